@@ -3,6 +3,7 @@
 import fiepipelib.localplatform.routines.localplatform
 import fiepipelib.localuser.routines.localuser
 import fiepipedesktoplib.shells.fiepipe
+from fiepipelib.git.routines.ssh import SSHMultiplexingSession
 
 
 def main():
@@ -10,7 +11,9 @@ def main():
     platform = fiepipelib.localplatform.routines.localplatform.get_local_platform_routines()
     localuser = fiepipelib.localuser.routines.localuser.LocalUserRoutines(platform)
     shell = fiepipedesktoplib.shells.fiepipe.Shell(localuser)
-    shell.cmdloop()
+    # git over ssh from the shell shares connections.  ControlMaster=auto makes the first one to a host the master.
+    with SSHMultiplexingSession():
+        shell.cmdloop()
 
 
 if __name__ == "__main__":
@@ -2,6 +2,7 @@ import abc
 import typing
 import os
 
+from fiepipelib.git.routines.lfs import LFSFetchProfile
 from fiepipelib.gitaspect.data.config import GitAspectConfiguration
 
 
@@ -13,6 +14,11 @@ class AssetAspectConfiguration(GitAspectConfiguration, abc.ABC):
         e.g. ['*.jpg','foo/**/bar.txt']"""
         raise NotImplementedError()
 
+    def get_lfs_fetch_profile(self) -> LFSFetchProfile:
+        """Returns the LFS fetch profile that hydrates this aspect's files.  By default, all the files matching
+        its lfs patterns.  Override to narrow it, e.g. to proxies only."""
+        return LFSFetchProfile(include=self.get_lfs_patterns())
+
     @abc.abstractmethod
     def get_git_ignores(self) -> typing.List[str]:
         """Returns a list of asset-wide ignores for git.
@@ -81,6 +81,16 @@ class AssetAspectConfigurationRoutines(GitAspectConfigurationRoutines[TA], typin
         await super(AssetAspectConfigurationRoutines, self).create_update_configuration_interactive_routine()
         self.update_git_meta()
 
+    async def hydrate_routine(self, feedback_ui: AbstractFeedbackUI):
+        """Downloads this aspect's LFS files, per its fetch profile, where the asset's own profile left them
+        out."""
+        configuration = self.get_configuration()
+        profile = configuration.get_lfs_fetch_profile()
+        if profile.is_full():
+            # no lfs patterns.  nothing of ours to hydrate.
+            return
+        await self.get_asset_routines().hydrate_routine(feedback_ui, profile)
+
     def update_git_meta(self):
         """Makes changes to the git meta-data system based
         on the configuration.  Such as ignores and lfs tracked files.
@@ -29,6 +29,10 @@ class AbstractSimpleApplicationInstallInteractiveRoutines(AbstractLocalManagedIn
         man = self.GetManager()
         return man.GetAll()
 
+    def IterAllItems(self) -> typing.Iterator[T]:
+        man = self.GetManager()
+        return man.IterGet()
+
     def ItemToName(self, item: T) -> str:
         return item.get_name()
 
@@ -1,35 +1,73 @@
 import hashlib
+import os
 import pathlib
 import sqlite3
+import time
+import typing
 
 from fiepipelib.gitstorage.data.locally_managed_types import abstractassetlocalmanager
 
+# bytes read at a time when hashing a dump.
+HASH_READ_SIZE = 1024 * 1024
+
+# prefixes hashes so hashes of another algorithm (older md5 records) never compare equal.
+HASH_PREFIX = "blake2b:"
+
+# a file modified this recently (nanoseconds) when we stat it could be modified again within the same mtime tick
+# without its stat changing.  Such a stat isn't trusted to stand in for the hash.
+RACY_SIGNATURE_WINDOW_NS = 2 * 1000 * 1000 * 1000
+
 
 class databasehash(object):
     _name = None
     _md5hash = None
+    _size: int = None
+    _mtime_ns: int = None
+    _inode: int = None
 
     def GetName(self):
         return self._name
 
-    def GetMD5(self):
+    def GetHash(self):
+        """The hash of the dump the db was last read from or written to.  See hashfile."""
         return self._md5hash
 
+    def GetMD5(self):
+        """Older name for GetHash.  Newer hashes aren't md5s."""
+        return self.GetHash()
+
+    def GetSignature(self) -> typing.Tuple[int, int, int]:
+        """(size, mtime_ns, inode) of the dump when it was hashed.  None if not known or not trusted."""
+        if self._size is None:
+            return None
+        return self._size, self._mtime_ns, self._inode
+
+    def MatchesFile(self, fname: str) -> bool:
+        """True if the file's stat is unchanged since it was hashed, so it needn't be hashed again."""
+        signature = self.GetSignature()
+        return signature is not None and signature == statfile(fname)
+
 
-def FromParams(name: str, md5: str):
+def FromParams(name: str, md5: str, signature: typing.Tuple[int, int, int] = None):
     """@param name: the name of the db
-    @param md5: the hex of the md5 hash e.g. md5.hexdigest()
+    @param md5: the hash of the dump.  See hashfile.
+    @param signature: the (size, mtime_ns, inode) of the dump when it was hashed.  See hashfile_with_signature.
     """
     ret = databasehash()
     ret._name = name
     ret._md5hash = md5
+    if signature is not None:
+        ret._size, ret._mtime_ns, ret._inode = signature
     return ret
 
 
 def ToJSON(dbh: databasehash):
     ret = {}
     ret["name"] = dbh.GetName()
-    ret["md5hash"] = dbh.GetMD5()
+    ret["md5hash"] = dbh.GetHash()
+    signature = dbh.GetSignature()
+    if signature is not None:
+        ret["size"], ret["mtime_ns"], ret["inode"] = signature
     return ret
 
 
@@ -37,6 +75,9 @@ def FromJSON(data: dict):
     ret = databasehash()
     ret._name = data['name']
     ret._md5hash = data['md5hash']
+    ret._size = data.get('size', None)
+    ret._mtime_ns = data.get('mtime_ns', None)
+    ret._inode = data.get('inode', None)
     return ret
 
 
@@ -48,6 +89,59 @@ def md5file(fname: str):
     return hash_md5.hexdigest()
 
 
+def newhasher():
+    """A streaming hasher for dumps.  Feed it with update() and finish with hasherdigest()."""
+    return hashlib.blake2b(digest_size=32)
+
+
+def hasherdigest(hasher) -> str:
+    return HASH_PREFIX + hasher.hexdigest()
+
+
+def hashfile(fname: str) -> str:
+    """Hashes a dump file.  BLAKE2b, read in large chunks."""
+    hasher = newhasher()
+    buffer = bytearray(HASH_READ_SIZE)
+    view = memoryview(buffer)
+    with open(fname, "rb", buffering=0) as f:
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            hasher.update(view[:read])
+    return hasherdigest(hasher)
+
+
+def statfile(fname: str) -> typing.Tuple[int, int, int]:
+    """(size, mtime_ns, inode) of the file.  None if it doesn't exist."""
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+def trustedsignature(signature: typing.Tuple[int, int, int]) -> typing.Tuple[int, int, int]:
+    """The signature if it can stand in for a hash later.  None if the file was modified too recently to tell a
+    later modification in the same mtime tick apart."""
+    if signature is None:
+        return None
+    if time.time_ns() - signature[1] < RACY_SIGNATURE_WINDOW_NS:
+        return None
+    return signature
+
+
+def hashfile_with_signature(fname: str) -> typing.Tuple[str, typing.Tuple[int, int, int]]:
+    """Hashes the file and returns the hash with the file's trusted signature.  The signature is None if the file
+    changed while we hashed it, or too recently."""
+    before = statfile(fname)
+    ret = hashfile(fname)
+    after = statfile(fname)
+    if before != after:
+        return ret, None
+    return ret, trustedsignature(after)
+
+
 class AssetDatabaseManager(abstractassetlocalmanager):
 
     def FromJSONData(self, data):
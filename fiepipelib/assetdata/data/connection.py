@@ -1,31 +1,227 @@
+import asyncio
+import os.path
 import sqlite3
+import threading
+import typing
+
 import fiepipelib.assetdata
-from fiepipelib.assetdata.data.assetdatabasemanager import AssetDatabaseManager
+import fiepipelib.assetdata.data.items
+from fiepipelib.assetdata.data.assetdatabasemanager import AssetDatabaseManager, statfile, trustedsignature
 from fiepipelib.gitstorage.data.git_working_asset import GitWorkingAsset
 
+# seconds a writer waits for its turn in this process's queue for an asset DB before raising.
+WRITER_QUEUE_TIMEOUT = 600.0
+
+
+class WriterQueue(object):
+    """Gives this process's writers to an asset DB their turns in the order they asked for them.  Without it,
+    they'd all poll sqlite's lock and the turn goes to whoever happens to poll at the right moment.  Writers in
+    other processes still just wait on sqlite's lock.
+
+    Threads wait their turn with acquire.  Coroutines wait with acquire_routine, which doesn't block the event
+    loop.  Asking again while already holding the turn would wait forever, so it raises instead.
+    """
+
+    _condition: threading.Condition = None
+    _next_ticket: int = 0
+    _serving: int = 0
+    _abandoned: typing.Set[int] = None
+    _waiters: typing.Dict[int, typing.Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = None
+    _owner_thread: int = None
+    _owner_task: asyncio.Task = None
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._abandoned = set()
+        self._waiters = {}
+
+    def _check_reentry(self, task: asyncio.Task):
+        # called with the condition held.
+        if self._owner_thread is None:
+            return
+        if task is not None and self._owner_task is task:
+            raise TransactionError("This task already holds the writer turn for the asset DB.")
+        if task is None and self._owner_thread == threading.get_ident():
+            raise TransactionError("This thread already holds the writer turn for the asset DB.")
+
+    def _take_turn(self, task: asyncio.Task):
+        # called with the condition held.
+        self._owner_thread = threading.get_ident()
+        self._owner_task = task
+
+    def _abandon(self, ticket: int):
+        # called with the condition held.  The writers behind us shouldn't wait for us.
+        self._waiters.pop(ticket, None)
+        if self._serving == ticket:
+            # we were given the turn just as we gave up on it.
+            self._release()
+        else:
+            self._abandoned.add(ticket)
+
+    def _release(self):
+        # called with the condition held.
+        self._owner_thread = None
+        self._owner_task = None
+        self._serving += 1
+        while self._serving in self._abandoned:
+            self._abandoned.remove(self._serving)
+            self._serving += 1
+        self._condition.notify_all()
+        waiter = self._waiters.pop(self._serving, None)
+        if waiter is not None:
+            loop, future = waiter
+            loop.call_soon_threadsafe(_wake_waiter, future)
+
+    def acquire(self, timeout: float = WRITER_QUEUE_TIMEOUT):
+        """Waits for our turn.  Raises TransactionError if it doesn't come within the timeout.
+
+        On a thread running an event loop, this never waits, since the writer we'd wait on may need the loop to
+        finish.  It raises TransactionError if it isn't our turn right away.  Use acquire_routine there instead.
+        """
+        on_loop = _get_running_loop() is not None
+        if on_loop:
+            timeout = 0
+        with self._condition:
+            self._check_reentry(None)
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            if not self._condition.wait_for(lambda: self._serving == ticket, timeout):
+                self._abandon(ticket)
+                if on_loop:
+                    raise TransactionError("Another writer has the asset DB.  Waiting here would block the event "
+                                           "loop.")
+                raise TransactionError("Timed out waiting for other writers to the asset DB.")
+            self._take_turn(None)
+
+    async def acquire_routine(self, timeout: float = WRITER_QUEUE_TIMEOUT):
+        """Waits for our turn without blocking the event loop.  Raises TransactionError if it doesn't come within
+        the timeout.  If cancelled, gives up its place in the queue."""
+        loop = asyncio.get_event_loop()
+        task = asyncio.current_task()
+        with self._condition:
+            self._check_reentry(task)
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            if self._serving == ticket:
+                self._take_turn(task)
+                return
+            future = loop.create_future()
+            self._waiters[ticket] = (loop, future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            with self._condition:
+                self._abandon(ticket)
+            raise TransactionError("Timed out waiting for other writers to the asset DB.")
+        except BaseException:
+            with self._condition:
+                self._abandon(ticket)
+            raise
+        with self._condition:
+            self._take_turn(task)
+
+    def release(self):
+        """Ends the current turn and starts the next."""
+        with self._condition:
+            self._release()
+
+
+def _wake_waiter(future: asyncio.Future):
+    # runs on the waiter's loop.  It may have timed out or been cancelled already.
+    if not future.done():
+        future.set_result(None)
+
+
+def _get_running_loop() -> typing.Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+_writer_queues: typing.Dict[str, WriterQueue] = {}
+_writer_queues_lock = threading.Lock()
+
+
+def GetWriterQueue(filename: str) -> WriterQueue:
+    """The process wide writer queue for the DB file at the given path."""
+    key = os.path.realpath(filename)
+    with _writer_queues_lock:
+        ret = _writer_queues.get(key, None)
+        if ret is None:
+            ret = WriterQueue()
+            _writer_queues[key] = ret
+        return ret
+
 
 class Connection(object):
     _conn = None
     _attachedmultidbs = None
     _readonly: bool = False
+    _queue: WriterQueue = None
 
-    def __init__(self, conn: sqlite3.Connection, readonly=False):
+    def __init__(self, conn: sqlite3.Connection, readonly=False, queue: WriterQueue = None, acquire=True):
         """
-        :param conn:
-        :param readonly: a readonly connection allows concurrency.  A non-readonly connection gets and exclusive lock
-        immediately
+        :param conn: a WAL mode connection.  Owned (and closed) by this object from now on.
+        :param readonly: a readonly connection reads a consistent snapshot of the DBs and doesn't lock them, so
+        it never waits on (or holds up) a writer.  A non-readonly connection gets an exclusive lock immediately
+        :param queue: the writer queue for the DB.  A non-readonly connection waits its turn first, and holds it
+        until closed.
+        :param acquire: False if the caller has already waited its turn in the queue (e.g. with
+        acquire_routine).  The turn is still released on close.
         """
         self._attachedmultidbs = []
         self._readonly = readonly
-        if not self._readonly:
+        self._conn = conn
+        if self._readonly:
+            # we begin and end the snapshot ourselves.
+            self._conn.isolation_level = None
+            return
+        if queue is not None and acquire:
+            queue.acquire()
+        try:
             # get exclusive lock immediately.
-            self._conn = conn
             self._conn.isolation_level = 'EXCLUSIVE'
             self._conn.execute('BEGIN EXCLUSIVE')
+        except:
+            if queue is not None:
+                queue.release()
+            raise
+        self._queue = queue
+
+    def IsReadOnly(self) -> bool:
+        return self._readonly
+
+    def _BeginSnapshot(self):
+        """Starts the readonly connection's read transaction, if it hasn't been, and reads from each DB so the
+        snapshot of each is taken now rather than at its first query.  Writes raise until it ends."""
+        if self._conn.in_transaction:
+            return
+        self._conn.execute("PRAGMA query_only = ON")
+        self._conn.execute("BEGIN DEFERRED")
+        self._conn.execute("SELECT count(*) FROM main.sqlite_master").fetchone()
+        for db in self._attachedmultidbs:
+            assert isinstance(db, fiepipelib.assetdata.data.items.AbstractItemsRelation)
+            self._conn.execute("SELECT count(*) FROM " + db.GetMultiManagedName() + ".sqlite_master").fetchone()
 
     def GetDBConnection(self) -> sqlite3.Connection:
+        """The sqlite connection.  On a readonly connection, this begins the snapshot if it hasn't been."""
+        if self._conn is None:
+            raise TransactionError("Connection already closed.")
+        if self._readonly:
+            self._BeginSnapshot()
+        return self._conn
+
+    def _GetAttachConnection(self) -> sqlite3.Connection:
+        """The sqlite connection, for bringing a multi DB up to date and attaching it.  That may mean re-reading
+        the local DB from its dump.  So a readonly connection ends its snapshot and allows writes until the next
+        GetDBConnection."""
         if self._conn is None:
             raise TransactionError("Connection already closed.")
+        if self._readonly:
+            if self._conn.in_transaction:
+                self._conn.rollback()
+            self._conn.execute("PRAGMA query_only = OFF")
         return self._conn
 
     def Commit(self):
@@ -36,26 +232,31 @@ class Connection(object):
         # first we commit everything
         self._conn.commit()
         # then we walk through each multi db that has been attached.
+        hashes = []
         for db in self._attachedmultidbs:
-            assert isinstance(db, fiepipelib.assetdata.abstractassetdata.abstractmultimanager)
-            # open it and dump it
-            db._dumpTo(db._GetDBDumpFilename())
+            assert isinstance(db, fiepipelib.assetdata.data.items.AbstractItemsRelation)
+            # open it and dump the tables written to.  the dump is hashed as it's written, so we don't read it back.
+            # only if the dump is still the one we attached to.  Otherwise it's regenerated whole.
+            dirty = db._GetDirtyTables()
+            hash = db._dumpTo(db._GetDBDumpFilename(), dirty, db._GetDumpHash())
+            db._ClearDirtyTables(dirty)
+            if hash is not None:
+                db._SetDumpHash(hash)
+                hashes.append((db, hash))
 
         # we do a loop again because the dump is critical and want that to complete first.
         # A failed hash db update will just result in an extraneous read of the dump and hash db update the
         # next time we read.  Which is not optimal. But isn't a failure.
-        for db in self._attachedmultidbs:
-            assert isinstance(db, fiepipelib.assetdata.abstractassetdata.abstractmultimanager)
-            # get the hash
-            hash = db._GetHashOfDump()
+        for db, hash in hashes:
+            # just written, so the signature usually isn't trusted yet.  The next attach hashes once and records it.
+            signature = trustedsignature(statfile(db._GetDBDumpFilename()))
             # update the dbhashes table
-            db._WriteHashToDB(hash, self._conn)
+            db._WriteHashToDB(hash, self._conn, signature)
         # commit again to commit the updated hashes.
         self._conn.commit()
 
     def Rollback(self):
-        if self._readonly:
-            raise TransactionError("This connection is readonly.")
+        """On a readonly connection, ends the snapshot.  The next GetDBConnection sees the DBs as of then."""
         if self._conn is None:
             raise TransactionError("Connection already closed.")
         self._conn.rollback()
@@ -63,8 +264,13 @@ class Connection(object):
     def Close(self):
         if self._conn == None:
             raise TransactionError("Connection already closed.")
-        self._conn.close()
-        self._conn = None
+        try:
+            self._conn.close()
+        finally:
+            self._conn = None
+            if self._queue is not None:
+                self._queue.release()
+                self._queue = None
 
     def __del__(self):
         if self._conn != None:
@@ -76,6 +282,38 @@ class TransactionError(Exception):
 
 
 def GetConnection(workingAsset: GitWorkingAsset, readonly: bool = False) -> Connection:
+    """A new connection to the asset's data.  Use readonly wherever you don't write.  e.g. farm tasks reading
+    versions.  Readers don't wait on writers (other than to re-read a local DB whose dump changed) and writers
+    don't wait on readers.  Writers wait on each other.
+
+    From a coroutine, use GetConnectionRoutine, which waits its turn as a writer without blocking the event loop.
+    Here, a writer on an event loop's thread raises TransactionError rather than wait."""
+    man = AssetDatabaseManager(workingAsset)
+    conn = man.OpenDBConnection()
+    try:
+        if readonly:
+            return Connection(conn, True)
+        return Connection(conn, False, GetWriterQueue(man._GetDBFilename()))
+    except:
+        conn.close()
+        raise
+
+
+async def GetConnectionRoutine(workingAsset: GitWorkingAsset, readonly: bool = False) -> Connection:
+    """GetConnection for coroutines.  A writer waits its turn behind this process's other writers without
+    blocking the event loop."""
+    if readonly:
+        return GetConnection(workingAsset, True)
     man = AssetDatabaseManager(workingAsset)
-    ret = Connection(man.GetDBConnection(), readonly)
-    return ret
\ No newline at end of file
+    queue = GetWriterQueue(man._GetDBFilename())
+    await queue.acquire_routine()
+    try:
+        conn = man.OpenDBConnection()
+    except:
+        queue.release()
+        raise
+    try:
+        return Connection(conn, False, queue, acquire=False)
+    except:
+        conn.close()
+        raise
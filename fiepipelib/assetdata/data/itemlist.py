@@ -74,7 +74,7 @@ class AbstractItemListEntry(AbstractLink):
 class AbstractItemListEntryManager(AbstractLinkTableManager):
 
     def ClearList(self, lst:AbstractItemList, conn: fiepipelib.assetdata.data.connection.Connection):
-        self.DeleteByFirst(list, conn)
+        self.DeleteByFirst(lst, conn)
 
     def RemoveFromLists(self, item, conn: fiepipelib.assetdata.data.connection.Connection):
         self.DeleteBySecond(item, conn)
\ No newline at end of file
@@ -2,11 +2,113 @@ import sqlite3
 import fiepipelib.assetdata.data.assetdatabasemanager
 import fiepipelib.assetdata.data.connection
 import fiepipelib.gitstorage.data.git_working_asset
+import fiepipelib.locallymanagedtypes.data.abstractmanager
 import os.path
 import pathlib
 import abc
 import fiepipelib.assetdata.data.items
+import io
 import json
+import math
+import typing
+
+# the first line of a dump in the per table format.  Older dumps are whole database iterdumps.
+DUMP_FORMAT_HEADER = "-- fiepipe asset db dump v2"
+
+# lines bracketing each table's section of a dump.
+DUMP_TABLE_START = "-- table: "
+DUMP_TABLE_END = "-- end table: "
+
+
+def _sql_literal(value) -> str:
+    """A deterministic sql literal for a value.  Newlines are written as char() calls so every row stays on one
+    line of the dump.  So are NULs, which can't be in a script at all."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        if math.isnan(value):
+            # sqlite stores NaN as NULL anyway.
+            return "NULL"
+        if math.isinf(value):
+            return "1e999" if value > 0 else "-1e999"
+        return repr(value)
+    if isinstance(value, bytes):
+        return "X'" + value.hex().upper() + "'"
+    text = str(value)
+    if "\n" not in text and "\r" not in text and "\0" not in text:
+        return "'" + text.replace("'", "''") + "'"
+    parts = []
+    current = ""
+    for c in text:
+        if c == "\n" or c == "\r" or c == "\0":
+            if len(current) != 0:
+                parts.append("'" + current.replace("'", "''") + "'")
+                current = ""
+            parts.append("char(" + str(ord(c)) + ")")
+        else:
+            current += c
+    if len(current) != 0:
+        parts.append("'" + current.replace("'", "''") + "'")
+    return "(" + "||".join(parts) + ")"
+
+
+def _dump_table(conn: sqlite3.Connection, name: str) -> str:
+    """One table's section of a dump.  Its schema, then its rows in primary key order, so unchanged rows stay
+    put and git diffs (and merges) are only as big as the change."""
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone()[0]
+    info = conn.execute('PRAGMA table_info("' + name + '")').fetchall()
+    columns = ['"' + row[1] + '"' for row in info]
+    # table_info's pk field is the column's position in the primary key.  0 if not in it.
+    primary = ['"' + row[1] + '"' for row in sorted(info, key=lambda r: r[5]) if row[5] > 0]
+    order = ", ".join(primary) if len(primary) != 0 else "rowid"
+    lines = [DUMP_TABLE_START + name, sql + ";"]
+    prefix = 'INSERT INTO "' + name + '" VALUES('
+    cur = conn.execute("SELECT " + ", ".join(columns) + ' FROM "' + name + '" ORDER BY ' + order)
+    for row in cur:
+        lines.append(prefix + ",".join([_sql_literal(value) for value in row]) + ");")
+    lines.append(DUMP_TABLE_END + name)
+    return "\n".join(lines) + "\n"
+
+
+def _read_dump_sections(path: str, expected_hash: str = None) -> typing.Dict[str, str]:
+    """Splits a per table dump into its tables' sections.  None if there's no dump, it's in the older format, or
+    it doesn't have the expected hash.
+
+    @param expected_hash: the hash the dump should have.  See hashfile.  None to not check.
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as f:
+        data = f.read()
+    if expected_hash is not None:
+        hasher = fiepipelib.assetdata.data.assetdatabasemanager.newhasher()
+        hasher.update(data)
+        if fiepipelib.assetdata.data.assetdatabasemanager.hasherdigest(hasher) != expected_hash:
+            return None
+    ret = {}
+    with io.StringIO(data.decode('utf-8'), newline=None) as f:
+        if f.readline().rstrip("\n") != DUMP_FORMAT_HEADER:
+            return None
+        name = None
+        lines = []
+        for line in f:
+            if name is None:
+                if line.startswith(DUMP_TABLE_START):
+                    name = line[len(DUMP_TABLE_START):].rstrip("\n")
+                    lines = [line]
+                continue
+            lines.append(line)
+            if line.rstrip("\n") == DUMP_TABLE_END + name:
+                ret[name] = "".join(lines)
+                name = None
+    if name is not None:
+        # truncated.  we can't trust any of it.
+        return None
+    return ret
 
 
 class AbstractItemsRelation(object):
@@ -22,8 +124,11 @@ class AbstractItemsRelation(object):
     
     _dataManagers = None    
     _workingAsset = None
+    _dirtyTables = None
+    _dumpHash = None
 
     def __init__(self, workingAsset: fiepipelib.gitstorage.data.git_working_asset.GitWorkingAsset, dataManagers = []):
+        self._dirtyTables = set()
         self._dataManagers = dataManagers.copy()
         for dm in dataManagers:
             assert isinstance(dm, AbstractItemManager)
@@ -78,17 +183,27 @@ class AbstractItemsRelation(object):
     def _GetHashOfDump(self):
         fname = self._GetDBDumpFilename()
         path = pathlib.Path(fname)
-        dumphash = fiepipelib.assetdata.data.assetdatabasemanager.md5file(str(path.absolute()))
+        dumphash = fiepipelib.assetdata.data.assetdatabasemanager.hashfile(str(path.absolute()))
         return dumphash
+
+    def _GetHashAndSignatureOfDump(self):
+        """The hash of the dump and its trusted (size, mtime_ns, inode) signature, which may be None."""
+        fname = self._GetDBDumpFilename()
+        path = pathlib.Path(fname)
+        return fiepipelib.assetdata.data.assetdatabasemanager.hashfile_with_signature(str(path.absolute()))
     
-    def _WriteHashToDB(self, hash, conn:sqlite3.Connection):
-        h = fiepipelib.assetdata.data.assetdatabasemanager.FromParams(self._GetDBFilename(), hash)
+    def _WriteHashToDB(self, hash, conn:sqlite3.Connection, signature = None):
+        """@param signature: the dump's (size, mtime_ns, inode) when hashed, so the next attach can skip hashing
+        if it's unchanged.  None to always hash next time."""
+        h = fiepipelib.assetdata.data.assetdatabasemanager.FromParams(self._GetDBFilename(), hash, signature)
         man = fiepipelib.assetdata.data.assetdatabasemanager.AssetDatabaseManager(self._workingAsset)
         man.Set([h],conn)
     
-    def _UpToDateAttach(self, connection:sqlite3.Connection = None):
+    def _UpToDateAttach(self, connection:sqlite3.Connection = None, readonly = False):
         """Given a connection to the asset's dbhahses DB, we make sure
         the local database is up to date and attach to it.
+
+        @param readonly: skip writes that are only optimizations, so a reader doesn't wait on a writer for them.
         """
         #TODO: Big question.
         #Is it even worth doing all these checks?  Shouldn't we just read each time we connect
@@ -104,22 +219,24 @@ class AbstractItemsRelation(object):
             #nothing exists.  So, it's technically fine.
             #we create an empty one then attach.
             self._Connect().close()
+            self._dumpHash = None
             self._Attach(connection)
             return
         
         if (self._DumpExists()) & (not self._DBExists()):
             #dump exists but no db.  So we read it and enter it.
+            hashofdump, signature = self._GetHashAndSignatureOfDump()
             self._readFrom(self._GetDBDumpFilename())
-            hashofdump = self._GetHashOfDump()
-            self._WriteHashToDB(hashofdump,connection)
+            self._WriteHashToDB(hashofdump,connection,signature)
+            self._dumpHash = hashofdump
             self._Attach(connection)
             return
         
         if (not self._DumpExists()) & (self._DBExists()):
             #we have a db but no dump.  shouldn't happen.  But if it does, we dump and enter it.
-            self._dumpTo(self._GetDBDumpFilename())
-            hash = self._GetHashOfDump()
+            hash = self._dumpTo(self._GetDBDumpFilename())
             self._WriteHashToDB(hash,connection)
+            self._dumpHash = hash
             self._Attach(connection)
             return
 
@@ -136,9 +253,10 @@ class AbstractItemsRelation(object):
             #no existing record but there is a file.  No way to know if its okay.  Abundance of caution.  We delete and read.
             #probably this should never happen.  But it is at least easy fast logic.
             self._deleteDB()
-            hashofdump = self._GetHashOfDump()
+            hashofdump, signature = self._GetHashAndSignatureOfDump()
             self._readFrom(self._GetDBDumpFilename())
-            self._WriteHashToDB(hashofdump,connection)
+            self._WriteHashToDB(hashofdump,connection,signature)
+            self._dumpHash = hashofdump
             self._Attach(connection)
             return
 
@@ -147,11 +265,21 @@ class AbstractItemsRelation(object):
         dbhash = dbhashes[0]
         assert isinstance(dbhash, fiepipelib.assetdata.data.assetdatabasemanager.databasehash)
 
-        #finally, we md5 the dump file (slow) and check equality with the dbhash.
-        hashofdump = self._GetHashOfDump()
+        #if the dump's size, mtime and inode haven't changed since it was hashed, neither has the dump.
+        if dbhash.MatchesFile(self._GetDBDumpFilename()):
+            self._dumpHash = dbhash.GetHash()
+            self._Attach(connection)
+            return
+
+        #finally, we hash the dump file (slow) and check equality with the dbhash.
+        hashofdump, signature = self._GetHashAndSignatureOfDump()
         
-        if dbhash.GetMD5() == hashofdump:
+        if dbhash.GetHash() == hashofdump:
             #it's up to date.  We're fine.
+            if signature is not None and not readonly:
+                #touched but not changed, or we couldn't trust the stat last time.  Next time we won't hash.
+                self._WriteHashToDB(hashofdump,connection,signature)
+            self._dumpHash = hashofdump
             self._Attach(connection)
             return
         else:
@@ -163,14 +291,18 @@ class AbstractItemsRelation(object):
             #need to test this.  Need to create a path toward resolution here.  A re-merge capability maybe?
             self._deleteDB()
             self._readFrom(self._GetDBDumpFilename())
-            self._WriteHashToDB(hashofdump,connection)
+            self._WriteHashToDB(hashofdump,connection,signature)
+            self._dumpHash = hashofdump
             self._Attach(connection)
             return
 
     
     def _Connect(self):
-        """Retruns a connection to the db.  No checks."""
-        ret = sqlite3.connect(self._GetDBFilename())
+        """Retruns a connection to the db.  No checks.  The db is put in WAL mode, so readonly connections
+        attached to it don't wait on writers."""
+        timeout = fiepipelib.locallymanagedtypes.data.abstractmanager.DB_BUSY_TIMEOUT
+        ret = sqlite3.connect(self._GetDBFilename(), timeout=timeout)
+        ret.execute("PRAGMA journal_mode=WAL")
         return ret
         
     def _Attach(self, conn:sqlite3.Connection):
@@ -182,8 +314,8 @@ class AbstractItemsRelation(object):
     def AttachToConnection(self, connection: fiepipelib.assetdata.data.connection.Connection):
         """Makes sure the local DB is up to date and attaches it to the connection.
         """
-        conn = connection.GetDBConnection()
-        self._UpToDateAttach(conn)
+        conn = connection._GetAttachConnection()
+        self._UpToDateAttach(conn, connection.IsReadOnly())
         self._CreateTables(conn.cursor())
         connection._attachedmultidbs.append(self)
     
@@ -191,47 +323,96 @@ class AbstractItemsRelation(object):
         for m in self._dataManagers:
             assert isinstance(m, AbstractItemManager)
             m._CreateTable(cur)
+            m._CreateIndexes(cur)
+
+    def _MarkTableDirty(self, name: str):
+        """Notes that a table was written to, so its section of the dump is regenerated on commit."""
+        self._dirtyTables.add(name)
+
+    def _GetDirtyTables(self) -> typing.Set[str]:
+        return self._dirtyTables.copy()
+
+    def _ClearDirtyTables(self, names: typing.Set[str]):
+        self._dirtyTables.difference_update(names)
+
+    def _GetDumpHash(self) -> str:
+        """The hash of the dump as of attach, or as of our last dump since.  None if not known."""
+        return self._dumpHash
+
+    def _SetDumpHash(self, hash: str):
+        self._dumpHash = hash
 
-    def _dumpTo(self, path):
-        #TODO implement this as a transaction which can be rolled back or forward (resolved).
+    def _dumpTo(self, path, tables: typing.Set[str] = None, expected_hash: str = None):
+        """Writes the dump in the per table format and returns its hash, taken as it's written rather than by
+        reading it back.
+
+        Tables are written in name order, and each table's rows in primary key order.  Indexes aren't written.
+        They're local and recreated on attach.
+
+        @param tables: the tables to regenerate.  The other tables' sections are copied from the existing dump.
+        Tables missing from the existing dump are always generated.  None to regenerate everything.
+        @param expected_hash: the hash the existing dump had when the local DB was last in step with it.  The
+        existing dump is only copied from if it still has this hash.  Otherwise it changed underneath us (e.g. a
+        pull) and everything is regenerated, rather than splicing our tables into someone else's.
+        @return: the hash.  None if there was nothing to regenerate and the existing dump was left alone.
+        """
         p = pathlib.Path(path)
+        existing = None
+        if tables is not None and expected_hash is not None:
+            existing = _read_dump_sections(str(p.absolute()), expected_hash)
         conn = self._Connect()
-        
-        with open(str(p.absolute()), 'w') as f:
-            for line in conn.iterdump():
-                f.write('%s\n' % line)        
-        conn.close()
-        #cur = conn.cursor()
-        #assert isinstance(cur, sqlite3.Cursor)
-        #statement = ".output " + str(p.absolute())
-        #cur.execute(statement)
-        #statement = ".dump"
-        #cur.execute(statement)
-        #cur.close()
-        #conn.close()
+        try:
+            names = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+            if existing is not None and set(names) == set(existing.keys()) and len(tables.intersection(names)) == 0:
+                return None
+            sections = []
+            for name in names:
+                if existing is not None and name in existing and name not in tables:
+                    sections.append(existing[name])
+                else:
+                    sections.append(_dump_table(conn, name))
+        finally:
+            conn.close()
+
+        data = (DUMP_FORMAT_HEADER + "\n" + "".join(sections)).encode('utf-8')
+        hasher = fiepipelib.assetdata.data.assetdatabasemanager.newhasher()
+        hasher.update(data)
+        # written beside and moved over, so git (or a reader) never sees half a dump.
+        temppath = str(p.absolute()) + ".tmp"
+        with open(temppath, 'wb') as f:
+            f.write(data)
+        os.replace(temppath, str(p.absolute()))
+        return fiepipelib.assetdata.data.assetdatabasemanager.hasherdigest(hasher)
 
     def _readFrom(self, path):
-        #TODO implment resolution (rollback or forward here.)
+        """Loads a dump into the local DB with a single script, in a single transaction.  Reads both the per table
+        format and older whole database iterdumps."""
+        p = pathlib.Path(path)
+        # no newline translation.  Older iterdumps have raw CRs in their values.
+        with open(str(p.absolute()), 'r', encoding='utf-8', newline='') as f:
+            script = f.read()
         conn = self._Connect()
         assert  isinstance(conn, sqlite3.Connection)
-        p = pathlib.Path(path)
-        
-        with open(str(p.absolute()), 'r') as f:
-            for line in f:
-                conn.execute(line)        
-        conn.close()
-        
-        #cur = conn.cursor()
-        #assert isinstance(cur, sqlite3.Cursor)
-        #statement = ".read " + str(p.absolute())
-        #cur.execute(statement)
-        #cur.close()
-        #conn.close()
+        try:
+            if script.startswith(DUMP_FORMAT_HEADER):
+                conn.executescript("BEGIN;\n" + script + "\nCOMMIT;")
+            else:
+                # iterdumps bring their own BEGIN TRANSACTION and COMMIT.
+                conn.executescript(script)
+        finally:
+            # if the script failed part way, closing rolls it back.
+            conn.close()
         
     def _deleteDB(self):
         path = pathlib.Path(self._GetDBFilename())
         if path.exists() & path.is_file():
             path.unlink()
+        # a stale write ahead log must not be applied to the db that's read in next.
+        for suffix in ["-wal", "-shm"]:
+            sidecar = pathlib.Path(self._GetDBFilename() + suffix)
+            if sidecar.exists() & sidecar.is_file():
+                sidecar.unlink()
 
 class AbstractItemManager(object):
     
@@ -290,7 +471,23 @@ class AbstractItemManager(object):
         statement = statement + colstring + ", PRIMARY KEY (" + primstring + ") )"
 
         cur.execute( statement )
-        #TODO: add indexes here
+
+    def GetIndexes(self) -> typing.List[typing.List[str]]:
+        """Override this and call super to add indexes: Returns a list of indexes for the columns lookups search
+        on.  Each index is a list of column names.  None by default.
+
+        Indexes that lead the primary key are skipped, as sqlite already has one.  Indexes are local.  They're
+        created when the DB is attached and never written to the dump.
+        """
+        return []
+
+    def _CreateIndexes(self, cur):
+        """Creates any declared indexes that don't yet exist.  Safe to run against existing databases, which is
+        how databases read from dumps (which have no indexes) get them."""
+        indexes = fiepipelib.locallymanagedtypes.data.abstractmanager.GetUncoveredIndexes(
+            self.GetIndexes(), self.GetPrimaryKeyColumns())
+        fiepipelib.locallymanagedtypes.data.abstractmanager.CreateIndexes(
+            cur, self.GetManagedTypeName(), indexes, self.GetMultiManager().GetMultiManagedName())
 
     def _CreateUpdateRows(self, data, conn:sqlite3.Connection):
         """Uses the REPLACE statement to insert or update a row regardless of if it exsits or not.
@@ -312,6 +509,11 @@ class AbstractItemManager(object):
             statement = statement + ", ".join(names) + ") VALUES (" + " ,".join(qmarks) + ")"
             cur = conn.cursor()
             cur.executemany(statement,values)
+            self._MarkDirty()
+
+    def _MarkDirty(self):
+        """Call after writing to the table, so it's regenerated in the dump on commit."""
+        self.GetMultiManager()._MarkTableDirty(self.GetManagedTypeName())
 
     def _DeleteRowsByMultipleAND(self, conn:sqlite3.Connection, colNamesAndValues = []):
         """Runs a delete statement to search for and delete rows matching all passed column and value tupples with AND logic.
@@ -328,6 +530,8 @@ class AbstractItemManager(object):
                 values.append(str(i[1]))
             statement = statement + " AND ".join(clauses) 
         cur.execute(statement,values)
+        if cur.rowcount != 0:
+            self._MarkDirty()
 
     def _GetRowsByMultipleAND(self, cur:sqlite3.Cursor, colNamesAndValues = []):
         """Selects and returns rows based on the given search criteria.
@@ -1,9 +1,13 @@
 import abc
+import sqlite3
 import typing
 
 import fiepipelib.assetdata
 from fiepipelib.assetdata.data.items import AbstractItemManager
 
+# the most values bound in one IN (...) query.  Well under sqlite's host parameter limit.
+IN_BATCH_SIZE = 500
+
 
 class AbstractLink(object):
     _linkManager = None
@@ -24,7 +28,7 @@ class AbstractLink(object):
         keyCols = self._linkManager._firstManager.GetPrimaryKeyColumns()
         colsAndVal = []
         for key in keyCols:
-            colsAndVal[key] = data[key]
+            colsAndVal.append((key, data[key]))
         self._firstColsAndValues = colsAndVal
 
     def _setSecond(self, item):
@@ -32,7 +36,7 @@ class AbstractLink(object):
         keyCols = self._linkManager._secondManager.GetPrimaryKeyColumns()
         colsAndVal = []
         for key in keyCols:
-            colsAndVal[key] = data[key]
+            colsAndVal.append((key, data[key]))
         self._secondColsAndValues = colsAndVal
 
 
@@ -52,7 +56,15 @@ class AbstractLinkTableManager(AbstractItemManager):
         for fk in firstKeys:
             ret.append("first_" + fk)
         for sk in secondKeys:
-            ret.append("second_" + fk)
+            ret.append("second_" + sk)
+        return ret
+
+    def GetIndexes(self):
+        """Lookups by first and by second.  The primary key leads with the first_ columns, so only the second_
+        columns get an index of their own."""
+        ret = super().GetIndexes()
+        ret.append(["first_" + fk for fk in self._firstManager.GetPrimaryKeyColumns()])
+        ret.append(["second_" + sk for sk in self._secondManager.GetPrimaryKeyColumns()])
         return ret
 
     def GetColumns(self):
@@ -80,12 +92,12 @@ class AbstractLinkTableManager(AbstractItemManager):
         firstQuery = []
         secondQuery = []
         for fk in firstKeys:
-            firstQuery.append(fk, data["first_" + fk])
+            firstQuery.append((fk, data["first_" + fk]))
         for sk in secondKeys:
-            secondQuery.append(sk, data["second_" + sk])
-        l = self.NewAbstractLink()
+            secondQuery.append((sk, data["second_" + sk]))
+        l = self.NewLink()
         l._firstColsAndValues = firstQuery
-        l._secondColsAndVAlues = secondQuery
+        l._secondColsAndValues = secondQuery
         return l
 
     @abc.abstractmethod
@@ -102,13 +114,11 @@ class AbstractLinkTableManager(AbstractItemManager):
 
     def ToJSONData(self, item: AbstractLink):
         """Call the super() to fill AbstractLink fields first"""
-        ret = []
-        firstKeys = self._firstManager.GetPrimaryKeyColumns()
-        secondKeys = self._secondManager.GetPrimaryKeyColumns()
-        for fk in firstKeys:
-            ret["first_" + fk] = item._firstColsAndValues[fk]
-        for sk in secondKeys:
-            ret["second_" + sk] = item._secondColsAndValues[sk]
+        ret = {}
+        for fk, value in item._firstColsAndValues:
+            ret["first_" + fk] = value
+        for sk, value in item._secondColsAndValues:
+            ret["second_" + sk] = value
         return ret
 
     def GetByFirst(self, item, conn: fiepipelib.assetdata.data.connection.Connection):
@@ -116,25 +126,72 @@ class AbstractLinkTableManager(AbstractItemManager):
         data = self._firstManager.ToJSONData(item)
         colsAndVals = []
         for fk in firstKeys:
-            colsAndVals["first_" + fk] = data[fk]
-        return self._Get(conn.GetDBConnection, colsAndVals)
+            colsAndVals.append(("first_" + fk, data[fk]))
+        return self._Get(conn.GetDBConnection(), colsAndVals)
 
     def GetBySecond(self, item, conn: fiepipelib.assetdata.data.connection.Connection):
         secondKeys = self._secondManager.GetPrimaryKeyColumns()
         data = self._secondManager.ToJSONData(item)
         colsAndVals = []
         for sk in secondKeys:
-            colsAndVals["second_" + sk] = data[sk]
-        return self._Get(conn.GetDBConnection, colsAndVals)
+            colsAndVals.append(("second_" + sk, data[sk]))
+        return self._Get(conn.GetDBConnection(), colsAndVals)
+
+    def _GetByKeysMany(self, prefix: str, manager: AbstractItemManager, items,
+                       conn: fiepipelib.assetdata.data.connection.Connection) -> typing.List[AbstractLink]:
+        """Gets the links whose prefixed key columns match the keys of any of the given items, a batch of keys
+        per query."""
+        keys = manager.GetPrimaryKeyColumns()
+        cols = [prefix + k for k in keys]
+        keyValues = []
+        seen = set()
+        for item in items:
+            data = manager.ToJSONData(item)
+            # stored as strings.  see _ItemsToInsertData.
+            keyValue = tuple([str(data[k]) for k in keys])
+            if keyValue not in seen:
+                seen.add(keyValue)
+                keyValues.append(keyValue)
+
+        dbconn = conn.GetDBConnection()
+        dbconn.row_factory = sqlite3.Row
+        cur = dbconn.cursor()
+        table = self.GetMultiManager().GetMultiManagedName() + "." + self.GetManagedTypeName()
+        if len(cols) == 1:
+            target = cols[0]
+            placeholder = "?"
+        else:
+            target = "(" + ", ".join(cols) + ")"
+            placeholder = "(" + ", ".join(["?"] * len(cols)) + ")"
+        batchSize = max(1, IN_BATCH_SIZE // len(cols))
+        ret = []
+        for i in range(0, len(keyValues), batchSize):
+            batch = keyValues[i:i + batchSize]
+            if len(cols) == 1:
+                inList = "(" + ", ".join([placeholder] * len(batch)) + ")"
+            else:
+                inList = "(VALUES " + ", ".join([placeholder] * len(batch)) + ")"
+            statement = "SELECT * FROM " + table + " WHERE " + target + " IN " + inList
+            values = [value for keyValue in batch for value in keyValue]
+            cur.execute(statement, values)
+            for row in cur.fetchall():
+                ret.append(self._ItemFromRow(row))
+        return ret
+
+    def GetByFirstMany(self, items, conn: fiepipelib.assetdata.data.connection.Connection) -> typing.List[AbstractLink]:
+        """Gets the links to any of the given first items.  Much faster than calling GetByFirst for each."""
+        return self._GetByKeysMany("first_", self._firstManager, items, conn)
+
+    def GetBySecondMany(self, items, conn: fiepipelib.assetdata.data.connection.Connection) -> typing.List[AbstractLink]:
+        """Gets the links to any of the given second items.  Much faster than calling GetBySecond for each."""
+        return self._GetByKeysMany("second_", self._secondManager, items, conn)
 
     def Delete(self, link: AbstractLink, conn: fiepipelib.assetdata.data.connection.Connection):
-        firstKeys = self._firstManager.GetPrimaryKeyColumns()
-        secondKeys = self._secondManager.GetPrimaryKeyColumns()
         colsAndVals = []
-        for fk in firstKeys:
-            colsAndVals["first_" + fk] = link._firstColsAndValues[fk]
-        for sk in secondKeys:
-            colsAndVals["second_" + sk] = link._secondColsAndValues[sk]
+        for fk, value in link._firstColsAndValues:
+            colsAndVals.append(("first_" + fk, value))
+        for sk, value in link._secondColsAndValues:
+            colsAndVals.append(("second_" + sk, value))
         self._DeleteByMultipleAND(conn.GetDBConnection(), colsAndVals)
 
     def DeleteByFirst(self, item, conn: fiepipelib.assetdata.data.connection.Connection):
@@ -142,7 +199,7 @@ class AbstractLinkTableManager(AbstractItemManager):
         data = self._firstManager.ToJSONData(item)
         colsAndVals = []
         for fk in firstKeys:
-            colsAndVals["first_" + fk] = data[fk]
+            colsAndVals.append(("first_" + fk, data[fk]))
         self._DeleteByMultipleAND(conn.GetDBConnection(), colsAndVals)
 
     def DeleteBySecond(self, item, conn: fiepipelib.assetdata.data.connection.Connection):
@@ -150,21 +207,31 @@ class AbstractLinkTableManager(AbstractItemManager):
         data = self._secondManager.ToJSONData(item)
         colsAndVals = []
         for sk in secondKeys:
-            colsAndVals["second_" + sk] = data[sk]
+            colsAndVals.append(("second_" + sk, data[sk]))
         self._DeleteByMultipleAND(conn.GetDBConnection(), colsAndVals)
 
-    def CullMissing(self, conn: fiepipelib.assetdata.data.connection.Connection):
+    def _MissingClause(self, prefix: str, manager: AbstractItemManager, alias: str) -> str:
+        """A NOT EXISTS clause that's true for a link row whose prefixed keys match no row in the manager's
+        table."""
+        table = manager.GetMultiManager().GetMultiManagedName() + "." + manager.GetManagedTypeName()
+        matches = []
+        for k in manager.GetPrimaryKeyColumns():
+            matches.append(alias + "." + k + " = " + self.GetManagedTypeName() + "." + prefix + k)
+        return "NOT EXISTS (SELECT 1 FROM " + table + " AS " + alias + " WHERE " + " AND ".join(matches) + ")"
+
+    def CullMissing(self, conn: fiepipelib.assetdata.data.connection.Connection) -> int:
         """Culls entries that point to nothing.  A maintnance function. Shouldn't be
         called regularly.
+
+        One DELETE, anti-joined against the first and second tables' primary keys.  No rows are decoded.
+
+        @return: the number of links culled.
         """
-        # probably could do this better.  we're getting first and second too often. [shrug]
-        allLinks = self.GetAll(conn)
-        toDelete = []
-        for link in allLinks:
-            assert isinstance(link, AbstractLink)
-            if len(link.GetFirst(conn)) == 0:
-                toDelete.append(link)
-            elif len(link.GetSecond(conn)) == 0:
-                toDelete.append(link)
-        for link in toDelete:
-            self.Delete(link, conn)
+        statement = "DELETE FROM " + self.GetMultiManager().GetMultiManagedName() + "." + self.GetManagedTypeName() + \
+                    " WHERE " + self._MissingClause("first_", self._firstManager, "f") + \
+                    " OR " + self._MissingClause("second_", self._secondManager, "s")
+        cur = conn.GetDBConnection().cursor()
+        cur.execute(statement)
+        if cur.rowcount != 0:
+            self._MarkDirty()
+        return cur.rowcount
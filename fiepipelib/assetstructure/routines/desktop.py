@@ -8,6 +8,7 @@ from fiepipelib.assetstructure.routines.structure import AbstractAssetBasePath,
 from fiepipelib.automanager.data.localconfig import LegalEntityConfig, LegalEntityMode
 from fiepipelib.container.local_config.data.automanager import ContainerAutomanagerConfigurationComponent
 from fiepipelib.enum import get_worse_enum
+from fiepipelib.git.routines.repo import get_repo
 from fieui.FeedbackUI import AbstractFeedbackUI
 
 
@@ -55,6 +56,9 @@ class AbstractDesktopProjectRootBasePath(AbstractRootBasePath[BT], typing.Generi
                     create_status = get_worse_enum(create_status, subpath_ret)
                     # catch a failure.
 
+            # creation may have changed the worktree.
+            self.invalidate_status()
+
             if create_status == AutoCreateResults.CANNOT_COMPLETE:
                 await feedback_ui.output(
                     "Canceling further auto-management of this storage root due to a subpath failing to create.")
@@ -72,6 +76,8 @@ class AbstractDesktopProjectRootBasePath(AbstractRootBasePath[BT], typing.Generi
             index_dirty = self.is_dirty(True, False, False, False)
             if index_dirty:
                 self.get_routines().get_repo().index.commit("Auto-manager commit of changed structure.")
+                self.invalidate_status()
+                self.invalidate_sync_status()
 
             # we move into our child logic.
 
@@ -255,6 +261,9 @@ class AbstractDesktopProjectAssetBasePath(AbstractAssetBasePath[BDT], typing.Gen
                     create_status = get_worse_enum(create_status, subpath_ret)
                     # catch a failure.
 
+            # creation may have changed the worktree.
+            self.invalidate_status()
+
             if create_status == AutoCreateResults.CANNOT_COMPLETE:
                 await feedback_ui.output(
                     "Canceling further auto-management of this storage asset due to a subpath failing to create.")
@@ -274,6 +283,8 @@ class AbstractDesktopProjectAssetBasePath(AbstractAssetBasePath[BDT], typing.Gen
                         repo = self.get_asset_routines().get_repo()
                         try:
                             repo.index.commit("Auto-manager git-asset structure auto-commit")
+                            self.invalidate_status()
+                            self.invalidate_sync_status()
                         except git.GitCommandError as err:
                             await feedback_ui.error("Error on commit:")
                             await feedback_ui.error(err.stdout)
@@ -356,7 +367,7 @@ class AbstractDesktopProjectAssetBasePath(AbstractAssetBasePath[BDT], typing.Gen
                     else:
                         await feedback_ui.output("Children have no unpublished commits and are clean.")
                         await feedback_ui.output("Attempting to automatically checkout 'HEAD'")
-                        repo = git.Repo(gitlab_asset_routines.get_local_repo_path())
+                        repo = get_repo(gitlab_asset_routines.get_local_repo_path())
                         try:
                             output = repo.git.checkout("master")
                             await feedback_ui.output(output)
@@ -364,6 +375,8 @@ class AbstractDesktopProjectAssetBasePath(AbstractAssetBasePath[BDT], typing.Gen
                             await feedback_ui.error("There was an error checking out the master branch.")
                             await feedback_ui.error(err.stderr)
                             return AutoManageResults.CANNOT_COMPLETE
+                        self.invalidate_status()
+                        self.invalidate_sync_status()
                         if self.is_conflicted():
                             await feedback_ui.error("Checkout resulted in conflict.  User intervention required.")
                             return AutoManageResults.CANNOT_COMPLETE
@@ -3,7 +3,7 @@ import os
 import typing
 from enum import Enum
 
-from git import Repo, Submodule
+from git import Submodule
 
 from fiepipelib.automanager.data.localconfig import LegalEntityConfig
 from fiepipelib.automanager.routines.automanager import AutoManagerRoutines
@@ -11,8 +11,9 @@ from fiepipelib.container.local_config.data.automanager import ContainerAutomana
 from fiepipelib.container.local_config.data.localcontainerconfiguration import LocalContainerConfigurationManager
 from fiepipelib.localuser.routines.localuser import get_local_user_routines
 from fiepipelib.enum import get_worse_enum
-from fiepipelib.git.routines.remote import get_commits_ahead, get_commits_behind, exists as remote_exists
-from fiepipelib.git.routines.repo import RepoExists, is_in_conflict
+from fiepipelib.git.routines.remote import get_sync_status, invalidate_sync_status, SyncStatus
+from fiepipelib.git.routines.repo import RepoExists, get_repo
+from fiepipelib.git.routines.status import WorkingTreeStatus, get_status, invalidate_status
 from fiepipelib.git.routines.submodules import CreateEmpty as CreateEmptySubmodule, Add as AddSubmodule, \
     CreateFromSubDirectory as CreateSubmoduleFromSubDirectory, add_gitmodules_file
 from fiepipelib.gitlabserver.routines.gitlabserver import GitLabServerRoutines
@@ -256,35 +257,45 @@ class AbstractGitStorageBasePath(AbstractDirPath[BT], typing.Generic[BT], abc.AB
         """Gets the root id of this base"""
         raise NotImplementedError()
 
+    def sync_status(self) -> SyncStatus:
+        """Gets the remote's existence and the ahead/behind state of 'master' in one go.  Cached for the
+        automanager cycle, or until invalidate_sync_status is called or this base path is pushed or pulled."""
+        repo = get_repo(self.get_path())
+        return get_sync_status(repo, "master", self.get_gitlab_server_name())
+
     def remote_is_ahead(self) -> bool:
         """return true or false if the remote is ahead of the local worktree or not"""
-        repo = Repo(self.get_path())
-        remote_commits_ahead = get_commits_behind(repo, "master", self.get_gitlab_server_name())
-        return len(remote_commits_ahead) > 0
+        return self.sync_status().is_behind()
 
     def remote_is_behind(self) -> bool:
         """returns true or false if the remote is behind the local worktree or not"""
-        repo = Repo(self.get_path())
-        local_commits_ahead = get_commits_ahead(repo, "master", self.get_gitlab_server_name())
-        return len(local_commits_ahead) > 0
+        return self.sync_status().is_ahead()
+
+    @abc.abstractmethod
+    def get_gitlab_project_name(self, server_routines: GitLabServerRoutines) -> str:
+        """The name of the gitlab project this basepath pushes to and pulls from."""
+        raise NotImplementedError()
 
     def remote_exists(self) -> bool:
-        repo = Repo(self.get_path())
-        return remote_exists(repo,self.get_gitlab_server_name())
+        """Uses the gitlab group's project listing, shared for the automanager cycle, when the API is available.
+        Otherwise asks the remote via git."""
+        server_routines = GitLabServerRoutines(self.get_gitlab_server_name())
+        prober = server_routines.get_group_prober(server_routines.group_name_from_fqdn(self.get_fqdn()))
+        if prober.is_available():
+            return prober.project_exists(self.get_gitlab_project_name(server_routines))
+        return self.sync_status().exists()
 
 
     def is_conflicted(self) -> bool:
-        repo = Repo(self.get_path())
-        return is_in_conflict(repo)
+        return self.status().is_conflicted()
 
     def is_detached(self) -> bool:
         """return true or false if the worktree is detached from the head or not"""
-        repo = Repo(self.get_path())
-        return repo.head.is_detached
+        return self.status().is_detached()
 
     def is_checked_out(self) -> bool:
         """returns true of false if the worktree is checked out or not"""
-        repo = Repo(self.get_path())
+        repo = get_repo(self.get_path())
         # for a root, we check if we're bare.
         if repo.bare:
             return False
@@ -312,9 +323,22 @@ class AbstractGitStorageBasePath(AbstractDirPath[BT], typing.Generic[BT], abc.AB
         :param consider_working_tree: whether to consider changes to the worktree as making this tree 'dirty'
         :param consider_index: whether to consider changes to the index as making this tree 'dirty'
         """
-        repo = Repo(self.get_path())
-        return repo.is_dirty(index=consider_index, working_tree=consider_working_tree,
-                             untracked_files=consider_untracked_files, submodules=consider_submodule_changes)
+        return self.status().is_dirty(index=consider_index, working_tree=consider_working_tree,
+                                      untracked_files=consider_untracked_files,
+                                      submodules=consider_submodule_changes)
+
+    def status(self) -> WorkingTreeStatus:
+        """A status snapshot of the worktree.  Cached for the automanager cycle.  One git call answers all the
+        dirty, conflict and detached checks."""
+        return get_status(self.get_path())
+
+    def invalidate_status(self):
+        """Call after changing the worktree, index or HEAD, so the next checks see the change."""
+        invalidate_status(self.get_path())
+
+    def invalidate_sync_status(self):
+        """Call after committing, checking out or merging, so the next ahead/behind checks see the change."""
+        invalidate_sync_status(self.get_path())
 
 TARBP = typing.TypeVar("TARBP", bound= "AbstractRootBasePath")
 
@@ -359,6 +383,9 @@ class AbstractRootBasePath(AbstractGitStorageBasePath[TARBP], typing.Generic[TAR
         container_automan_config.Load()
         return container_automan_config.get_root_gitlab_server(self.get_root_id())
 
+    def get_gitlab_project_name(self, server_routines: GitLabServerRoutines) -> str:
+        return server_routines.project_name_for_gitroot(self.get_root_id())
+
     def get_gitlab_root_routines(self) -> GitLabFQDNGitRootRoutines:
         """Gets GitLabFQDNGitRootRooutines for this root."""
         gitlab_server_routines = GitLabServerRoutines(self.get_gitlab_server_name())
@@ -423,6 +450,9 @@ class AbstractAssetBasePath(AbstractGitStorageBasePath[TAABP], typing.Generic[TA
         container_automan_config.Load()
         return container_automan_config.get_asset_gitlab_server(self.get_asset_id())
 
+    def get_gitlab_project_name(self, server_routines: GitLabServerRoutines) -> str:
+        return server_routines.project_name_for_gitasset(self.get_asset_id())
+
 
     def get_gitlab_asset_routines(self) -> GitLabFQDNGitAssetRoutines:
         """Gets GitLabFQDNGitAssetRooutines for this root."""
@@ -508,7 +538,7 @@ class AssetsStaticSubDir(StaticSubDir[BT,DT], typing.Generic[BT,DT], abc.ABC):
     def get_submodules(self) -> typing.Dict[str, Submodule]:
         """Gets the contained assets as dictionary of git.Submodule objects where the directory name is the key."""
         ret = {}
-        repo = Repo(self.get_base_static_path().get_path())
+        repo = get_repo(self.get_base_static_path().get_path())
         dir_path = self.get_path()
         submods = {}
         for submod in repo.submodules:
@@ -561,7 +591,7 @@ class AssetsStaticSubDir(StaticSubDir[BT,DT], typing.Generic[BT,DT], abc.ABC):
         Will throw an exception if the directory exists."""
         base_path = self.get_base_static_path()
         assert isinstance(base_path, AbstractGitStorageBasePath)
-        repo = Repo(base_path.get_path())
+        repo = get_repo(base_path.get_path())
         dir_path = self.get_path()
         submod_abspath = os.path.join(dir_path, dirname)
         if os.path.exists(submod_abspath):
@@ -579,7 +609,7 @@ class AssetsStaticSubDir(StaticSubDir[BT,DT], typing.Generic[BT,DT], abc.ABC):
         that existing asset.  May throw if the directory already exists."""
         base_path = self.get_base_static_path()
         assert isinstance(base_path, AbstractGitStorageBasePath)
-        repo = Repo(base_path.get_path())
+        repo = get_repo(base_path.get_path())
         dir_path = self.get_path()
         submod_abspath = os.path.join(dir_path, dirname)
         if os.path.exists(submod_abspath):
@@ -596,7 +626,7 @@ class AssetsStaticSubDir(StaticSubDir[BT,DT], typing.Generic[BT,DT], abc.ABC):
         May throw if the directory doesn't already exist."""
         base_path = self.get_base_static_path()
         assert isinstance(base_path, AbstractGitStorageBasePath)
-        repo = Repo(base_path.get_path())
+        repo = get_repo(base_path.get_path())
         dir_path = self.get_path()
         submod_abspath = os.path.join(dir_path, dirname)
         if not os.path.exists(submod_abspath):
@@ -624,7 +654,7 @@ class AssetsStaticSubDir(StaticSubDir[BT,DT], typing.Generic[BT,DT], abc.ABC):
         base_path = self.get_base_static_path()
         assert isinstance(base_path,AbstractGitStorageBasePath)
         base_repo_path = base_path.get_path()
-        base_repo = Repo(base_repo_path)
+        base_repo = get_repo(base_repo_path)
         asset_server_routines = self.get_asset_gitlab_routines_by_dirname(dirname)
         asset_id = asset_server_routines.working_asset.GetAsset().GetID()
         await asset_server_routines.init_submodule_sub_routine(feedback_ui,asset_id,base_repo,"master")
@@ -57,6 +57,11 @@ class LegalEntityConfigManager(AbstractUserLocalTypeManager[LegalEntityConfig]):
     def GetPrimaryKeyColumns(self) -> typing.List[str]:
         return ["fqdn"]
 
+    def GetIndexes(self) -> typing.List[typing.List[str]]:
+        ret = super(LegalEntityConfigManager, self).GetIndexes()
+        ret.append(["fqdn COLLATE NOCASE"])
+        return ret
+
     def ToJSONData(self, item: LegalEntityConfig) -> dict:
         ret = {}
         ret["fqdn"] = item.get_fqdn()
@@ -84,6 +89,9 @@ class LegalEntityConfigManager(AbstractUserLocalTypeManager[LegalEntityConfig]):
     def get_by_fqdn(self, fqdn:str) -> typing.List[LegalEntityConfig]:
         return self._Get([("fqdn",fqdn)])
 
+    def get_by_fqdn_case_insensitive(self, fqdn:str) -> typing.List[LegalEntityConfig]:
+        return self._Get([("fqdn COLLATE NOCASE",fqdn)])
+
     def delete_by_fqdn(self, fqdn:str):
         self._Delete("fqdn",fqdn)
 
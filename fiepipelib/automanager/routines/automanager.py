@@ -13,9 +13,13 @@ from fiepipelib.container.local_config.data.localcontainerconfiguration import L
 from fiepipelib.container.shared.data.container import LocalContainerManager
 from fiepipelib.container.shared.routines.gitlabserver import GitlabManagedContainerRoutines
 from fiepipelib.container.shared.routines.manager import FQDNContainerManagementRoutines
-from fiepipelib.git.routines.repo import RepoExists
+from fiepipelib.git.routines.executor import execute_routine
+from fiepipelib.git.routines.remote import clear_sync_status_cache, set_sync_status_cache_enabled
+from fiepipelib.git.routines.repo import RepoExists, close_cached_repos
+from fiepipelib.git.routines.ssh import SSHMultiplexingSession
+from fiepipelib.git.routines.status import clear_status_cache, set_status_cache_enabled
 from fiepipelib.gitlabserver.data.gitlab_server import GitLabServerManager
-from fiepipelib.gitlabserver.routines.gitlabserver import GitLabServerRoutines
+from fiepipelib.gitlabserver.routines.gitlabserver import GitLabServerRoutines, clear_group_probers
 from fiepipelib.gitstorage.data.git_root import SharedGitRootsComponent
 from fiepipelib.gitstorage.routines.gitlab_server import GitLabFQDNGitRootRoutines
 from fiepipelib.gitstorage.routines.gitroot import GitRootRoutines
@@ -37,6 +41,9 @@ class LegalEntityRoutines(AbstractLocalManagedRoutines[LegalEntityConfig]):
     def GetAllItems(self) -> typing.List[LegalEntityConfig]:
         return self.GetManager().GetAll()
 
+    def IterAllItems(self) -> typing.Iterator[LegalEntityConfig]:
+        return self.GetManager().IterGet()
+
     def ItemToName(self, item: LegalEntityConfig) -> str:
         return item.get_fqdn()
 
@@ -74,11 +81,10 @@ class LegalEntityInteractiveRoutines(LegalEntityRoutines, AbstractLocalManagedIn
         fqdn = name
         user = get_local_user_routines()
         man = LegalEntityConfigManager(user)
-        all = man.GetAll()
         config = None
-        for item in all:
-            if item.get_fqdn().lower() == fqdn.lower():
-                config = item
+        found = man.get_by_fqdn_case_insensitive(fqdn)
+        if len(found) > 0:
+            config = found[-1]
         if config == None:
             config = man.FromParameters(fqdn, True, LegalEntityMode.NONE, "gitlab." + fqdn)
 
@@ -122,13 +128,96 @@ class AutoManagerRoutines(object):
     However, if 'once' is set to true when main_routine called, it will run once and return without sleeping.
 
     In this way, one can either use the simple, internal looping/sleeping logic, or their own, from the same simple call.
+
+    Legal entities, containers and roots are each processed concurrently, up to a configurable limit per level.
+    Roots are also limited per GitLab server, so one server isn't flooded.  A container is only processed once its
+    legal entity has been updated, and a root only once its container has.  A failure in one is reported and
+    doesn't stop its siblings.
+
+    Git-over-SSH traffic shares one master connection per GitLab host for the life of the main routine, via an
+    SSHMultiplexingSession.  Masters are health checked once a cycle and restarted if needed.
     """
 
     _sleep_length: float = 600.0
     _request_close = False
 
-    def __init__(self, sleep_length: float):
+    _max_concurrent_fqdns: int = 2
+    _max_concurrent_containers: int = 4
+    _max_concurrent_roots: int = 8
+    _max_concurrent_per_server: int = 4
+
+    _fqdn_semaphore: asyncio.Semaphore = None
+    _container_semaphore: asyncio.Semaphore = None
+    _root_semaphore: asyncio.Semaphore = None
+    _server_semaphores: typing.Dict[str, asyncio.Semaphore] = None
+
+    _ssh_session: SSHMultiplexingSession = None
+    _ssh_masters: typing.Dict[str, asyncio.Future] = None
+
+    def __init__(self, sleep_length: float, max_concurrent_fqdns: int = 2, max_concurrent_containers: int = 4,
+                 max_concurrent_roots: int = 8, max_concurrent_per_server: int = 4,
+                 ssh_session: SSHMultiplexingSession = None):
+        """@param ssh_session: an already started session to use, e.g. the shell's.  If None, the main routine
+        runs its own for its duration."""
         self._sleep_length = sleep_length
+        self._ssh_session = ssh_session
+        self._max_concurrent_fqdns = max_concurrent_fqdns
+        self._max_concurrent_containers = max_concurrent_containers
+        self._max_concurrent_roots = max_concurrent_roots
+        self._max_concurrent_per_server = max_concurrent_per_server
+
+    def _reset_limits(self):
+        """Creates fresh semaphores.  Semaphores belong to an event loop, so we make new ones every cycle."""
+        self._fqdn_semaphore = asyncio.Semaphore(self._max_concurrent_fqdns)
+        self._container_semaphore = asyncio.Semaphore(self._max_concurrent_containers)
+        self._root_semaphore = asyncio.Semaphore(self._max_concurrent_roots)
+        self._server_semaphores = {}
+        self._ssh_masters = {}
+
+    def _begin_cycle(self):
+        """Starts a cycle.  Fresh limits, and empty caches.  Remote sync status, worktree status and project
+        listings are cached for the duration of a cycle."""
+        self._reset_limits()
+        clear_sync_status_cache()
+        clear_status_cache()
+        clear_group_probers()
+
+    def _ensure_cycle(self):
+        """Begins a cycle if none has been, so the automanage entry points can be called outside the main loop."""
+        if self._fqdn_semaphore is None:
+            self._begin_cycle()
+
+    def _get_server_semaphore(self, gitlab_server: str) -> asyncio.Semaphore:
+        if gitlab_server not in self._server_semaphores:
+            self._server_semaphores[gitlab_server] = asyncio.Semaphore(self._max_concurrent_per_server)
+        return self._server_semaphores[gitlab_server]
+
+    async def _ensure_ssh_master(self, user_host: str) -> bool:
+        """Makes sure the SSH master connection to the host is healthy.  Checked once per host, per cycle."""
+        if self._ssh_session is None or not self._ssh_session.is_active():
+            return False
+        if user_host not in self._ssh_masters:
+            self._ssh_masters[user_host] = asyncio.ensure_future(
+                execute_routine(self._ssh_session.ensure_master, user_host))
+        return await self._ssh_masters[user_host]
+
+    async def _run_limited(self, semaphores: typing.List[asyncio.Semaphore], coro: typing.Awaitable):
+        """Awaits the coroutine while holding the given semaphores, acquired in order."""
+        if len(semaphores) == 0:
+            return await coro
+        async with semaphores[0]:
+            return await self._run_limited(semaphores[1:], coro)
+
+    async def _gather_reporting(self, feedback_ui: AbstractFeedbackUI, coros: typing.List[typing.Awaitable]):
+        """Runs the coroutines concurrently.  Errors are reported rather than raised, so one failure doesn't
+        abort its siblings.  Cancellation is still raised."""
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        for result in results:
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            if isinstance(result, BaseException):
+                await feedback_ui.error("".join(
+                    traceback.format_exception(type(result), result, result.__traceback__)))
 
     def request_close(self):
         self._request_close = True
@@ -136,45 +225,64 @@ class AutoManagerRoutines(object):
     async def main_routine(self, feedback_ui: AbstractFeedbackUI, once=False):
         self._request_close = False
         await feedback_ui.output("Starting AutoManager Main Routine...")
+        owns_ssh_session = self._ssh_session is None
+        if owns_ssh_session:
+            self._ssh_session = SSHMultiplexingSession()
+            self._ssh_session.start()
+        set_status_cache_enabled(True)
+        set_sync_status_cache_enabled(True)
+        try:
+            await self._main_loop_routine(feedback_ui, once)
+        finally:
+            set_status_cache_enabled(False)
+            set_sync_status_cache_enabled(False)
+            close_cached_repos()
+            if owns_ssh_session:
+                await execute_routine(self._ssh_session.stop)
+                self._ssh_session = None
+
+        # we've exited cleanly
+        await feedback_ui.output("AutoManager Main Routine Complete.")
+        return
+
+    async def _main_loop_routine(self, feedback_ui: AbstractFeedbackUI, once: bool):
         while not self._request_close:
             # begin auto loop
 
             # first we loop through legal entities.
 
+            self._begin_cycle()
+
             registry = localregistry(get_local_user_routines())
-            all_reg_entities = registry.GetAll()
-            for reg_entity in all_reg_entities:
-                fqdn = reg_entity.get_fqdn()
+            fqdns = [row[0] for row in registry.GetColumnValues(["fqdn"])]
 
             #legal_entity_configs = self._get_active_legal_entitiy_configs()
             #for legal_entity_config in legal_entity_configs:
+            #    # get the particualrs
+            #    mode = legal_entity_config.get_mode()
 
-                # get the particualrs
-                #mode = legal_entity_config.get_mode()
-
-                # if the mode is none: we don't even bother.  this relieves others of checking further down the line.
-                await self.automanage_fqdn(feedback_ui, fqdn)
+            # if the mode is none: we don't even bother.  this relieves others of checking further down the line.
+            await self._gather_reporting(feedback_ui, [
+                self._run_limited([self._fqdn_semaphore], self.automanage_fqdn(feedback_ui, fqdn)) for fqdn in
+                fqdns])
 
             if once:
                 self.request_close()
                 break
 
+            # no point keeping repositories (and their git processes) open while we sleep.
+            close_cached_repos()
+
             # wait for sleep length before running again
             await asyncio.sleep(self._sleep_length)
 
-        # we've exited cleanly
-        await feedback_ui.output("AutoManager Main Routine Complete.")
-        return
-
     def get_legal_entitiy_config(self, fqdn: str) -> LegalEntityConfig:
-        ret = []
         user = get_local_user_routines()
         man = LegalEntityConfigManager(user)
-        all = man.GetAll()
-        for item in all:
-            if item.get_fqdn().lower() == fqdn.lower():
-                return item
-        raise KeyError()
+        found = man.get_by_fqdn_case_insensitive(fqdn)
+        if len(found) == 0:
+            raise KeyError()
+        return found[0]
 
     def get_container_config(self, local_container_config:LocalContainerConfiguration):
         return ContainerAutomanagerConfigurationComponent(local_container_config)
@@ -182,6 +290,7 @@ class AutoManagerRoutines(object):
 
 
     async def automanage_fqdn(self, feedback_ui: AbstractFeedbackUI, fqdn:str):
+        self._ensure_cycle()
 
         # pre automanage hook
         # we call regardless of mode.
@@ -246,12 +355,16 @@ class AutoManagerRoutines(object):
         container_man = LocalContainerManager(user)
         #local_container_config_man = LocalContainerConfigurationManager(user)
 
-        all_containers = container_man.GetByFQDN(legal_entity_config.get_fqdn())
-        for container in all_containers:
-            await self.automanage_container(feedback_ui, legal_entity_config, container.GetID(), gitlab_server)
+        container_ids = [row[0] for row in
+                         container_man.GetColumnValues(["id"], [("fqdn", legal_entity_config.get_fqdn())])]
+        await self._gather_reporting(feedback_ui, [
+            self._run_limited([self._container_semaphore],
+                              self.automanage_container(feedback_ui, legal_entity_config, container_id,
+                                                        gitlab_server)) for container_id in container_ids])
 
     async def automanage_container(self, feedback_ui: AbstractFeedbackUI, legal_entity_config: LegalEntityConfig,
                                    container_id: str, gitlab_server: str):
+        self._ensure_cycle()
 
         # pre automanage hook
         # we call regardless of mode.
@@ -307,6 +420,8 @@ class AutoManagerRoutines(object):
             await feedback_ui.error("GitLab Server not found: " + gitlab_server)
             return
 
+        # all the roots' git traffic to the server shares one ssh connection.
+        await self._ensure_ssh_master(servers[0].get_ssh_user_host())
 
         # root level auto management
 
@@ -314,10 +429,14 @@ class AutoManagerRoutines(object):
         shared_roots_component.Load()
         shared_roots = shared_roots_component.GetItems()
 
-        for shared_root in shared_roots:
-            await self.automanage_root(feedback_ui, shared_root.GetID(), container_id, config_component,
-                                       legal_entity_config,
-                                       gitlab_server)
+        # the per server limit first.  Roots queued behind a busy server mustn't sit on global slots that roots on
+        # other servers could use.
+        server_semaphore = self._get_server_semaphore(gitlab_server)
+        await self._gather_reporting(feedback_ui, [
+            self._run_limited([server_semaphore, self._root_semaphore],
+                              self.automanage_root(feedback_ui, shared_root.GetID(), container_id, config_component,
+                                                   legal_entity_config,
+                                                   gitlab_server)) for shared_root in shared_roots])
 
     async def automanage_root(self, feedback_ui: AbstractFeedbackUI, root_id: str, container_id: str,
                               container_config: ContainerAutomanagerConfigurationComponent,
@@ -353,21 +472,31 @@ class AutoManagerRoutines(object):
             gitlab_server_routines = GitLabServerRoutines(gitlab_server)
             gitlab_routines = GitLabFQDNGitRootRoutines(gitlab_server_routines, root_routines.root,
                                                         root_routines.root_config, legal_entity_config.get_fqdn())
-            #does the remote exist.
-            exists = await gitlab_routines.remote_exists(feedback_ui)
-
-            if not exists:
+            # the group's project listing answers existence for all roots in the group with one API call.
+            prober = gitlab_server_routines.get_group_prober(
+                gitlab_server_routines.group_name_from_fqdn(legal_entity_config.get_fqdn()))
+            known_missing = False
+            if await execute_routine(prober.is_available):
+                known_missing = not prober.root_exists(root_routines.root_config.GetID())
+
+            sync_status = None
+            if not known_missing:
+                #does the remote exist, and are we ahead or behind.  one trip to the server.
+                sync_status = await gitlab_routines.sync_status_routine(feedback_ui)
+
+            if known_missing or not sync_status.exists():
                 #we push it up if not
                 await feedback_ui.output("Root doesn't exist on server.  Pushing...")
                 success = await gitlab_routines.push_sub_routine(feedback_ui, 'master', False)
                 if not success:
                     await feedback_ui.error("Failed to push new repository.  Aborting auto-management of this root")
                     return
+                prober.mark_exists(gitlab_server_routines.project_name_for_gitroot(root_routines.root_config.GetID()))
 
             else:
                 #if it exists, we check its ahead/behind status and act accordingly.
-                is_behind_remote = await gitlab_routines.is_behind_remote(feedback_ui)
-                is_ahead_of_remote = await gitlab_routines.is_aheadof_remote(feedback_ui)
+                is_behind_remote = sync_status.is_behind()
+                is_ahead_of_remote = sync_status.is_ahead()
 
                 if is_ahead_of_remote and not is_behind_remote:
                     await feedback_ui.output("Root is ahead.  Pushing...")
@@ -424,9 +553,5 @@ class AutoManagerRoutines(object):
 class AutoManagerInteractiveRoutines(AutoManagerRoutines):
 
     def get_fqdns(self) -> typing.List[str]:
-        ret = []
         registry = localregistry(get_local_user_routines())
-        all = registry.GetAll()
-        for item in all:
-            ret.append(item.get_fqdn())
-        return ret
+        return [row[0] for row in registry.GetColumnValues(["fqdn"])]
@@ -0,0 +1,30 @@
+from fiepipelib.components.data.components import AbstractComponent
+from fiepipelib.git.routines.lfs import LFSFetchProfile, LFSFetchProfileFromJSONData, LFSFetchProfileToJSONData
+
+
+class ContainerLFSFetchConfigurationComponent(AbstractComponent):
+    """Which LFS files this system downloads for the container's roots and assets.  e.g. a remote artist might
+    only want proxies."""
+
+    _profile: LFSFetchProfile = None
+
+    def get_profile(self) -> LFSFetchProfile:
+        return self._profile
+
+    def set_profile(self, profile: LFSFetchProfile):
+        self._profile = profile
+
+    def __init__(self, cont):
+        self._profile = LFSFetchProfile()
+        super().__init__(cont)
+
+    def GetComponentName(self):
+        return "lfs_fetch_configuration"
+
+    def DeserializeJSONData(self, data: dict):
+        self._profile = LFSFetchProfileFromJSONData(data['profile'])
+
+    def SerializeJSONData(self) -> dict:
+        ret = {}
+        ret['profile'] = LFSFetchProfileToJSONData(self._profile)
+        return ret
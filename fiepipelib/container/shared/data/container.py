@@ -108,6 +108,11 @@ class LocalContainerManager(
     def GetPrimaryKeyColumns(self) -> typing.List[str]:
         return ["id"]
 
+    def GetIndexes(self) -> typing.List[typing.List[str]]:
+        ret = super().GetIndexes()
+        ret.append(["fqdn", "shortname"])
+        return ret
+
     def GetManagedTypeName(self) -> str:
         return "container"
 
@@ -93,6 +93,10 @@ class FQDNContainerManagementRoutines(AbstractContainerManagementRoutines):
         man = self.GetManager()
         return man.GetByFQDN(self.get_fqdn())
 
+    def IterAllItems(self) -> typing.Iterator[Container]:
+        man = self.GetManager()
+        return man.IterGet([("fqdn", self.get_fqdn())])
+
     def GetItemByName(self, name: str) -> Container:
         man = self.GetManager()
         containers = man.GetByShortName(shortName=name, fqdn=self.get_fqdn())
@@ -125,6 +129,10 @@ class AllContainerManagementRoutines(AbstractContainerManagementRoutines):
         man = self.GetManager()
         return man.GetAll()
 
+    def IterAllItems(self) -> typing.Iterator[Container]:
+        man = self.GetManager()
+        return man.IterGet()
+
     def GetItemByName(self, name: str) -> Container:
         """WARNING:  Containers from different FQDNs might share the same name!"""
         man = self.GetManager()
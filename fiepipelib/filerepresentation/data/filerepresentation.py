@@ -60,6 +60,12 @@ class AbstractRepresentationManager(AbstractItemManager):
             ret.append(col)
         return ret
 
+    def GetIndexes(self):
+        """Lookups by version.  The primary key leads with it, so this doesn't add an index of its own."""
+        ret = super().GetIndexes()
+        ret.append(['version'])
+        return ret
+
     @abc.abstractclassmethod
     def GetByVersion(self, version:AbstractFileVersion, connection: Connection):
         raise NotImplementedError()
@@ -26,6 +26,12 @@ class AbstractFileVersionManager(AbstractItemManager):
         ck.append("version")
         return ck
 
+    def GetIndexes(self):
+        """Lookups by version, regardless of the rest of the compound key."""
+        ret = super().GetIndexes()
+        ret.append(["version"])
+        return ret
+
 
 class AbstractFileVersion(object):
 
@@ -0,0 +1,91 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+import typing
+
+import git
+
+from fieui.FeedbackUI import AbstractFeedbackUI
+
+# the most git operations we'll run on threads at once, per process.
+GIT_EXECUTOR_MAX_WORKERS = 8
+
+_executor: concurrent.futures.ThreadPoolExecutor = None
+_executor_pid: int = None
+_executor_lock = threading.Lock()
+
+
+def get_git_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """Returns the process wide thread pool on which blocking git (GitPython) calls are run."""
+    global _executor, _executor_pid
+    pid = os.getpid()
+    with _executor_lock:
+        if _executor is None or _executor_pid != pid:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=GIT_EXECUTOR_MAX_WORKERS,
+                                                              thread_name_prefix="fiepipe_git")
+            _executor_pid = pid
+    return _executor
+
+
+def shutdown_git_executor():
+    """Waits for outstanding git calls and shuts down the pool.  A new one is made on next use."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+async def execute_routine(func: typing.Callable, *args, **kwargs):
+    """Runs a blocking call (usually GitPython) on the git thread pool and returns its result, without blocking
+    the event loop.  Exceptions raised by the call are raised here.
+
+    GitPython Repo objects aren't safe to share between threads.  Do all the work with a given Repo inside one
+    call, rather than passing a Repo to several concurrent calls.
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(get_git_executor(), lambda: func(*args, **kwargs))
+
+
+async def _stream_lines_routine(stream: asyncio.StreamReader, lines: typing.List[str],
+                                feedback_ui: AbstractFeedbackUI):
+    while True:
+        data = await stream.readline()
+        if len(data) == 0:
+            return
+        line = data.decode(errors="replace").rstrip("\r\n")
+        lines.append(line)
+        if feedback_ui is not None and len(line) > 0:
+            await feedback_ui.feedback(line)
+
+
+async def git_command_routine(working_dir: str, args: typing.List[str], feedback_ui: AbstractFeedbackUI = None,
+                              env: typing.Dict[str, str] = None) -> str:
+    """Runs 'git [args]' in the given directory as an asyncio subprocess.
+
+    Output (stdout and stderr) is streamed line by line to the feedback_ui's feedback as it arrives, if one is
+    given.
+
+    @param env: extra environment variables for the git process.
+    @return: stdout
+    @raise git.GitCommandError: on a non-zero exit, like GitPython would.
+    """
+    command = ["git"] + list(args)
+    full_env = None
+    if env is not None:
+        full_env = dict(os.environ)
+        full_env.update(env)
+    proc = await asyncio.create_subprocess_exec(*command, cwd=working_dir, env=full_env,
+                                                stdin=asyncio.subprocess.DEVNULL,
+                                                stdout=asyncio.subprocess.PIPE,
+                                                stderr=asyncio.subprocess.PIPE)
+    stdout_lines = []
+    stderr_lines = []
+    await asyncio.gather(_stream_lines_routine(proc.stdout, stdout_lines, feedback_ui),
+                         _stream_lines_routine(proc.stderr, stderr_lines, feedback_ui))
+    status = await proc.wait()
+    stdout = "\n".join(stdout_lines)
+    if status != 0:
+        raise git.GitCommandError(command, status, "\n".join(stderr_lines), stdout)
+    return stdout
@@ -1,7 +1,34 @@
+import errno
+import fnmatch
+import json
+import os
+import os.path
+import shutil
+import time
 import typing
 
 import git
 
+from fiepipelib.git.routines.executor import execute_routine, git_command_routine
+from fiepipelib.git.routines.repo import get_repo
+from fieui.FeedbackUI import AbstractFeedbackUI
+
+# the file in a shared LFS storage directory that lists the repositories using it.  Its presence is also what
+# marks a directory as a shared LFS storage directory.
+SHARED_LFS_REGISTRY_FILENAME = "fiepipe_shared_lfs.json"
+
+# how long (seconds) we wait for another process to release a shared LFS storage directory's lock.
+SHARED_LFS_LOCK_TIMEOUT = 600
+
+# a lock older than this (seconds) was left behind by a process that died.
+SHARED_LFS_LOCK_STALE = 6 * 60 * 60
+
+# objects newer than this (seconds) are never pruned.  They may belong to changes that aren't committed yet.
+SHARED_LFS_PRUNE_GRACE = 2 * 24 * 60 * 60
+
+# the most paths we pass to one 'git lfs fetch --include'.
+LFS_FETCH_PATHS_PER_COMMAND = 100
+
 
 def InstallLFSGlobal():
     if not LFSIsInstalledGlobal():
@@ -117,3 +144,524 @@ def SetConfigLFSServerRepo(repo, url):
     ret = repo.git.config("-f", ".lfsconfig", "lfs.url = " + url)
     ret = ret + repo.git.add(".lfsconfig")
     return ret
+
+
+def _same_path(a: str, b: str) -> bool:
+    return os.path.normcase(os.path.realpath(a)) == os.path.normcase(os.path.realpath(b))
+
+
+def _common_dir(repo: git.Repo) -> str:
+    return getattr(repo, "common_dir", repo.git_dir)
+
+
+def _object_path(storage_path: str, oid: str) -> str:
+    """LFS storage is content addressed: objects/<first two of oid>/<next two of oid>/<oid>."""
+    return os.path.join(storage_path, "objects", oid[0:2], oid[2:4], oid)
+
+
+def _iter_objects(storage_path: str) -> typing.Iterator[typing.Tuple[str, str]]:
+    """Yields (oid, path) for every object in the LFS storage directory."""
+    objects_dir = os.path.join(storage_path, "objects")
+    if not os.path.isdir(objects_dir):
+        return
+    for dir_path, dir_names, file_names in os.walk(objects_dir):
+        for file_name in file_names:
+            if len(file_name) == 64:
+                yield file_name, os.path.join(dir_path, file_name)
+
+
+def _configured_storage(git_dir: str) -> str:
+    """The lfs.storage in the given git dir's config, made absolute.  None if not set."""
+    reader = git.GitConfigParser(os.path.join(git_dir, "config"), read_only=True)
+    try:
+        if not reader.has_option("lfs", "storage"):
+            return None
+        storage = reader.get_value("lfs", "storage")
+    finally:
+        reader.release()
+    # relative paths are relative to the git dir, as LFS treats them.
+    return os.path.join(git_dir, str(storage))
+
+
+def GetLFSStorageDir(repo: git.Repo) -> str:
+    """The directory LFS stores the repository's objects in.  Its lfs.storage if set, otherwise the default."""
+    common_dir = _common_dir(repo)
+    configured = _configured_storage(common_dir)
+    if configured is None:
+        return os.path.join(common_dir, "lfs")
+    return configured
+
+
+def IsSharedLFSStorage(storage_path: str) -> bool:
+    return os.path.isfile(os.path.join(storage_path, SHARED_LFS_REGISTRY_FILENAME))
+
+
+def GetSharedLFSStorage(repo: git.Repo) -> str:
+    """The shared LFS storage directory the repository is pointed at.  None if it has its own."""
+    configured = _configured_storage(_common_dir(repo))
+    if configured is None or not IsSharedLFSStorage(configured):
+        return None
+    return configured
+
+
+class SharedLFSStorageLock(object):
+    """Cross process lock on a shared LFS storage directory's registry.  Held while registering repositories and
+    for the whole of a prune, so a repository can't start using the storage between a prune counting references
+    and deleting objects."""
+
+    _path: str = None
+    _timeout: float = None
+
+    def __init__(self, storage_path: str, timeout: float = SHARED_LFS_LOCK_TIMEOUT):
+        self._path = os.path.join(storage_path, SHARED_LFS_REGISTRY_FILENAME + ".lock")
+        self._timeout = timeout
+
+    def acquire(self):
+        deadline = time.monotonic() + self._timeout
+        while True:
+            try:
+                fd = os.open(self._path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode())
+                os.close(fd)
+                return
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+            try:
+                if time.time() - os.stat(self._path).st_mtime > SHARED_LFS_LOCK_STALE:
+                    os.remove(self._path)
+                    continue
+            except OSError:
+                # released while we looked.
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError("Timed out waiting for shared LFS storage lock: " + self._path)
+            time.sleep(0.5)
+
+    def release(self):
+        os.remove(self._path)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+def _read_registry(storage_path: str) -> typing.Dict[str, typing.Dict[str, str]]:
+    """git dir -> {"working_dir":..., "git_dir":...} for the repositories registered with the storage."""
+    with open(os.path.join(storage_path, SHARED_LFS_REGISTRY_FILENAME), "r") as f:
+        data = json.load(f)
+    ret = {}
+    for entry in data["repositories"]:
+        ret[entry["git_dir"]] = entry
+    return ret
+
+
+def _write_registry(storage_path: str, registry: typing.Dict[str, typing.Dict[str, str]]):
+    data = {"version": 1, "repositories": sorted(registry.values(), key=lambda e: e["git_dir"])}
+    path = os.path.join(storage_path, SHARED_LFS_REGISTRY_FILENAME)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f, sort_keys=True, indent=4)
+    os.replace(temp_path, path)
+
+
+def InitSharedLFSStorage(storage_path: str):
+    """Creates the shared LFS storage directory if it doesn't exist yet."""
+    os.makedirs(os.path.join(storage_path, "objects"), exist_ok=True)
+    if IsSharedLFSStorage(storage_path):
+        return
+    with SharedLFSStorageLock(storage_path):
+        if not IsSharedLFSStorage(storage_path):
+            _write_registry(storage_path, {})
+
+
+def _register(storage_path: str, repo: git.Repo):
+    git_dir = os.path.realpath(_common_dir(repo))
+    with SharedLFSStorageLock(storage_path):
+        registry = _read_registry(storage_path)
+        registry[git_dir] = {"git_dir": git_dir, "working_dir": os.path.realpath(repo.working_tree_dir)}
+        _write_registry(storage_path, registry)
+
+
+def _unregister(storage_path: str, repo: git.Repo):
+    git_dir = os.path.realpath(_common_dir(repo))
+    with SharedLFSStorageLock(storage_path):
+        registry = _read_registry(storage_path)
+        if registry.pop(git_dir, None) is not None:
+            _write_registry(storage_path, registry)
+
+
+def _transfer_objects(source_path: str, dest_path: str, oids: typing.Set[str] = None,
+                      move: bool = True) -> typing.Tuple[int, int]:
+    """Moves (or copies) objects between LFS storage directories.  Objects the destination already has are left
+    where they are (or deleted, when moving).
+
+    @param oids: only these objects.  None for all of them.
+    @return: (objects transferred, objects the destination already had)
+    """
+    transferred = 0
+    existing = 0
+    for oid, path in list(_iter_objects(source_path)):
+        if oids is not None and oid not in oids:
+            continue
+        dest = _object_path(dest_path, oid)
+        if os.path.exists(dest):
+            existing += 1
+            if move:
+                os.remove(path)
+            continue
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if move:
+            shutil.move(path, dest)
+        else:
+            shutil.copy2(path, dest)
+        transferred += 1
+    return transferred, existing
+
+
+def GetReferencedLFSObjects(repo: typing.Union[git.Repo, str]) -> typing.Set[str]:
+    """The oids of all the LFS objects referenced by any ref (branches, tags, stashes) of the repository.
+
+    @param repo: a repository, or the path to a git dir without a working tree (e.g. a de-inited submodule's).
+    """
+    if isinstance(repo, str):
+        output = git.Git(repo).execute(["git", "--git-dir=" + repo, "lfs", "ls-files", "--long", "--all"])
+    else:
+        output = repo.git.lfs("ls-files", "--long", "--all")
+    ret = set()
+    for line in output.splitlines():
+        oid = line.split(" ", 1)[0]
+        if len(oid) == 64:
+            ret.add(oid)
+    return ret
+
+
+def SharedLFSStorageArgs(storage_path: str) -> typing.List[str]:
+    """git arguments that point LFS at the given shared storage for one command, and the submodule clones and
+    checkouts it runs.  Used so submodules cloned into a repository using shared storage download into it
+    straight away, before they have their own lfs.storage set.  Empty if storage_path is None."""
+    if storage_path is None:
+        return []
+    return ["-c", "lfs.storage=" + storage_path]
+
+
+def SetSharedLFSStorage(repo: git.Repo, storage_path: str) -> typing.Tuple[int, int]:
+    """Points the repository's LFS storage at a shared, content addressed storage directory.  The objects it
+    already has are moved into the shared storage, and dropped if it already has them.
+
+    If the repository was using another shared storage, only the objects it references are copied over, as
+    other repositories still use that one.
+
+    @return: (objects moved or copied in, objects the shared storage already had)
+    """
+    storage_path = os.path.abspath(storage_path)
+    InitSharedLFSStorage(storage_path)
+    current = GetLFSStorageDir(repo)
+    # registered first, so a prune of the storage will count the objects we're about to move in.
+    _register(storage_path, repo)
+    if _same_path(current, storage_path):
+        return 0, 0
+    if IsSharedLFSStorage(current):
+        ret = _transfer_objects(current, storage_path, GetReferencedLFSObjects(repo), move=False)
+        repo.git.config("--local", "lfs.storage", storage_path)
+        _unregister(current, repo)
+        return ret
+    ret = _transfer_objects(current, storage_path, move=True)
+    repo.git.config("--local", "lfs.storage", storage_path)
+    return ret
+
+
+def UnsetSharedLFSStorage(repo: git.Repo) -> int:
+    """Gives the repository its own LFS storage again.  The objects it references are copied out of the shared
+    storage.
+
+    @return: the number of objects copied.
+    """
+    storage_path = GetSharedLFSStorage(repo)
+    if storage_path is None:
+        return 0
+    own_path = os.path.join(_common_dir(repo), "lfs")
+    copied, existing = _transfer_objects(storage_path, own_path, GetReferencedLFSObjects(repo), move=False)
+    repo.git.config("--local", "--unset", "lfs.storage")
+    _unregister(storage_path, repo)
+    return copied
+
+
+def _count_references(storage_path: str, registry: typing.Dict[str, typing.Dict[str, str]]) -> typing.Dict[str, int]:
+    """Counts, per object, how many of the registered repositories reference it.  Repositories that are gone or
+    no longer use the storage are dropped from the registry."""
+    counts = {}
+    for git_dir, entry in list(registry.items()):
+        if not os.path.isdir(git_dir):
+            del registry[git_dir]
+            continue
+        configured = _configured_storage(git_dir)
+        if configured is None or not _same_path(configured, storage_path):
+            del registry[git_dir]
+            continue
+        working_dir = entry["working_dir"]
+        if os.path.exists(os.path.join(working_dir, ".git")):
+            oids = GetReferencedLFSObjects(get_repo(working_dir))
+        else:
+            # de-inited; its history (and the objects it needs) is still there.
+            oids = GetReferencedLFSObjects(git_dir)
+        for oid in oids:
+            counts[oid] = counts.get(oid, 0) + 1
+    return counts
+
+
+def GetSharedLFSReferenceCounts(storage_path: str) -> typing.Dict[str, int]:
+    """How many of the repositories using the shared storage reference each object it holds.  Unreferenced
+    objects have a count of 0."""
+    with SharedLFSStorageLock(storage_path):
+        registry = _read_registry(storage_path)
+        counts = _count_references(storage_path, registry)
+    ret = {}
+    for oid, path in _iter_objects(storage_path):
+        ret[oid] = counts.get(oid, 0)
+    return ret
+
+
+def PruneSharedLFSStorage(storage_path: str, grace: float = SHARED_LFS_PRUNE_GRACE,
+                          dry_run: bool = False) -> typing.Tuple[int, int, int]:
+    """Deletes the objects in a shared LFS storage directory that none of the repositories using it reference.
+
+    Never use 'git lfs prune' in a repository using shared storage; it only knows about its own references.
+
+    A repository that can't be listed stops the prune (with its GitCommandError), as its references are unknown.
+
+    @param grace: objects modified less than this many seconds ago are kept.
+    @param dry_run: count what would be deleted without deleting it.
+    @return: (objects deleted, bytes deleted, objects kept)
+    """
+    deleted = 0
+    deleted_bytes = 0
+    kept = 0
+    now = time.time()
+    with SharedLFSStorageLock(storage_path):
+        registry = _read_registry(storage_path)
+        before = len(registry)
+        counts = _count_references(storage_path, registry)
+        if len(registry) != before and not dry_run:
+            _write_registry(storage_path, registry)
+        for oid, path in list(_iter_objects(storage_path)):
+            stat = os.stat(path)
+            if counts.get(oid, 0) != 0 or now - stat.st_mtime < grace:
+                kept += 1
+                continue
+            if not dry_run:
+                os.remove(path)
+            deleted += 1
+            deleted_bytes += stat.st_size
+    return deleted, deleted_bytes, kept
+
+
+class LFSFetchProfile(object):
+    """Which LFS objects to download, for partial hydration of a repository.  Objects that aren't downloaded stay
+    as pointer files in the working tree until hydrated.
+
+    An empty profile downloads everything.
+    """
+
+    _include: typing.List[str] = None
+    _exclude: typing.List[str] = None
+    _max_size: int = None
+    _recent_days: int = None
+
+    def __init__(self, include: typing.List[str] = None, exclude: typing.List[str] = None, max_size: int = None,
+                 recent_days: int = None):
+        self._include = list(include or [])
+        self._exclude = list(exclude or [])
+        self._max_size = max_size
+        self._recent_days = recent_days
+
+    def get_include(self) -> typing.List[str]:
+        """LFS style globs (e.g. '*.jpg', 'proxies/**').  Only matching files are downloaded.  Empty for all."""
+        return self._include.copy()
+
+    def get_exclude(self) -> typing.List[str]:
+        """LFS style globs.  Matching files aren't downloaded."""
+        return self._exclude.copy()
+
+    def get_max_size(self) -> int:
+        """Files larger than this many bytes aren't downloaded.  None for no limit."""
+        return self._max_size
+
+    def get_recent_days(self) -> int:
+        """Only files changed in the last this many days are downloaded.  None for all."""
+        return self._recent_days
+
+    def is_full(self) -> bool:
+        return (len(self._include) == 0 and len(self._exclude) == 0 and self._max_size is None and
+                self._recent_days is None)
+
+    def needs_file_list(self) -> bool:
+        """Whether LFS can't apply the profile on its own (with globs), and we have to list the files to fetch."""
+        return self._max_size is not None or self._recent_days is not None
+
+
+def LFSFetchProfileFromJSONData(data: typing.Dict) -> LFSFetchProfile:
+    return LFSFetchProfile(data.get('include', []), data.get('exclude', []), data.get('max_size', None),
+                           data.get('recent_days', None))
+
+
+def LFSFetchProfileToJSONData(profile: LFSFetchProfile) -> typing.Dict:
+    data = {}
+    data['include'] = profile.get_include()
+    data['exclude'] = profile.get_exclude()
+    data['max_size'] = profile.get_max_size()
+    data['recent_days'] = profile.get_recent_days()
+    return data
+
+
+def GetFetchProfile(repo: git.Repo) -> LFSFetchProfile:
+    """The fetch profile stored in the repository's local config.  LFS's own lfs.fetchinclude and
+    lfs.fetchexclude, which its smudge filter and 'git lfs pull' honor too, plus our size and age limits."""
+    reader = git.GitConfigParser(os.path.join(_common_dir(repo), "config"), read_only=True)
+    try:
+        def get(section: str, option: str):
+            if reader.has_option(section, option):
+                return reader.get_value(section, option)
+            return None
+
+        include = get("lfs", "fetchinclude")
+        exclude = get("lfs", "fetchexclude")
+        max_size = get("fiepipe", "lfsmaxsize")
+        recent_days = get("fiepipe", "lfsrecentdays")
+    finally:
+        reader.release()
+    return LFSFetchProfile(_split_globs(include), _split_globs(exclude),
+                           None if max_size is None else int(max_size),
+                           None if recent_days is None else int(recent_days))
+
+
+def SetFetchProfile(repo: git.Repo, profile: LFSFetchProfile):
+    """Stores the fetch profile in the repository's local config.  It's then used by its checkouts and pulls."""
+    values = [("lfs.fetchinclude", ",".join(profile.get_include())),
+              ("lfs.fetchexclude", ",".join(profile.get_exclude())),
+              ("fiepipe.lfsmaxsize", profile.get_max_size()),
+              ("fiepipe.lfsrecentdays", profile.get_recent_days())]
+    for key, value in values:
+        if value is None or value == "":
+            try:
+                repo.git.config("--local", "--unset", key)
+            except git.GitCommandError:
+                # wasn't set.
+                pass
+        else:
+            repo.git.config("--local", key, str(value))
+
+
+def _split_globs(value) -> typing.List[str]:
+    if value is None:
+        return []
+    return [glob.strip() for glob in str(value).split(",") if len(glob.strip()) != 0]
+
+
+def _matches(path: str, globs: typing.List[str]) -> bool:
+    """An approximation of LFS's (gitignore style) glob matching.  Globs without a slash match any file name,
+    those with one match from the top of the repository.  A directory matches everything in it."""
+    name = path.rsplit("/", 1)[-1]
+    for glob in globs:
+        glob = glob.replace("**", "*").rstrip("/")
+        if "/" not in glob:
+            if fnmatch.fnmatchcase(name, glob) or any(fnmatch.fnmatchcase(part, glob) for part in path.split("/")[:-1]):
+                return True
+        elif fnmatch.fnmatchcase(path, glob.lstrip("/")) or fnmatch.fnmatchcase(path, glob.lstrip("/") + "/*"):
+            return True
+    return False
+
+
+def _path_glob(path: str) -> str:
+    """An LFS include glob matching exactly the given path.  LFS splits globs on commas and has no escapes, so
+    commas and glob characters in the path become single character wildcards."""
+    for c in ",*?[]\\":
+        path = path.replace(c, "?")
+    return path
+
+
+def GetLFSPointers(repo: git.Repo, ref: str = "HEAD") -> typing.List[typing.Tuple[str, str, int]]:
+    """(path, oid, size) of every LFS file in the ref's tree.  Reads the pointer files, not the objects."""
+    paths = repo.git.lfs("ls-files", "--name-only", ref).splitlines()
+    tree = repo.commit(ref).tree
+    ret = []
+    for path in paths:
+        oid = None
+        size = None
+        for line in tree[path].data_stream.read().decode(errors="replace").splitlines():
+            if line.startswith("oid sha256:"):
+                oid = line[len("oid sha256:"):]
+            elif line.startswith("size "):
+                size = int(line[len("size "):])
+        if oid is not None:
+            ret.append((path, oid, size))
+    return ret
+
+
+def GetRecentlyChangedPaths(repo: git.Repo, ref: str, days: int) -> typing.Set[str]:
+    """Paths changed by commits in the last 'days' days, reachable from the ref."""
+    output = repo.git.log("--since=" + str(days) + ".days", "--name-only", "--format=", ref)
+    return set([line for line in output.splitlines() if len(line) != 0])
+
+
+def ResolveFetchPaths(repo: git.Repo, ref: str, profile: LFSFetchProfile) -> typing.List[str]:
+    """The paths of the LFS files in the ref's tree that the profile says to download."""
+    recent = None
+    if profile.get_recent_days() is not None:
+        recent = GetRecentlyChangedPaths(repo, ref, profile.get_recent_days())
+    include = profile.get_include()
+    exclude = profile.get_exclude()
+    ret = []
+    for path, oid, size in GetLFSPointers(repo, ref):
+        if len(include) != 0 and not _matches(path, include):
+            continue
+        if _matches(path, exclude):
+            continue
+        if profile.get_max_size() is not None and size is not None and size > profile.get_max_size():
+            continue
+        if recent is not None and path not in recent:
+            continue
+        ret.append(path)
+    return ret
+
+
+def FetchCommands(remote: str, ref: str, profile: LFSFetchProfile,
+                  paths: typing.List[str] = None) -> typing.List[typing.List[str]]:
+    """The 'git lfs fetch' commands (git arguments) that download what the profile says to.  Includes and
+    excludes are always given, so the repository's configured ones don't apply.
+
+    @param paths: the files to fetch, from ResolveFetchPaths, if the profile needs a file list.
+    """
+    exclude = ",".join(profile.get_exclude())
+    if paths is None:
+        return [["lfs", "fetch", "--include=" + ",".join(profile.get_include()), "--exclude=" + exclude, remote, ref]]
+    ret = []
+    for i in range(0, len(paths), LFS_FETCH_PATHS_PER_COMMAND):
+        include = ",".join([_path_glob(path) for path in paths[i:i + LFS_FETCH_PATHS_PER_COMMAND]])
+        ret.append(["lfs", "fetch", "--include=" + include, "--exclude=" + exclude, remote, ref])
+    return ret
+
+
+# smudging (downloading LFS files on checkout) is turned off for git commands run with this environment.
+SKIP_SMUDGE_ENV = {"GIT_LFS_SKIP_SMUDGE": "1"}
+
+
+async def hydrate_routine(working_dir: str, remote: str, profile: LFSFetchProfile,
+                          feedback_ui: AbstractFeedbackUI = None) -> int:
+    """Downloads the LFS files the profile says to, for the checked out commit, and replaces their pointer files
+    in the working tree.  Files already downloaded aren't downloaded again.
+
+    @return: the number of files fetched, or -1 if the profile didn't need them listed.
+    """
+    paths = None
+    if profile.needs_file_list():
+        paths = await execute_routine(lambda: ResolveFetchPaths(get_repo(working_dir), "HEAD", profile))
+        if len(paths) == 0:
+            return 0
+    for args in FetchCommands(remote, "HEAD", profile, paths):
+        await git_command_routine(working_dir, args, feedback_ui)
+    await git_command_routine(working_dir, ["lfs", "checkout"], feedback_ui)
+    return -1 if paths is None else len(paths)
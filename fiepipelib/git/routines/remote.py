@@ -1,7 +1,11 @@
+import os.path
+import threading
 import typing
 
 import git
 
+from fiepipelib.git.routines.repo import is_in_conflict, get_repo
+
 
 def create_update_remote(repo: git.Repo, name: str, url: str):
     found_remote = None
@@ -10,13 +14,21 @@ def create_update_remote(repo: git.Repo, name: str, url: str):
         if existing_remote.name == name:
             found_remote = existing_remote
     if found_remote is not None:
-        found_remote.set_url(url)
+        # avoid rewriting the config when nothing changed.
+        if found_remote.url != url:
+            found_remote.set_url(url)
         return found_remote
     else:
         new_remote = repo.create_remote(name, url)
         return new_remote
 
 
+def create_update_remote_at_path(path: str, name: str, url: str):
+    """Like create_update_remote, for the repository at the given path.  Handy for running on another thread."""
+    repo = get_repo(path)
+    create_update_remote(repo, name, url)
+
+
 def get_commits_behind(repo: git.Repo, branch: str, remote: str) -> typing.List[git.Commit]:
     """remote commits ahead of local"""
     ret = []
@@ -44,3 +56,143 @@ def exists(repo: git.Repo, remote: str) -> bool:
         print("GitCommanddError thrown upon testing for remote.  Error output follows:")
         print(str(err.stderr))
         return False
+
+
+class SyncStatus(object):
+    """The state of a local branch compared to the same branch on a remote."""
+
+    _exists: bool = False
+    _branch_exists: bool = False
+    _ahead: int = 0
+    _behind: int = 0
+    _conflicted: bool = False
+
+    def __init__(self, exists: bool, branch_exists: bool, ahead: int, behind: int, conflicted: bool):
+        self._exists = exists
+        self._branch_exists = branch_exists
+        self._ahead = ahead
+        self._behind = behind
+        self._conflicted = conflicted
+
+    def exists(self) -> bool:
+        """Whether the remote repository exists (or at least, is reachable)."""
+        return self._exists
+
+    def branch_exists(self) -> bool:
+        """Whether the branch exists on the remote."""
+        return self._branch_exists
+
+    def get_commits_ahead(self) -> int:
+        """The number of local commits the remote doesn't have."""
+        return self._ahead
+
+    def get_commits_behind(self) -> int:
+        """The number of remote commits the local branch doesn't have."""
+        return self._behind
+
+    def is_ahead(self) -> bool:
+        return self._ahead != 0
+
+    def is_behind(self) -> bool:
+        return self._behind != 0
+
+    def is_conflicted(self) -> bool:
+        """Whether the local index has unresolved conflicts."""
+        return self._conflicted
+
+
+_sync_status_cache: typing.Dict[typing.Tuple[str, str, str], SyncStatus] = {}
+_sync_status_cache_enabled = False
+_sync_status_lock = threading.Lock()
+
+
+def _sync_status_key(repo: git.Repo, branch: str, remote: str) -> typing.Tuple[str, str, str]:
+    path = repo.working_tree_dir
+    if path is None:
+        path = repo.git_dir
+    return (os.path.realpath(path), remote, branch)
+
+
+def _local_branch_exists(repo: git.Repo, branch: str) -> bool:
+    try:
+        repo.git.rev_parse("--verify", "--quiet", "refs/heads/" + branch)
+    except git.GitCommandError:
+        return False
+    return True
+
+
+def get_sync_status(repo: git.Repo, branch: str, remote: str, use_cache: bool = True) -> SyncStatus:
+    """Compares the local branch to the same branch on the remote, with one ls-remote, a fetch only if the remote
+    has commits we don't, and one rev-list.
+
+    Results are only cached while the sync status cache is enabled; the automanager enables it for its cycles and
+    clears it at the start of each.  Anything that commits, checks out, merges, pushes or pulls while it's enabled
+    should call invalidate_sync_status for the repository.
+    """
+    key = _sync_status_key(repo, branch, remote)
+    if use_cache:
+        with _sync_status_lock:
+            if _sync_status_cache_enabled and key in _sync_status_cache:
+                return _sync_status_cache[key]
+
+    conflicted = is_in_conflict(repo)
+    try:
+        ls_output = repo.git.ls_remote(remote, "refs/heads/" + branch)
+    except git.GitCommandError:
+        ret = SyncStatus(False, False, 0, 0, conflicted)
+    else:
+        remote_sha = None
+        for line in ls_output.splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[1] == "refs/heads/" + branch:
+                remote_sha = parts[0]
+        local_exists = _local_branch_exists(repo, branch)
+        if remote_sha is None:
+            # an empty remote, or one without the branch.  Everything local is ahead.
+            ahead = 0
+            if local_exists:
+                ahead = int(repo.git.rev_list("--count", branch))
+            ret = SyncStatus(True, False, ahead, 0, conflicted)
+        else:
+            try:
+                repo.git.cat_file("-e", remote_sha + "^{commit}")
+            except git.GitCommandError:
+                # we don't have it.  This also updates the remote tracking branch.
+                repo.git.fetch(remote, branch)
+            if local_exists:
+                counts = repo.git.rev_list("--left-right", "--count", branch + "..." + remote_sha).split()
+                ret = SyncStatus(True, True, int(counts[0]), int(counts[1]), conflicted)
+            else:
+                # no local branch yet.  Everything on the remote is behind.
+                behind = int(repo.git.rev_list("--count", remote_sha))
+                ret = SyncStatus(True, True, 0, behind, conflicted)
+
+    with _sync_status_lock:
+        if _sync_status_cache_enabled:
+            _sync_status_cache[key] = ret
+    return ret
+
+
+def invalidate_sync_status(path: str):
+    """Forgets cached sync status for all remotes and branches of the repository at the given path (its worktree,
+    or git dir if bare)."""
+    path = os.path.realpath(path)
+    with _sync_status_lock:
+        for key in list(_sync_status_cache.keys()):
+            if key[0] == path:
+                del _sync_status_cache[key]
+
+
+def clear_sync_status_cache():
+    """Forgets all cached sync status."""
+    with _sync_status_lock:
+        _sync_status_cache.clear()
+
+
+def set_sync_status_cache_enabled(enabled: bool):
+    """Turns sync status caching on or off.  Turning it off clears the cache."""
+    global _sync_status_cache_enabled
+    with _sync_status_lock:
+        _sync_status_cache_enabled = enabled
+        if not enabled:
+            _sync_status_cache.clear()
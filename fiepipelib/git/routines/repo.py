@@ -1,27 +1,136 @@
+import collections
 import git
 import pathlib
 import shutil
 import os
 import stat
+import threading
+import typing
+
+from fiepipelib.git.routines.status import get_status
 
 class NoSuchRepoError(git.GitError):
     pass
 
+def _is_git_dir(path:str) -> bool:
+    if not os.path.isfile(os.path.join(path, "HEAD")):
+        return False
+    # linked worktrees share objects and refs through their commondir.
+    if os.path.isfile(os.path.join(path, "commondir")):
+        return True
+    return os.path.isdir(os.path.join(path, "objects")) and os.path.isdir(os.path.join(path, "refs"))
+
 def RepoExists(path):
-    if not pathlib.Path(path).exists:
+    """Whether there's a git repository (a worktree, including submodules and linked worktrees, or a bare
+    repository) at the path.  Only looks at the filesystem.  Doesn't open the repository."""
+    if not os.path.isdir(path):
         return False
-    try:
-        repo = git.Repo(path)
-        del(repo)
-    except:
+    dot_git = os.path.join(path, ".git")
+    if os.path.isdir(dot_git):
+        return _is_git_dir(dot_git)
+    if os.path.isfile(dot_git):
+        # submodules and linked worktrees have a 'gitdir: <path>' file.
+        try:
+            with open(dot_git, "r") as f:
+                content = f.read().strip()
+        except OSError:
+            return False
+        if not content.startswith("gitdir:"):
+            return False
+        git_dir = content[len("gitdir:"):].strip()
+        if not os.path.isabs(git_dir):
+            git_dir = os.path.join(path, git_dir)
+        return _is_git_dir(git_dir)
+    return _is_git_dir(path)
+
+# the most repositories each thread keeps open.
+REPO_CACHE_SIZE = 16
+
+_repo_cache_local = threading.local()
+_repo_caches: typing.List[typing.Dict[str, git.Repo]] = []
+_repo_caches_lock = threading.Lock()
+_repo_caches_pid: int = None
+# caches inherited over a fork.  Kept referenced so they're never closed, which would kill the parent's git
+# processes.
+_forked_repo_caches: typing.List[typing.Dict[str, git.Repo]] = []
+
+def _get_thread_repo_cache() -> typing.Dict[str, git.Repo]:
+    global _repo_caches, _repo_caches_pid
+    pid = os.getpid()
+    with _repo_caches_lock:
+        if _repo_caches_pid != pid:
+            if _repo_caches_pid is not None:
+                _forked_repo_caches.extend(_repo_caches)
+            _repo_caches = []
+            _repo_caches_pid = pid
+            _repo_cache_local.__dict__.clear()
+        cache = getattr(_repo_cache_local, "cache", None)
+        if cache is None:
+            cache = collections.OrderedDict()
+            _repo_cache_local.cache = cache
+            _repo_caches.append(cache)
+        return cache
+
+def _is_cached_repo_valid(repo:git.Repo) -> bool:
+    if not os.path.isdir(repo.git_dir):
+        return False
+    if repo.working_tree_dir is not None and not os.path.exists(os.path.join(repo.working_tree_dir, ".git")):
         return False
-    #try:
-    #   repo.rev_parse("")
-    #except:
-    #    return False
     return True
 
+def get_repo(path:str) -> git.Repo:
+    """Returns a git.Repo for the path, reusing one this thread already has open when possible.
+
+    Reusing a Repo reuses its persistent 'git cat-file' processes, rather than starting new ones.  Each thread
+    keeps its own least-recently-used set of REPO_CACHE_SIZE repositories, since a Repo isn't safe to share
+    between threads.  Don't hand the result to another thread.
+
+    Raises like git.Repo if there's no repository there.
+    """
+    key = os.path.realpath(path)
+    cache = _get_thread_repo_cache()
+    repo = cache.get(key, None)
+    if repo is not None:
+        # it might have been deleted, or (for a submodule) deinitialized, since.
+        if _is_cached_repo_valid(repo):
+            cache.move_to_end(key)
+            return repo
+        del cache[key]
+        repo.close()
+    repo = git.Repo(path)
+    cache[key] = repo
+    while len(cache) > REPO_CACHE_SIZE:
+        evicted_key, evicted = cache.popitem(last=False)
+        evicted.close()
+    return repo
+
+def evict_repo(path:str):
+    """Closes and forgets any cached Repos (on any thread) for the path, or inside it.  Call before deleting or
+    moving a repository."""
+    key = os.path.realpath(path)
+    with _repo_caches_lock:
+        caches = list(_repo_caches)
+    for cache in caches:
+        for cached_key in list(cache.keys()):
+            if cached_key == key or cached_key.startswith(key + os.sep):
+                repo = cache.pop(cached_key, None)
+                if repo is not None:
+                    repo.close()
+
+def close_cached_repos():
+    """Closes all cached Repos and their git processes, on all threads.  Only call when no git work is running,
+    e.g. between automanager cycles or at shutdown."""
+    with _repo_caches_lock:
+        caches = list(_repo_caches)
+    for cache in caches:
+        for key in list(cache.keys()):
+            repo = cache.pop(key, None)
+            if repo is not None:
+                repo.close()
+
 def DeleteLocalRepo(path):
+    # open handles (and their git processes) would keep files locked on windows.
+    evict_repo(path)
     #git makes its object files 'readonly' which freaks out shutil on windows.
     #the onerror implementation detects this and tries to change readonly permission first.
     shutil.rmtree(path,onerror=onerror)
@@ -78,17 +187,5 @@ def CloneFrom(src:str, dst:str):
 
 
 def is_in_conflict(repo:git.Repo) -> bool:
-
-    # checking for conflicts
-    unmerged_blobs = repo.index.unmerged_blobs()
-
-    conflicted = False
-
-    for path in unmerged_blobs:
-        list_of_blobs = unmerged_blobs[path]
-        for (stage, blob) in list_of_blobs:
-            # Now we can check each stage to see whether there were any conflicts
-            if stage != 0:
-                conflicted = True
-
-    return conflicted
+    # unmerged entries in the status snapshot.  Saves parsing the whole index in python.
+    return get_status(repo).is_conflicted()
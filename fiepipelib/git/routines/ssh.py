@@ -0,0 +1,189 @@
+import os
+import os.path
+import shutil
+import stat
+import subprocess
+import tempfile
+import threading
+import typing
+
+# seconds an idle master connection stays up after its last use.  Also bounds how long a master can outlive a
+# session that crashed before it could clean up.
+SSH_CONTROL_PERSIST = 600
+
+# seconds to wait on ssh to start or check a master connection.
+SSH_MASTER_TIMEOUT = 30
+
+
+class SSHMultiplexingSession(object):
+    """Shares one SSH connection per host across all git-over-SSH operations, using OpenSSH's ControlMaster.
+
+    While started, GIT_SSH_COMMAND is set for this process so GitPython and git subprocesses go through the
+    shared master connections, rather than doing a full handshake each.  Masters are started (and restarted if
+    unhealthy) with ensure_master and are shut down when the session stops.
+
+    Usually used as a context manager around an automanager run or a shell session:
+
+    with SSHMultiplexingSession() as session:
+        session.ensure_master("git@gitlab.example.com")
+        ...
+
+    Does nothing where OpenSSH multiplexing isn't available (e.g. Windows) or if the user has already set
+    GIT_SSH_COMMAND or GIT_SSH themselves.
+    """
+
+    _requested_dir: str = None
+    _control_dir: str = None
+    _persist: int = SSH_CONTROL_PERSIST
+    _active: bool = False
+    _previous_command: str = None
+    _created_dir: str = None
+    _hosts: typing.Set[str] = None
+
+    def __init__(self, control_dir: str = None, persist: int = SSH_CONTROL_PERSIST):
+        # None picks a default when started, since the default can't be built where this isn't supported.
+        self._requested_dir = control_dir
+        self._control_dir = control_dir
+        self._persist = persist
+        self._hosts = set()
+        self._lock = threading.Lock()
+
+    def is_supported(self) -> bool:
+        if os.name == 'nt':
+            return False
+        if "GIT_SSH_COMMAND" in os.environ or "GIT_SSH" in os.environ:
+            return False
+        return shutil.which("ssh") is not None
+
+    def is_active(self) -> bool:
+        return self._active
+
+    def _control_options(self) -> typing.List[str]:
+        return ["-o", "ControlMaster=auto",
+                "-o", "ControlPath=" + os.path.join(self._control_dir, "%C"),
+                "-o", "ControlPersist=" + str(self._persist)]
+
+    def get_ssh_command(self) -> str:
+        """The ssh command git should use while this session is active."""
+        return " ".join(["ssh"] + self._control_options())
+
+    def _make_control_dir(self) -> str:
+        """Makes (or reuses) the directory the control sockets live in and returns its path.
+
+        Prefers the per-user $XDG_RUNTIME_DIR, so masters are shared between sessions.  Otherwise a fresh private
+        temp dir, removed again on stop.  Control sockets have short path limits.  So we keep these short.
+        """
+        if self._requested_dir is not None:
+            os.makedirs(self._requested_dir, mode=0o700, exist_ok=True)
+            return self._requested_dir
+        runtime_dir = os.environ.get("XDG_RUNTIME_DIR", None)
+        if runtime_dir is not None and os.path.isdir(runtime_dir):
+            path = os.path.join(runtime_dir, "fiepipe_ssh")
+            try:
+                os.mkdir(path, 0o700)
+            except FileExistsError:
+                pass
+            return path
+        self._created_dir = tempfile.mkdtemp(prefix="fiepipe_ssh_")
+        return self._created_dir
+
+    def _is_private_dir(self, path: str) -> bool:
+        """Whether the path is a real directory (not a link), owned by us and only accessible by us.  Anyone else
+        who can get into the control dir can ride our authenticated connections."""
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return False
+        return (stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid()
+                and stat.S_IMODE(st.st_mode) == 0o700)
+
+    def _remove_created_dir(self):
+        if self._created_dir is not None:
+            shutil.rmtree(self._created_dir, ignore_errors=True)
+            self._created_dir = None
+
+    def start(self):
+        """Starts the session.  Sets GIT_SSH_COMMAND for this process.
+
+        Refuses to start (and so does nothing) if the control dir isn't private to this user.
+        """
+        if self._active or not self.is_supported():
+            return
+        try:
+            self._control_dir = self._make_control_dir()
+        except OSError:
+            self._remove_created_dir()
+            return
+        if not self._is_private_dir(self._control_dir):
+            self._remove_created_dir()
+            return
+        self._previous_command = os.environ.get("GIT_SSH_COMMAND", None)
+        os.environ["GIT_SSH_COMMAND"] = self.get_ssh_command()
+        self._active = True
+
+    def check_master(self, user_host: str) -> bool:
+        """Returns whether a healthy master connection to the host is up.  Blocking."""
+        if not self._active:
+            return False
+        try:
+            result = subprocess.run(["ssh"] + self._control_options() + ["-O", "check", user_host],
+                                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                    timeout=SSH_MASTER_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            return False
+        return result.returncode == 0
+
+    def ensure_master(self, user_host: str) -> bool:
+        """Makes sure a healthy master connection to the host (e.g. 'git@gitlab.example.com') is up, starting or
+        restarting it if needed.  Blocking.
+
+        Returns False if one couldn't be started.  Git will still work, it'll just make its own connections.
+        """
+        if not self._active:
+            return False
+        with self._lock:
+            if self.check_master(user_host):
+                return True
+            # a dead master can leave its socket behind.  ssh -O exit cleans it up if it's there.
+            self._exit_master(user_host)
+            try:
+                result = subprocess.run(
+                    ["ssh"] + self._control_options() + ["-o", "BatchMode=yes", "-M", "-N", "-f", user_host],
+                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                    timeout=SSH_MASTER_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                return False
+            if result.returncode != 0:
+                return False
+            self._hosts.add(user_host)
+            return True
+
+    def _exit_master(self, user_host: str):
+        try:
+            subprocess.run(["ssh"] + self._control_options() + ["-O", "exit", user_host],
+                           stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                           timeout=SSH_MASTER_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            pass
+
+    def stop(self):
+        """Shuts down the master connections this session started and restores GIT_SSH_COMMAND."""
+        if not self._active:
+            return
+        with self._lock:
+            for user_host in self._hosts:
+                self._exit_master(user_host)
+            self._hosts.clear()
+        if self._previous_command is None:
+            del os.environ["GIT_SSH_COMMAND"]
+        else:
+            os.environ["GIT_SSH_COMMAND"] = self._previous_command
+        self._remove_created_dir()
+        self._active = False
+
+    def __enter__(self) -> 'SSHMultiplexingSession':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
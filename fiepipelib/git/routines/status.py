@@ -0,0 +1,200 @@
+import os.path
+import threading
+import typing
+
+import git
+
+
+class WorkingTreeStatus(object):
+    """A snapshot of a working tree's state, parsed from one 'git status --porcelain=v2 -z --branch'."""
+
+    _index_changed: typing.List[typing.Tuple[str, bool]] = None
+    _worktree_changed: typing.List[typing.Tuple[str, bool]] = None
+    _untracked: typing.List[str] = None
+    _conflicted: typing.List[str] = None
+    _head_branch: str = None
+    _head_commit: str = None
+    _upstream: str = None
+    _ahead: int = 0
+    _behind: int = 0
+
+    def __init__(self):
+        self._index_changed = []
+        self._worktree_changed = []
+        self._untracked = []
+        self._conflicted = []
+
+    def is_index_dirty(self, submodules: bool = True) -> bool:
+        """Whether there are staged changes.  Like GitPython's is_dirty(index=True)."""
+        for path, is_submodule in self._index_changed:
+            if submodules or not is_submodule:
+                return True
+        return False
+
+    def is_worktree_dirty(self, submodules: bool = True) -> bool:
+        """Whether tracked files have unstaged changes.  Like GitPython's is_dirty(working_tree=True)."""
+        for path, is_submodule in self._worktree_changed:
+            if submodules or not is_submodule:
+                return True
+        return False
+
+    def has_untracked(self) -> bool:
+        return len(self._untracked) != 0
+
+    def get_untracked(self) -> typing.List[str]:
+        """Untracked paths, as git status reports them.  Wholly untracked directories are listed once, not by
+        file."""
+        return self._untracked.copy()
+
+    def is_dirty(self, index: bool = True, working_tree: bool = True, untracked_files: bool = False,
+                 submodules: bool = True) -> bool:
+        """Same arguments and meaning as GitPython's Repo.is_dirty."""
+        if index and self.is_index_dirty(submodules):
+            return True
+        if working_tree and self.is_worktree_dirty(submodules):
+            return True
+        if untracked_files and self.has_untracked():
+            return True
+        return False
+
+    def is_conflicted(self) -> bool:
+        """Whether the index has unresolved conflicts (unmerged entries)."""
+        return len(self._conflicted) != 0
+
+    def get_conflicted(self) -> typing.List[str]:
+        return self._conflicted.copy()
+
+    def get_head_branch(self) -> str:
+        """The checked out branch.  None if detached."""
+        return self._head_branch
+
+    def get_head_commit(self) -> str:
+        """The sha of HEAD.  None if there are no commits yet."""
+        return self._head_commit
+
+    def is_detached(self) -> bool:
+        return self._head_branch is None
+
+    def get_upstream(self) -> str:
+        """The upstream branch (e.g. 'origin/master').  None if there isn't one."""
+        return self._upstream
+
+    def get_commits_ahead(self) -> int:
+        """Local commits the upstream doesn't have, as of the last fetch.  0 without an upstream."""
+        return self._ahead
+
+    def get_commits_behind(self) -> int:
+        """Upstream commits, as of the last fetch, that the local branch doesn't have.  0 without an upstream."""
+        return self._behind
+
+
+def parse_porcelain_v2(output: str) -> WorkingTreeStatus:
+    """Parses the output of 'git status --porcelain=v2 -z --branch'."""
+    ret = WorkingTreeStatus()
+    fields = output.split("\0")
+    i = 0
+    while i < len(fields):
+        field = fields[i]
+        i += 1
+        if len(field) == 0:
+            continue
+        if field.startswith("# "):
+            header = field[2:].split(" ")
+            if header[0] == "branch.oid" and header[1] != "(initial)":
+                ret._head_commit = header[1]
+            elif header[0] == "branch.head" and header[1] != "(detached)":
+                ret._head_branch = header[1]
+            elif header[0] == "branch.upstream":
+                ret._upstream = header[1]
+            elif header[0] == "branch.ab":
+                ret._ahead = int(header[1].lstrip("+"))
+                ret._behind = int(header[2].lstrip("-"))
+        elif field[0] == "1" or field[0] == "2":
+            # 1 XY sub mH mI mW hH hI path
+            # 2 XY sub mH mI mW hH hI Xscore path, followed by the original path as its own field.
+            parts = field.split(" ", 9 if field[0] == "2" else 8)
+            xy = parts[1]
+            is_submodule = parts[2].startswith("S")
+            path = parts[-1]
+            if xy[0] != ".":
+                ret._index_changed.append((path, is_submodule))
+            if xy[1] != ".":
+                ret._worktree_changed.append((path, is_submodule))
+            if field[0] == "2":
+                i += 1
+        elif field[0] == "u":
+            # u XY sub m1 m2 m3 mW h1 h2 h3 path
+            parts = field.split(" ", 10)
+            is_submodule = parts[2].startswith("S")
+            path = parts[-1]
+            ret._conflicted.append(path)
+            ret._index_changed.append((path, is_submodule))
+            ret._worktree_changed.append((path, is_submodule))
+        elif field[0] == "?":
+            ret._untracked.append(field[2:])
+    return ret
+
+
+_status_cache: typing.Dict[typing.Tuple[str, bool], WorkingTreeStatus] = {}
+_status_cache_enabled = False
+_status_lock = threading.Lock()
+
+
+def get_status(repo: typing.Union[git.Repo, str], use_cache: bool = True,
+               submodules: bool = True) -> WorkingTreeStatus:
+    """Takes a status snapshot of the repository (or the worktree at the given path) with one git call.  Given a
+    path, no Repo is opened.
+
+    Snapshots are only cached while the status cache is enabled; the automanager enables it for its cycles.
+    Anything that changes a working tree while it's enabled should call invalidate_status for it.
+
+    @param submodules: False to leave submodules out entirely ('--ignore-submodules=all'), like GitPython's
+    is_dirty(submodules=False).  git then doesn't look inside their working trees, which is much faster on big
+    roots.
+    """
+    if isinstance(repo, str):
+        path = repo
+        runner = git.Git(path)
+    else:
+        path = repo.working_tree_dir
+        runner = repo.git
+    key = (os.path.realpath(path), submodules)
+    if use_cache:
+        with _status_lock:
+            if _status_cache_enabled and key in _status_cache:
+                return _status_cache[key]
+
+    # --no-optional-locks keeps us from refreshing (and locking) the index under concurrent git operations.
+    command = ["git", "--no-optional-locks", "status", "--porcelain=v2", "-z", "--branch"]
+    if not submodules:
+        command.append("--ignore-submodules=all")
+    output = runner.execute(command)
+    ret = parse_porcelain_v2(output)
+
+    with _status_lock:
+        if _status_cache_enabled:
+            _status_cache[key] = ret
+    return ret
+
+
+def invalidate_status(path: str):
+    """Forgets the cached status snapshots of the working tree at the given path."""
+    path = os.path.realpath(path)
+    with _status_lock:
+        for submodules in [True, False]:
+            _status_cache.pop((path, submodules), None)
+
+
+def clear_status_cache():
+    """Forgets all cached status snapshots."""
+    with _status_lock:
+        _status_cache.clear()
+
+
+def set_status_cache_enabled(enabled: bool):
+    """Turns status snapshot caching on or off.  Turning it off clears the cache."""
+    global _status_cache_enabled
+    with _status_lock:
+        _status_cache_enabled = enabled
+        if not enabled:
+            _status_cache.clear()
@@ -88,6 +88,16 @@ def CreateEmpty(repo, subpath, name, url: str = None):
     return ret
 
 
+# the most paths we pass to one git command.  Keeps us under command line length limits.
+PATHS_PER_COMMAND = 100
+
+
+def chunks(items: typing.List, size: int) -> typing.Iterator[typing.List]:
+    """Splits the items into consecutive lists of at most size items.  e.g. chunks(paths, PATHS_PER_COMMAND)"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
 def ChangeURL(repo, name, url, revertGitModulesFile=True):
     """Changes the urls in all places. Optionally reverting changes to the .gitmodules file.
 
@@ -105,12 +115,65 @@ def ChangeURL(repo, name, url, revertGitModulesFile=True):
 
     Note this doesn't actually run an update or fetch.  It just gets you ready to do so.
     """
+    ChangeURLs(repo, {name: url}, revertGitModulesFile)
+
+
+def ChangeURLs(repo, urls: typing.Dict[str, str], revertGitModulesFile=True):
+    """ChangeURL for many submodules of the same repository at once.
+
+    The .gitmodules file is read and written once (and once more to revert), rather than once per submodule, and
+    only one sync is run, for just the given submodules.
+
+    @param urls: new urls by submodule name
+    """
     assert isinstance(repo, git.Repo)
-    old = GetURL(repo, name)
-    SetURL(repo, name, url)
-    Sync(repo)
+    if len(urls) == 0:
+        return
+    old = SetURLs(repo, urls)
+    paths = []
+    for name in urls.keys():
+        paths.append(old[name][1])
+    Sync(repo, paths)
     if (revertGitModulesFile):
-        SetURL(repo, name, old)
+        SetURLs(repo, dict([(name, old[name][0]) for name in urls.keys()]))
+
+
+def GetURLs(repo) -> typing.Dict[str, str]:
+    """Gets the urls of all submodules from the current .gitmodules file, by name, with one read."""
+    assert isinstance(repo, git.Repo)
+    ret = {}
+    reader = git.GitConfigParser(os.path.join(repo.working_tree_dir, ".gitmodules"), read_only=True)
+    try:
+        for section in reader.sections():
+            if section.startswith('submodule "') and reader.has_option(section, "url"):
+                ret[section[len('submodule "'):-1]] = reader.get_value(section, "url")
+    finally:
+        reader.release()
+    return ret
+
+
+def SetURLs(repo, urls: typing.Dict[str, str]) -> typing.Dict[str, typing.Tuple[str, str]]:
+    """Sets the urls of many submodules in the .gitmodules file, with one read and one write.
+
+    @param urls: new urls by submodule name
+    @return: the previous (url, path) of each submodule, by name
+    @raise KeyError: if a submodule isn't in the .gitmodules file.  Nothing is written in that case.
+    """
+    assert isinstance(repo, git.Repo)
+    ret = {}
+    writer = git.GitConfigParser(os.path.join(repo.working_tree_dir, ".gitmodules"), read_only=False)
+    try:
+        for name, url in urls.items():
+            section = 'submodule "' + name + '"'
+            if not writer.has_section(section):
+                raise KeyError("No such submodule: " + name)
+            ret[name] = (writer.get_value(section, "url"), writer.get_value(section, "path"))
+        for name, url in urls.items():
+            writer.set_value('submodule "' + name + '"', "url", url)
+        writer.write()
+    finally:
+        writer.release()
+    return ret
 
 
 def GetURL(repo, name):
@@ -132,10 +195,17 @@ def SetURL(repo, name, url):
     # ret = ret + repo.git.config("--file=.gitmodules","submodule."+ name + ".branch " + branch)
 
 
-def Sync(repo):
+def Sync(repo, paths: typing.List[str] = None):
     """Pushes the url from .gitmodules to the local repository configurations.
+
+    @param paths: only sync the submodules at these paths (relative to the repo's worktree).  None for all.
     """
-    return repo.git.submodule("sync")
+    if paths is None:
+        return repo.git.submodule("sync")
+    ret = []
+    for chunk in chunks(paths, PATHS_PER_COMMAND):
+        ret.append(repo.git.submodule("sync", "--", *chunk))
+    return "\n".join(ret)
 
 
 def CreateFromSubDirectory(repo, subpath, name, forgedHistory=False, url: str = None) -> git.Submodule:
@@ -33,10 +33,14 @@ class GitLabServer(object):
     def get_private_token(self) -> str:
         return self._private_token
 
+    def get_ssh_user_host(self) -> str:
+        """The user@host git connects to over SSH"""
+        return "git@" + self.get_hostname()
+
     def get_ssh_url(self, group: str, name: str):
         if not name.endswith(".git"):
             name = name + ".git"
-        return "git@" + self.get_hostname() + ":" + group + "/" + name
+        return self.get_ssh_user_host() + ":" + group + "/" + name
 
     def get_https_url(self, group: str, name: str):
         if not name.endswith(".git"):
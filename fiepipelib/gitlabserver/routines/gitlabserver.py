@@ -1,16 +1,25 @@
 import abc
+import asyncio
 import os
 import os.path
 import os.path
 import pathlib
+import threading
+import time
 import typing
 import gitlab
+import gitlab.exceptions
 
 import git
 
-from fiepipelib.git.routines.remote import create_update_remote, get_commits_behind, get_commits_ahead, exists
-from fiepipelib.git.routines.repo import RepoExists, DeleteLocalRepo, is_in_conflict
-from fiepipelib.git.routines.submodules import SetURL,GetURL,ChangeURL
+from fiepipelib.git.routines.executor import execute_routine, git_command_routine
+from fiepipelib.git.routines.lfs import GetSharedLFSStorage, SetSharedLFSStorage, SharedLFSStorageArgs, \
+    LFSFetchProfile, GetFetchProfile, SetFetchProfile, SKIP_SMUDGE_ENV, hydrate_routine
+from fiepipelib.git.routines.remote import create_update_remote, create_update_remote_at_path, exists, \
+    get_sync_status, invalidate_sync_status, SyncStatus
+from fiepipelib.git.routines.repo import RepoExists, DeleteLocalRepo, is_in_conflict, get_repo
+from fiepipelib.git.routines.status import get_status, invalidate_status
+from fiepipelib.git.routines.submodules import SetURL,GetURL,ChangeURL,ChangeURLs,PATHS_PER_COMMAND,chunks
 from fiepipelib.gitlabserver.data.gitlab_server import GitLabServer, GitLabServerManager
 from fiepipelib.locallymanagedtypes.routines.localmanaged import AbstractLocalManagedInteractiveRoutines
 from fiepipelib.localplatform.routines.localplatform import get_local_platform_routines
@@ -56,45 +65,228 @@ class GitLabServerRoutines(object):
         server = self.get_server()
         return server.get_ssh_url(group_name, "fiepipe_" + type_name + ".git")
 
+    def _mangle_id(self, id: str) -> str:
+        mangled_id = str(id)
+        mangled_id = mangled_id.replace("-", "")
+        mangled_id = mangled_id.replace("_", "")
+        mangled_id = mangled_id.replace(" ", "")
+        return mangled_id
+
+    def project_name_for_gitroot(self, root_id: str) -> str:
+        """The name (path) of the gitlab project for a root.  e.g. fiepipe_gitroot_abc123"""
+        return "fiepipe_gitroot_" + self._mangle_id(root_id)
+
+    def project_name_for_gitasset(self, asset_id: str) -> str:
+        """The name (path) of the gitlab project for an asset.  e.g. fiepipe_gitasset_abc123"""
+        return "fiepipe_gitasset_" + self._mangle_id(asset_id)
+
     def remote_path_for_gitroot(self, group_name: str, root_id: str) -> str:
         server = self.get_server()
-        mangled_root_id = str(root_id)
-        mangled_root_id = mangled_root_id.replace("-", "")
-        mangled_root_id = mangled_root_id.replace("_", "")
-        mangled_root_id = mangled_root_id.replace(" ", "")
-        return server.get_ssh_url(group_name, "fiepipe_gitroot_" + mangled_root_id + ".git")
+        return server.get_ssh_url(group_name, self.project_name_for_gitroot(root_id) + ".git")
 
     def remote_path_for_gitasset(self, group_name: str, asset_id: str) -> str:
         server = self.get_server()
-        mangled_asset_id = str(asset_id)
-        mangled_asset_id = mangled_asset_id.replace("-", "")
-        mangled_asset_id = mangled_asset_id.replace("_", "")
-        mangled_asset_id = mangled_asset_id.replace(" ", "")
-        return server.get_ssh_url(group_name, "fiepipe_gitasset_" + mangled_asset_id + ".git")
+        return server.get_ssh_url(group_name, self.project_name_for_gitasset(asset_id) + ".git")
+
+    def get_gitlab_client(self) -> gitlab.Gitlab:
+        """Gets a python-gitlab client for this server's API.
+
+        Clients are shared per server, per process, so their HTTP session (and its kept-alive connections) are
+        reused.  A new one is made if the server's hostname or token changes."""
+        server = self.get_server()
+        url = "https://" + server.get_hostname()
+        token = server.get_private_token()
+        with _clients_lock:
+            found = _clients.get(self.get_server_name(), None)
+            if found is not None and found[0] == url and found[1] == token:
+                return found[2]
+            client = gitlab.Gitlab(url=url, private_token=token)
+            _clients[self.get_server_name()] = (url, token, client)
+            return client
+
+    def _get_cached_metadata(self, key: typing.Tuple, fetch: typing.Callable[[], typing.Any]):
+        """Returns the cached value for the key if it hasn't expired.  Otherwise fetches, caches and returns it."""
+        key = (self.get_server_name(),) + key
+        now = time.monotonic()
+        with _metadata_lock:
+            found = _metadata_cache.get(key, None)
+            if found is not None and found[0] > now:
+                return found[1]
+        value = fetch()
+        with _metadata_lock:
+            _metadata_cache[key] = (now + GITLAB_METADATA_TTL, value)
+        return value
+
+    def invalidate_metadata(self, group_name: str):
+        """Forgets cached metadata for a group and its projects.  Call after changing them on the server."""
+        with _metadata_lock:
+            for key in list(_metadata_cache.keys()):
+                if key[0] == self.get_server_name() and key[2] == group_name:
+                    del _metadata_cache[key]
+
+    def get_group(self, group_name: str):
+        """Gets a group by its path with a direct GET, rather than listing groups.  Returns None if there is no
+        such group.  Cached for GITLAB_METADATA_TTL seconds."""
+
+        def fetch():
+            try:
+                return self.get_gitlab_client().groups.get(group_name)
+            except gitlab.exceptions.GitlabGetError as err:
+                if err.response_code == 404:
+                    return None
+                raise
+
+        return self._get_cached_metadata(("group", group_name), fetch)
+
+    def get_project(self, group_name: str, project_name: str):
+        """Gets a project by its group and path with a direct GET.  Returns None if there is no such project.
+        Cached for GITLAB_METADATA_TTL seconds."""
+
+        def fetch():
+            try:
+                return self.get_gitlab_client().projects.get(group_name + "/" + project_name)
+            except gitlab.exceptions.GitlabGetError as err:
+                if err.response_code == 404:
+                    return None
+                raise
+
+        return self._get_cached_metadata(("project", group_name, project_name), fetch)
+
+    def list_group_project_names(self, group_name: str, prefix: str = "fiepipe_") -> typing.Set[str]:
+        """Lists the names (paths) of the projects in a group, via the GitLab API, with as few paginated calls
+        as the server allows.  Only names starting with the prefix are returned.  Cached for
+        GITLAB_METADATA_TTL seconds.
+
+        A group that doesn't exist has no projects.  Other API failures raise.
+        """
+
+        def fetch():
+            group = self.get_group(group_name)
+            if group is None:
+                return frozenset()
+            ret = set()
+            for project in group.projects.list(all=True, per_page=100, search=prefix, simple=True):
+                if project.path.startswith(prefix):
+                    ret.add(project.path)
+            return frozenset(ret)
+
+        return set(self._get_cached_metadata(("project_names", group_name, prefix), fetch))
+
+    def get_group_prober(self, group_name: str) -> "GitLabGroupProjectsProber":
+        """Gets a prober for the group's projects.  Probers are shared per server and group until
+        clear_group_probers is called.  The automanager does this every cycle."""
+        key = (self.get_server_name(), group_name)
+        with _probers_lock:
+            if key not in _probers:
+                _probers[key] = GitLabGroupProjectsProber(self, group_name)
+            return _probers[key]
 
     def group_name_from_fqdn(self, fqdn: str):
         return "fiepipe." + fqdn
 
     def provision_fqdn(self, fqdn: str):
-        server = self.get_server()
         groupname = self.group_name_from_fqdn(fqdn)
-        gitlab_server = gitlab.Gitlab(url="https://" + server.get_hostname(),private_token=server.get_private_token())
 
         #check for existitng group
 
-        fqdn_group = None
-        for group in gitlab_server.groups.list():
-            if group.name == groupname:
-                fqdn_group = group
-                break
+        fqdn_group = self.get_group(groupname)
 
         #create if neccesary
         if fqdn_group == None:
             fqdn_group = {'name':groupname,'path':groupname,'visibility':'private','lfs_enabled':True}
-            gitlab_server.groups.create(fqdn_group)
+            self.get_gitlab_client().groups.create(fqdn_group)
+            self.invalidate_metadata(groupname)
+
+
+
+
+
+class GitLabGroupProjectsProber(object):
+    """Answers whether fiepipe projects exist in a GitLab group, from one listing of the group's projects through
+    the GitLab API, rather than an ls-remote (and an SSH handshake) per repository.
+
+    The listing is loaded on first use and kept until refresh is called.  If the API can't be used (e.g. no
+    private token) is_available returns False and callers should fall back to asking git.
+    """
+
+    _server_routines: GitLabServerRoutines = None
+    _group_name: str = None
+    _names: typing.Set[str] = None
+    _failed: bool = False
+
+    def __init__(self, server_routines: GitLabServerRoutines, group_name: str):
+        self._server_routines = server_routines
+        self._group_name = group_name
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            self._failed = False
+            self._names = None
+            try:
+                self._names = self._server_routines.list_group_project_names(self._group_name)
+            except (gitlab.exceptions.GitlabError, IOError, KeyError):
+                self._failed = True
+
+    def refresh(self):
+        """Loads the group's project listing from the server, again, bypassing cached metadata.  Blocking."""
+        self._server_routines.invalidate_metadata(self._group_name)
+        self._load()
+
+    def is_available(self) -> bool:
+        """Loads the listing if it hasn't been yet (blocking) and returns whether it could be."""
+        if self._names is None and not self._failed:
+            self._load()
+        return not self._failed
+
+    def project_exists(self, name: str) -> bool:
+        if not self.is_available():
+            raise RuntimeError("Project listing for group " + self._group_name + " is not available.")
+        return name in self._names
+
+    def mark_exists(self, name: str):
+        """Records a project as existing.  e.g. after pushing it for the first time."""
+        if self._names is not None:
+            self._names.add(name)
+
+    def root_exists(self, root_id: str) -> bool:
+        return self.project_exists(self._server_routines.project_name_for_gitroot(root_id))
+
+    def asset_exists(self, asset_id: str) -> bool:
+        return self.project_exists(self._server_routines.project_name_for_gitasset(asset_id))
+
 
+# seconds that gitlab group and project metadata is cached for.
+GITLAB_METADATA_TTL = 60.0
 
+# parallel clones per 'git submodule update --jobs'.
+SUBMODULE_UPDATE_JOBS = 8
 
+# the most submodules we LFS fetch and checkout at once.
+LFS_FETCH_MAX_CONCURRENT = 4
+
+_clients: typing.Dict[str, typing.Tuple[str, str, gitlab.Gitlab]] = {}
+_clients_lock = threading.Lock()
+_metadata_cache: typing.Dict[typing.Tuple, typing.Tuple[float, typing.Any]] = {}
+_metadata_lock = threading.Lock()
+
+
+def clear_gitlab_caches():
+    """Forgets all shared gitlab clients and cached metadata."""
+    with _clients_lock:
+        _clients.clear()
+    with _metadata_lock:
+        _metadata_cache.clear()
+
+
+_probers: typing.Dict[typing.Tuple[str, str], GitLabGroupProjectsProber] = {}
+_probers_lock = threading.Lock()
+
+
+def clear_group_probers():
+    """Forgets all shared group probers, so their listings are loaded again on next use."""
+    with _probers_lock:
+        _probers.clear()
 
 
 T = typing.TypeVar("T", bound=AbstractLocalManagedInteractiveRoutines)
@@ -123,36 +315,40 @@ class GitLabGitStorageRoutines(abc.ABC):
 
     def is_in_conflict(self) -> bool:
         local_repo_path = self.get_local_repo_path()
-        repo = git.Repo(local_repo_path)
+        repo = get_repo(local_repo_path)
         return is_in_conflict(repo)
 
     async def init_submodule_sub_routine(self, feedback_ui:AbstractFeedbackUI, name:str, parent_repo:git.Repo, branch:str ) -> bool:
-        server = self.get_server_routines().get_server()
+        return await init_submodules_sub_routine(feedback_ui, parent_repo.working_tree_dir, [(name, self)], branch)
+
+    async def _checkout_initialized_submodule_routine(self, feedback_ui:AbstractFeedbackUI, branch:str,
+                                                      stream_output:bool = True, lfs_storage:str = None,
+                                                      lfs_profile:LFSFetchProfile = None):
+        """@param stream_output: whether git's output is passed on to the feedback_ui.  Turned off when many run
+        at once, where it'd be interleaved.
+        @param lfs_storage: shared LFS storage to point the submodule at before fetching.  None to leave it be.
+        @param lfs_profile: which LFS files to download.  Stored in the submodule for its later pulls.  None for
+        all of them."""
         local_repo_path = self.get_local_repo_path()
         remote_url = self.get_remote_url()
-
-        await feedback_ui.output("Initing submodule: " + local_repo_path + " from: " + remote_url)
-        git_cmd = git.Git(local_repo_path)
-        submod_init_output = git_cmd.submodule("init",".")
-        #submod_init_output = parent_repo.git.submodule("init",local_repo_path)
-        await feedback_ui.output(submod_init_output)
-        await feedback_ui.output("Updating submodule: " + local_repo_path + " from: " + remote_url)
-        ChangeURL(parent_repo,name,remote_url,True)
-        submod_update_output = git_cmd.submodule("update",".")
-        #submod_update_output = parent_repo.git.submodule("update",local_repo_path)
-        await feedback_ui.output(submod_update_output)
-        repo = git.Repo(local_repo_path)
-        remote_origin = repo.remote("origin")
-        remote_origin.set_url(remote_url)
-        await feedback_ui.output("Fetching LFS objects: " + local_repo_path + " from: " + remote_url)
-        lfs_fetch_output = repo.git.lfs("fetch", remote_url, branch)
-        await feedback_ui.output(lfs_fetch_output)
-        await feedback_ui.output("Checking out master branch to latest: " + local_repo_path + " from: " + remote_url)
-        checkout_output = repo.git.checkout("-f", branch)
-        await feedback_ui.output(checkout_output)
-
-
-
+        git_feedback_ui = feedback_ui if stream_output else None
+        await execute_routine(create_update_remote_at_path, local_repo_path, "origin", remote_url)
+        if lfs_storage is not None:
+            await execute_routine(lambda: SetSharedLFSStorage(get_repo(local_repo_path), lfs_storage))
+        if lfs_profile is not None:
+            await execute_routine(lambda: SetFetchProfile(get_repo(local_repo_path), lfs_profile))
+        if lfs_profile is None or lfs_profile.is_full():
+            await feedback_ui.output("Fetching LFS objects: " + local_repo_path + " from: " + remote_url)
+            await git_command_routine(local_repo_path, ["lfs", "fetch", remote_url, branch], git_feedback_ui)
+            await feedback_ui.output("Checking out master branch to latest: " + local_repo_path + " from: " + remote_url)
+            await git_command_routine(local_repo_path, ["checkout", "-f", branch], git_feedback_ui)
+        else:
+            # checked out as pointers first, so the checkout doesn't download what the profile leaves out.
+            await feedback_ui.output("Checking out master branch to latest: " + local_repo_path + " from: " + remote_url)
+            await git_command_routine(local_repo_path, ["checkout", "-f", branch], git_feedback_ui,
+                                      env=SKIP_SMUDGE_ENV)
+            await feedback_ui.output("Fetching profiled LFS objects: " + local_repo_path + " from: " + remote_url)
+            await hydrate_routine(local_repo_path, remote_url, lfs_profile, git_feedback_ui)
 
     async def pull_sub_routine(self, feedback_ui: AbstractFeedbackUI, branch: str) -> bool:
 
@@ -163,12 +359,21 @@ class GitLabGitStorageRoutines(abc.ABC):
         await feedback_ui.output("Pulling: " + local_repo_path + " from: " + remote_url)
 
         if RepoExists(local_repo_path):
-            repo = git.Repo(local_repo_path)
-            remote = create_update_remote(repo, "origin", remote_url)
-            remote = create_update_remote(repo, server.get_name(), remote_url)
-            assert isinstance(remote, git.Remote)
+            await execute_routine(create_update_remote_at_path, local_repo_path, "origin", remote_url)
+            await execute_routine(create_update_remote_at_path, local_repo_path, server.get_name(), remote_url)
             await feedback_ui.output(("Pulling " + branch + ": " + local_repo_path + " <- " + remote_url))
-            remote.pull(branch)
+            invalidate_sync_status(local_repo_path)
+            lfs_profile = await execute_routine(lambda: GetFetchProfile(get_repo(local_repo_path)))
+            try:
+                if lfs_profile.is_full():
+                    await git_command_routine(local_repo_path, ["pull", server.get_name(), branch], feedback_ui)
+                else:
+                    # the merge leaves pointers, and we download what the profile says to.
+                    await git_command_routine(local_repo_path, ["pull", server.get_name(), branch], feedback_ui,
+                                              env=SKIP_SMUDGE_ENV)
+                    await hydrate_routine(local_repo_path, server.get_name(), lfs_profile, feedback_ui)
+            finally:
+                invalidate_status(local_repo_path)
             return True
         else:
             await feedback_ui.error(
@@ -193,19 +398,21 @@ class GitLabGitStorageRoutines(abc.ABC):
             await feedback_ui.error("No local worktree.  You might need to create or pull it first.")
             return False
 
-        repo = git.Repo(local_path)
+        def is_dirty() -> bool:
+            return get_status(local_path).is_dirty(index=True, working_tree=True, untracked_files=True,
+                                                   submodules=True)
 
-        if repo.is_dirty(index=True, working_tree=True, untracked_files=True, submodules=True) and fail_on_dirty:
+        if fail_on_dirty and await execute_routine(is_dirty):
             await feedback_ui.error("Worktree is dirty.  Aborting.")
             return False
 
         # we push to the server even if there was no commit because this is a "push" command.
         # this works for submodules too, we think.  Maybe?
 
-        remote = create_update_remote(repo, server.get_name(), remote_url)
-        assert isinstance(remote, git.Remote)
+        await execute_routine(create_update_remote_at_path, local_path, server.get_name(), remote_url)
         await feedback_ui.output("Pushing " + branch + ": " + local_path + " -> " + remote_url)
-        remote.push(branch)
+        invalidate_sync_status(local_path)
+        await git_command_routine(local_path, ["push", server.get_name(), branch], feedback_ui)
         return True
 
     async def push_lfs_objects_subroutine(self, feedback_ui:AbstractFeedbackUI, branch: str):
@@ -223,12 +430,8 @@ class GitLabGitStorageRoutines(abc.ABC):
             await feedback_ui.error("No local worktree.  You might need to create or pull it first.")
             return False
 
-        repo = git.Repo(local_path)
-
-        remote = create_update_remote(repo, server.get_name(), remote_url)
-        assert isinstance(remote, git.Remote)
-        push_output = repo.git.lfs("push",server.get_name(),branch)
-        await feedback_ui.output(push_output)
+        await execute_routine(create_update_remote_at_path, local_path, server.get_name(), remote_url)
+        await git_command_routine(local_path, ["lfs", "push", server.get_name(), branch], feedback_ui)
         await feedback_ui.output("Done pushing LFS objects.")
 
 
@@ -236,18 +439,27 @@ class GitLabGitStorageRoutines(abc.ABC):
         """Meant to be called direclty by the user.  Dosen't throw on failure."""
         success = await self.push_sub_routine(feedback_ui, "master", True)
 
-    async def remote_exists(self, feedback_ui: AbstractFeedbackUI) -> bool:
+    async def sync_status_routine(self, feedback_ui: AbstractFeedbackUI, branch: str = "master",
+                                  use_cache: bool = True) -> SyncStatus:
+        """Gets whether the remote exists, and how far ahead and behind the branch is, in one go.
+        Cached until the next push or pull of this repository, or the next automanager cycle."""
         server = self.get_server_routines().get_server()
         remote_url = self.get_remote_url()
         local_path = self.get_local_repo_path()
 
-        repo = git.Repo(local_path)
         server_name = server.get_name()
 
-        await feedback_ui.output("Updating remote " + server_name + " to: " + remote_url)
-        create_update_remote(repo, server_name, remote_url)
+        def check() -> SyncStatus:
+            repo = get_repo(local_path)
+            create_update_remote(repo, server_name, remote_url)
+            return get_sync_status(repo, branch, server_name, use_cache)
+
+        await feedback_ui.output("Checking sync status of " + local_path + " against: " + remote_url)
+        return await execute_routine(check)
 
-        ret = exists(repo, server_name)
+    async def remote_exists(self, feedback_ui: AbstractFeedbackUI) -> bool:
+        status = await self.sync_status_routine(feedback_ui)
+        ret = status.exists()
         if ret:
             await feedback_ui.output("Remote exists.")
         else:
@@ -255,48 +467,144 @@ class GitLabGitStorageRoutines(abc.ABC):
         return ret
 
     async def is_behind_remote(self, feedback_ui: AbstractFeedbackUI) -> bool:
-
-        server = self.get_server_routines().get_server()
-        remote_url = self.get_remote_url()
-        local_path = self.get_local_repo_path()
-
-        repo = git.Repo(local_path)
-        server_name = server.get_name()
-
-        await feedback_ui.output("Updating remote " + server_name + " to: " + remote_url)
-        create_update_remote(repo, server_name, remote_url)
-
-        commits_behind = get_commits_behind(repo, "master", server_name)
-
-        ret =  len(commits_behind) != 0
+        status = await self.sync_status_routine(feedback_ui)
+        ret = status.is_behind()
         if ret:
             await feedback_ui.output("Local is behind Remote")
         else:
             await feedback_ui.output("Local is up to date.")
         return ret
 
-
     async def is_aheadof_remote(self, feedback_ui: AbstractFeedbackUI) -> bool:
+        status = await self.sync_status_routine(feedback_ui)
+        ret = status.is_ahead()
+        if ret:
+            await feedback_ui.output("Local is ahead of Remote")
+        else:
+            await feedback_ui.output("Remote is not behind")
+        return ret
 
-        server = self.get_server_routines().get_server()
-        remote_url = self.get_remote_url()
-        local_path = self.get_local_repo_path()
 
-        repo = git.Repo(local_path)
-        server_name = server.get_name()
+async def init_submodules_sub_routine(feedback_ui: AbstractFeedbackUI, parent_path: str,
+                                      submodules: typing.List[typing.Tuple[str, GitLabGitStorageRoutines]],
+                                      branch: str, jobs: int = SUBMODULE_UPDATE_JOBS,
+                                      max_concurrent_lfs: int = LFS_FETCH_MAX_CONCURRENT,
+                                      lfs_profile: LFSFetchProfile = None) -> bool:
+    """Inits, points at gitlab, updates and checks out many submodules of the same parent repository.
 
-        await feedback_ui.output("Updating remote " + server_name + " to: " + remote_url)
-        create_update_remote(repo, server_name, remote_url)
+    The submodules' urls are rewritten with one pass over .gitmodules and one sync, and they're inited and updated
+    with one git call each, rather than once per submodule.  The update clones up to 'jobs' submodules in
+    parallel.  Then up to max_concurrent_lfs submodules are LFS fetched and checked out at once, with progress
+    reported per submodule.
 
-        commits_ahead = get_commits_ahead(repo, "master", server_name)
+    A failure of one submodule's LFS fetch or checkout is reported and doesn't stop the others.
 
-        ret = len(commits_ahead) != 0
+    If the parent uses shared LFS storage, so do the submodules.
+
+    @param parent_path: the parent repository's working tree.
+    @param lfs_profile: which LFS files to download.  None for the parent's profile.
+
+    @param submodules: (submodule name, routines for the submodule) for each submodule.
+    @return: True if all succeeded.
+    """
+    if len(submodules) == 0:
+        return True
+    paths = []
+    urls = {}
+    for name, routines in submodules:
+        local_repo_path = routines.get_local_repo_path()
+        remote_url = routines.get_remote_url()
+        await feedback_ui.output("Initing submodule: " + local_repo_path + " from: " + remote_url)
+        paths.append(os.path.relpath(local_repo_path, parent_path))
+        urls[name] = remote_url
+
+    for chunk in chunks(paths, PATHS_PER_COMMAND):
+        await git_command_routine(parent_path, ["submodule", "init", "--"] + chunk, feedback_ui)
+    # Repos aren't shared between threads.  So the workers open their own.
+    await execute_routine(lambda: ChangeURLs(get_repo(parent_path), urls, True))
+    lfs_storage = await execute_routine(lambda: GetSharedLFSStorage(get_repo(parent_path)))
+    if lfs_profile is None:
+        lfs_profile = await execute_routine(lambda: GetFetchProfile(get_repo(parent_path)))
+    # the update's checkout only leaves pointers if we're going to be choosy about what's downloaded.
+    update_env = None if lfs_profile.is_full() else SKIP_SMUDGE_ENV
+    await feedback_ui.output("Updating " + str(len(paths)) + " submodule(s) of: " + parent_path)
+    for chunk in chunks(paths, PATHS_PER_COMMAND):
+        await git_command_routine(parent_path, SharedLFSStorageArgs(lfs_storage) +
+                                  ["submodule", "update", "--jobs", str(jobs), "--"] + chunk,
+                                  feedback_ui, env=update_env)
+
+    if len(submodules) == 1:
+        name, routines = submodules[0]
+        await routines._checkout_initialized_submodule_routine(feedback_ui, branch, lfs_storage=lfs_storage,
+                                                               lfs_profile=lfs_profile)
+        return True
+
+    semaphore = asyncio.Semaphore(max_concurrent_lfs)
+    completed = 0
+
+    async def checkout(name: str, routines: GitLabGitStorageRoutines) -> bool:
+        nonlocal completed
+        async with semaphore:
+            try:
+                await routines._checkout_initialized_submodule_routine(feedback_ui, branch, stream_output=False,
+                                                                       lfs_storage=lfs_storage,
+                                                                       lfs_profile=lfs_profile)
+                succeeded = True
+            except git.GitCommandError as err:
+                await feedback_ui.error("Failed to fetch or checkout: " + routines.get_local_repo_path())
+                await feedback_ui.error(str(err.stderr))
+                succeeded = False
+            completed += 1
+            await feedback_ui.output("[" + str(completed) + "/" + str(len(submodules)) + "] " +
+                                     ("Checked out: " if succeeded else "Failed: ") + routines.get_local_repo_path())
+            return succeeded
+
+    results = await asyncio.gather(*[checkout(name, routines) for name, routines in submodules])
+    return all(results)
+
+
+def _head_names(local_path: str) -> typing.Set[str]:
+    """The names of the repo's local branches.  Blocking.  Run it with execute_routine."""
+    return set([head.name for head in get_repo(local_path).heads])
+
+
+def _is_dirty(local_path: str, untracked_files: bool = False) -> bool:
+    """Blocking.  Run it with execute_routine."""
+    return get_status(local_path).is_dirty(index=True, working_tree=True, untracked_files=untracked_files,
+                                           submodules=True)
+
+
+def _is_conflicted(local_path: str) -> bool:
+    """Blocking.  Run it with execute_routine."""
+    return get_status(local_path).is_conflicted()
+
+
+def _list_json_files(local_path: str) -> typing.List[str]:
+    """Blocking.  Run it with execute_routine."""
+    return [item for item in os.listdir(local_path) if item.endswith(".json")]
+
+
+async def _checkout_branch_routine(local_path: str, branch: str):
+    """Force checks out the branch and raises if the worktree is dirty after."""
+    await git_command_routine(local_path, ["checkout", "--force", branch])
+    invalidate_status(local_path)
+    if await execute_routine(_is_dirty, local_path):
+        raise RuntimeError("Checkout of " + branch + " is dirty.  Won't continue.")
+
+
+async def _merge_branch_routine(feedback_ui: AbstractFeedbackUI, local_path: str, branch: str, message: str):
+    """Merges the branch into the one checked out and commits the result if the merge left it uncommitted.
+    Raises if the merge conflicted."""
+    merge_output = await git_command_routine(local_path, ["merge", "--no-edit", branch])
+    invalidate_status(local_path)
+    await feedback_ui.output(merge_output)
+    if await execute_routine(_is_conflicted, local_path):
+        raise RuntimeError("Conflicts found after merging " + branch + ".  Manual resolution required.  "
+                                                                       "Won't continue.")
+    if await execute_routine(_is_dirty, local_path):
+        await git_command_routine(local_path, ["commit", "--allow-empty", "-m", message])
+        invalidate_status(local_path)
 
-        if ret:
-            await feedback_ui.output("Local is ahead of Remote")
-        else:
-            await feedback_ui.output("Remote is not behind")
-        return ret
 
 class GitLabManagedTypeRoutines(typing.Generic[T]):
     server_routines: GitLabServerRoutines = None
@@ -332,8 +640,7 @@ class GitLabManagedTypeRoutines(typing.Generic[T]):
                 "No local worktree.  You can create an empty one with init_local or use a pull command to get an existing one.")
             return
 
-        repo = git.Repo(local_path)
-        return exists(repo,server.get_name())
+        return await execute_routine(lambda: exists(get_repo(local_path), server.get_name()))
 
     async def fetch_master_subroutine(self, group_name: str):
         """Fetches any remote changes but doesn't do anything with them.
@@ -346,21 +653,11 @@ class GitLabManagedTypeRoutines(typing.Generic[T]):
         if not RepoExists(local_path):
             raise RuntimeError("No local worktree.")
 
-        repo = git.Repo(local_path)
-
-        master_branch = None
-
-        # check for branches and create local if needed.
-        for branch in repo.heads:
-            assert isinstance(branch, git.Head)
-            if branch.name == "master":
-                master_branch = branch
-
-        if master_branch is None:
+        if "master" not in await execute_routine(_head_names, local_path):
             raise RuntimeError("There is no master branch.")
 
-        remote = create_update_remote(repo, server.get_name(), server_url)
-        remote.fetch("master")
+        await execute_routine(create_update_remote_at_path, local_path, server.get_name(), server_url)
+        await git_command_routine(local_path, ["fetch", server.get_name(), "master"])
 
     async def commit_to_local_subroutine(self, feedback_ui:AbstractFeedbackUI, group_name:str):
         """Ensures the head of the local branch matches the database exactly.
@@ -372,55 +669,47 @@ class GitLabManagedTypeRoutines(typing.Generic[T]):
         if not RepoExists(local_path):
             raise RuntimeError("No local worktree.")
 
-        repo = git.Repo(local_path)
+        heads = await execute_routine(_head_names, local_path)
 
-        local_branch = None
-        master_branch = None
-
-        #check for branches and create local if needed.
-        for branch in repo.heads:
-            assert  isinstance(branch, git.Head)
-            if branch.name == "local":
-                local_branch = branch
-            if branch.name == "master":
-                master_branch = branch
-
-        if master_branch is None:
+        if "master" not in heads:
             raise RuntimeError("There is no master branch.")
 
-        if local_branch is None:
+        #create local if needed.
+        if "local" not in heads:
             await feedback_ui.output("Creating local branch from master.")
-            branch_output = repo.git.branch("local","master")
+            branch_output = await git_command_routine(local_path, ["branch", "local", "master"])
             await feedback_ui.output(branch_output)
             await feedback_ui.output("Branch created.")
-            for branch in repo.heads:
-                assert isinstance(branch, git.Head)
-                if branch.name == "local":
-                    local_branch = branch
-                    break
-            if local_branch is None:
+            if "local" not in await execute_routine(_head_names, local_path):
                 raise RuntimeError("No local branch even though we just created it.")
 
         #check out local
-        local_branch.checkout(force=True)
+        await git_command_routine(local_path, ["checkout", "--force", "local"])
+        invalidate_status(local_path)
 
-        #we clear the dir of items
-        items = os.listdir(local_path)
-        for item in items:
-            if item.endswith(".json"):
-                os.remove(os.path.join(local_path,item))
+        #we export from the db, only writing and removing what changed.
+        written, removed = await manager_routines.ExportAllIncrementalRoutine(local_path)
 
-        #then we export from the db
-        await manager_routines.ExportAllRoutine(local_path)
+        #unchanged files that were never committed still need adding.
+        tracked = set((await git_command_routine(local_path, ["ls-files", "--", "*.json"])).splitlines())
+        untracked = [item for item in await execute_routine(_list_json_files, local_path) if item not in tracked]
 
-        #do an add
-        add_output = repo.git.add("--all")
-        await feedback_ui.output(add_output)
+        #removed files that were never committed have nothing to stage.
+        to_stage = sorted(set(written) | (set(removed) & tracked) | set(untracked))
+        if len(to_stage) == 0:
+            await feedback_ui.output("No changes to commit to local.")
+            return
+
+        #do an add of exactly those paths.  batched to stay well under command line limits.
+        batch_size = 256
+        for i in range(0, len(to_stage), batch_size):
+            add_output = await git_command_routine(local_path, ["add", "--all", "--"] + to_stage[i:i + batch_size])
+            await feedback_ui.output(add_output)
 
         #do a commit
-        if repo.is_dirty():
-            commit_output = repo.git.commit("-a","-m","\"commiting db to local.\"")
-            await feedback_ui.output(commit_output)
+        commit_output = await git_command_routine(local_path, ["commit", "-m", "\"commiting db to local.\""])
+        invalidate_status(local_path)
+        await feedback_ui.output(commit_output)
 
     async def merge_local_to_master_subroutine(self, feedback_ui:AbstractFeedbackUI, group_name:str):
         server = self.get_server_routines().get_server()
@@ -430,58 +719,27 @@ class GitLabManagedTypeRoutines(typing.Generic[T]):
             #nothing to merge.  So, done.
             return
 
-        repo = git.Repo(local_path)
-
-        local_branch = None
-        master_branch = None
+        heads = await execute_routine(_head_names, local_path)
 
-        #check for branches.
-        for branch in repo.heads:
-            assert  isinstance(branch, git.Head)
-            if branch.name == "local":
-                local_branch = branch
-            if branch.name == "master":
-                master_branch = branch
-
-        if master_branch is None:
+        if "master" not in heads:
             raise RuntimeError("There is no master branch.")
 
-        if local_branch is None:
+        if "local" not in heads:
             #nothing to merge.  So, done.
             return
 
         #checkout master
-        master_branch.checkout(force=True)
-
-        if repo.is_dirty():
-            raise RuntimeError("Checkout of master is dirty.  Won't continue.")
+        await _checkout_branch_routine(local_path, "master")
 
         #we merge local into master.
         await feedback_ui.output("Merging local into master.")
-        merge_output = repo.git.merge("--no-edit","local")
-        await feedback_ui.output(merge_output)
-
-        #repo.index.merge_tree(local_branch)
-        if is_in_conflict(repo):
-            raise RuntimeError("Conflicts found after merge.  Manual resolution required.  Won't continue.")
-        if repo.is_dirty():
-            repo.index.commit("Merged local changes to master.")
+        await _merge_branch_routine(feedback_ui, local_path, "local", "Merged local changes to master.")
 
         #if we got here, then we succesfully merged from local to master.  We merge back, to make future merges easier.
-        local_branch.checkout(force=True)
-
-        if repo.is_dirty():
-            raise RuntimeError("Checkout of local is dirty.  Won't continue.")
+        await _checkout_branch_routine(local_path, "local")
 
         await feedback_ui.output("Merging master back into local.")
-        merge_output = repo.git.merge("--no-edit","master")
-        await feedback_ui.output(merge_output)
-
-        #repo.index.merge_tree(master_branch)
-        if is_in_conflict(repo):
-            raise RuntimeError("Conflicts found after merging master back to local.  Manual resolution required.  Won't continue.")
-        if repo.is_dirty():
-            repo.index.commit("Merged master back to local.")
+        await _merge_branch_routine(feedback_ui, local_path, "master", "Merged master back to local.")
 
         #what we've done is as follows:
         #local branch consists of local versions, stacked on a recent master commit.
@@ -501,23 +759,16 @@ class GitLabManagedTypeRoutines(typing.Generic[T]):
         if not RepoExists(local_path):
             raise RuntimeError("No local worktree.")
 
-        repo = git.Repo(local_path)
+        heads = await execute_routine(_head_names, local_path)
 
-        master_branch = None
-
-        #check for branches and create local if needed.
-        for branch in repo.heads:
-            assert  isinstance(branch, git.Head)
-            if branch.name == "master":
-                master_branch = branch
-
-        if master_branch is None:
+        if "master" not in heads:
             raise RuntimeError("There is no master branch.")
 
         #check out master
-        master_branch.checkout(force=True)
+        await git_command_routine(local_path, ["checkout", "--force", "master"])
+        invalidate_status(local_path)
 
-        if repo.is_dirty():
+        if await execute_routine(_is_dirty, local_path):
             raise RuntimeError("Master branch is dirty after checkout.  Won't import dirty data to db.")
 
 
@@ -532,12 +783,10 @@ class GitLabManagedTypeRoutines(typing.Generic[T]):
 
         #if we got here, we succesfully imported from master.
         #now we kill the local branch completely and create it from master
-        for branch in repo.heads:
-            assert  isinstance(branch, git.Head)
-            if branch.name == "local":
-                git.Head.delete(repo,"local",force=True)
-                branch_output = repo.git.branch("local", "master")
-                await feedback_ui.output(branch_output)
+        if "local" in heads:
+            await git_command_routine(local_path, ["branch", "--delete", "--force", "local"])
+            branch_output = await git_command_routine(local_path, ["branch", "local", "master"])
+            await feedback_ui.output(branch_output)
 
     async def push_commits_subroutine(self, feedback_ui, group_name):
         server = self.get_server_routines().get_server()
@@ -546,12 +795,10 @@ class GitLabManagedTypeRoutines(typing.Generic[T]):
         local_path = self.get_server_routines().local_path_for_type_registry(server.get_name(), group_name,
                                                                              self.get_typename())
 
-        repo = git.Repo(local_path)
-
         # we push to the server even if there was no commit because this is a "push" command.  Server could be behind for other reasons.
-        remote = create_update_remote(repo, server.get_name(), server_url)
+        await execute_routine(create_update_remote_at_path, local_path, server.get_name(), server_url)
         #this could fail if you don't have permission to write container changes.  And that's okay because securityis handled by gitlab after all.
-        remote.push("master")
+        await git_command_routine(local_path, ["push", server.get_name(), "master"], feedback_ui)
 
 
     async def safe_merge_update_routine(self, feedback_ui:AbstractFeedbackUI, group_name:str):
@@ -604,7 +851,7 @@ class GitLabManagedTypeRoutines(typing.Generic[T]):
             DeleteLocalRepo(local_path)
 
         await self.get_feedback_ui().output("Cloning from: " + server_url)
-        git.Repo.clone_from(server_url, local_path)
+        await execute_routine(git.Repo.clone_from, server_url, local_path)
         await self.import_from_master_subroutine(feedback_ui,group_name)
 
 
@@ -615,7 +862,7 @@ class GitLabManagedTypeRoutines(typing.Generic[T]):
         local_path = self.get_server_routines().local_path_for_type_registry(server.get_name(), group_name,
                                                                              self.get_typename())
         if RepoExists(local_path):
-            repo = git.Repo(local_path)
+            repo = get_repo(local_path)
             return is_in_conflict(repo)
 
 
@@ -639,17 +886,15 @@ class GitLabManagedTypeRoutines(typing.Generic[T]):
         source_local_path = source_server_routines.local_path_for_type_registry(source_server_name,group_name,self.get_typename())
 
         os.makedirs(local_path, exist_ok=True)
-        git.Repo.clone_from(source_local_path,local_path)
+        await execute_routine(git.Repo.clone_from, source_local_path, local_path)
 
         #we push now, because we want to create it ASAP, or fail trying.
-        repo = git.Repo(local_path)
         server_url = server_routines.remote_path_for_entity_registry(group_name=group_name,
                                                                                 type_name=self.get_typename())
 
-        remote = create_update_remote(repo, server.get_name(), server_url)
+        await execute_routine(create_update_remote_at_path, local_path, server.get_name(), server_url)
         #this could fail if you don't have permission to write container changes.  And that's okay because securityis handled by gitlab after all.  And we don't want to diverge from the net either.
-        push_output = repo.git.push(server_routines.get_server_name(), 'master')
-        await feedback_ui.output(push_output)
+        await git_command_routine(local_path, ["push", server_routines.get_server_name(), 'master'], feedback_ui)
 
 
 
@@ -659,20 +904,17 @@ class GitLabManagedTypeRoutines(typing.Generic[T]):
         local_path = self.get_server_routines().local_path_for_type_registry(server.get_name(), group_name,
                                                                              self.get_typename())
         if RepoExists(local_path):
-            repo = git.Repo(local_path)
-            if repo.is_dirty(untracked_files=True):
+            if await execute_routine(_is_dirty, local_path, True):
                 if not fail_on_dirty:
-                    del (repo)
-                    DeleteLocalRepo(local_path)
+                    await execute_routine(DeleteLocalRepo, local_path)
                     return True
                 else:
                     return False
             else:
-                del (repo)
-                DeleteLocalRepo(local_path)
+                await execute_routine(DeleteLocalRepo, local_path)
                 return True
         else:
-            DeleteLocalRepo(local_path)
+            await execute_routine(DeleteLocalRepo, local_path)
             return True
 
 
@@ -695,14 +937,11 @@ class GitLabManagedTypeInteractiveRoutines(GitLabManagedTypeRoutines[T]):
         local_path = self.get_server_routines().local_path_for_type_registry(server.get_name(), group_name,
                                                                              self.get_typename())
         if RepoExists(local_path):
-            repo = git.Repo(local_path)
-            if repo.is_dirty(untracked_files=True):
+            if await execute_routine(_is_dirty, local_path, True):
                 answer = await dirty_ui.execute("Worktree is dirty. Delete anyway?", "Y", "N", "C", False)
                 if answer:
-                    del (repo)
-                    DeleteLocalRepo(local_path)
+                    await execute_routine(DeleteLocalRepo, local_path)
             else:
-                del (repo)
-                DeleteLocalRepo(local_path)
+                await execute_routine(DeleteLocalRepo, local_path)
         else:
-            DeleteLocalRepo(local_path)
+            await execute_routine(DeleteLocalRepo, local_path)
@@ -36,6 +36,9 @@ class GitLabServerManagerInteractiveRoutines(AbstractLocalManagedInteractiveRout
     def GetAllItems(self) -> typing.List[GitLabServer]:
         return self.GetManager().GetAll()
 
+    def IterAllItems(self) -> typing.Iterator[GitLabServer]:
+        return self.GetManager().IterGet()
+
     def ItemToName(self, item: GitLabServer) -> str:
         return item.get_name()
 
@@ -1,3 +1,4 @@
+import concurrent.futures
 import fiepipelib.components
 import fiepipelib.container.local_config.data.localcontainerconfiguration
 import fiepipelib.storage.localvolume
@@ -9,13 +10,36 @@ import fiepipelib.gitstorage.data.git_working_asset
 from fiepipelib.container.local_config.data.localcontainerconfiguration import LocalContainerConfiguration
 from fiepipelib.components.data.components import AbstractNamedItemListComponent
 from fiepipelib.gitstorage.data.git_working_asset import GitWorkingAsset
+from fiepipelib.git.routines.repo import get_repo
 from fiepipelib.gitstorage.data.localstoragemapper import localstoragemapper
 
+# the most submodules we'll probe at once when discovering working assets.
+DISCOVERY_MAX_WORKERS = 8
+
+# shared LFS storage scopes.  A root's assets can share LFS storage with each other, or with all the roots on the
+# same volume that use the volume scope.
+SHARED_LFS_SCOPE_ROOT = "root"
+SHARED_LFS_SCOPE_VOLUME = "volume"
+
+# where shared LFS storage lives, relative to the working volume.
+SHARED_LFS_STORAGE_SUBPATH = ".fiepipe_lfs_storage"
+
+
+def _probe_working_asset(asset: GitWorkingAsset, list_children: bool) -> typing.Tuple[bool, typing.List[GitWorkingAsset]]:
+    """Runs on a discovery thread.  Returns whether the asset is checked out and, if asked and it is, its
+    direct sub assets."""
+    if not asset.IsCheckedOut():
+        return False, []
+    if not list_children:
+        return True, []
+    return True, asset.GetSubWorkingAssets()
+
 def LocalRootConfigFromJSONData(data):
     ret = LocalRootConfiguration()
     ret._id = data['id']
     ret._volumeName = data['volume_name']
     ret._subPath = data['sub_path']
+    ret._sharedLFSScope = data.get('shared_lfs_scope', None)
     return ret
 
 def LocalRootConfigToJSONData(root):
@@ -24,6 +48,8 @@ def LocalRootConfigToJSONData(root):
     data['id'] = root._id
     data['volume_name'] = root._volumeName
     data['sub_path'] = root._subPath
+    if root._sharedLFSScope is not None:
+        data['shared_lfs_scope'] = root._sharedLFSScope
     return data
 
 def LocalRootConfigFromParameters(id, volumeName, subPath):
@@ -56,12 +82,20 @@ class LocalRootConfiguration(object):
         """
         return self._subPath
 
-    def GetWorkingPath(self, mapper:localstoragemapper):
-        """Returns the absolute path of the working directory root based on the data in
-        this object and the passed registry.
+    _sharedLFSScope = None
 
-        @param localVolumeRegistry: An instance of the localvolumeregistry to use to complete the lookup.
-        """
+    def GetSharedLFSScope(self):
+        """Which shared LFS storage the root's assets use: SHARED_LFS_SCOPE_ROOT, SHARED_LFS_SCOPE_VOLUME, or None
+        for each asset having its own."""
+        return self._sharedLFSScope
+
+    def SetSharedLFSScope(self, scope):
+        if scope not in (None, SHARED_LFS_SCOPE_ROOT, SHARED_LFS_SCOPE_VOLUME):
+            raise ValueError("Unknown shared LFS scope: " + str(scope))
+        self._sharedLFSScope = scope
+
+    def GetVolumePath(self, mapper:localstoragemapper):
+        """Returns the absolute path of the mounted working volume the root is on."""
         mountedWorkingVols = mapper.GetMountedWorkingStorage()
         volume = None
         for mountedWorkingVol in mountedWorkingVols:
@@ -70,8 +104,27 @@ class LocalRootConfiguration(object):
         if volume == None:
             raise fiepipelib.storage.localvolume.VolumeNotFoundException(self.GetVolumeName())
         assert isinstance(volume, fiepipelib.storage.localvolume.localvolume)
-        volPath = volume.GetPath()
-        return os.path.join(volPath,self.GetWorkingSubPath())
+        return volume.GetPath()
+
+    def GetWorkingPath(self, mapper:localstoragemapper):
+        """Returns the absolute path of the working directory root based on the data in
+        this object and the passed registry.
+
+        @param localVolumeRegistry: An instance of the localvolumeregistry to use to complete the lookup.
+        """
+        return os.path.join(self.GetVolumePath(mapper),self.GetWorkingSubPath())
+
+    def GetSharedLFSStoragePath(self, mapper:localstoragemapper, scope = None):
+        """Returns the absolute path of the shared LFS storage for the given scope, or the root's configured scope
+        if None.  None if the root isn't configured to share."""
+        if scope is None:
+            scope = self.GetSharedLFSScope()
+        if scope is None:
+            return None
+        storage_path = os.path.join(self.GetVolumePath(mapper), SHARED_LFS_STORAGE_SUBPATH)
+        if scope == SHARED_LFS_SCOPE_ROOT:
+            return os.path.join(storage_path, "roots", self.GetID())
+        return os.path.join(storage_path, "volume")
 
     def GetRepo(self, mapper:localstoragemapper):
         """Returns a git repository based on the data in this opbject and the passed registry.
@@ -80,37 +133,72 @@ class LocalRootConfiguration(object):
 
         @param localVolumeRegistry: An instance of the localvolumeregistry to use to complete the lookup.
         """
-        return git.Repo(self.GetWorkingPath(mapper))
+        return get_repo(self.GetWorkingPath(mapper))
 
     def GetWorkingAssets(self, mapper:localstoragemapper, recursive = False) -> typing.List[GitWorkingAsset]:
         """Returns a list of workingasset objects found in this root.
         @param recursive: If False (default) we only get the working assets directly accessible from this root.
         If True, we get the working assets from this root, and those asssets and those assets and so-on.  We do
-        not execute further checkouts.  So, if a submodule isn't cloned, it won't be recursed into; though it will
-        be included in the list.
+        not execute further checkouts.  So, if a submodule isn't cloned, it isn't included or recursed into.
+        """
+        if recursive:
+            return list(self.IterWorkingAssets(mapper))
+        else:
+            return list(self.IterWorkingAssets(mapper, max_depth=0))
+
+    def IterWorkingAssets(self, mapper:localstoragemapper, max_depth:int = None,
+                          asset_ids:typing.Iterable[str] = None,
+                          max_workers:int = DISCOVERY_MAX_WORKERS) -> typing.Iterator[GitWorkingAsset]:
+        """Yields the checked out workingassets in this root as they're found.
+
+        Sibling submodules are probed concurrently on a thread pool, so the order isn't fixed.  An asset is always
+        yielded before any of its sub assets.
+
+        @param max_depth: 0 only finds assets directly in this root, 1 their sub assets too, and so on.  None
+        (default) for no limit.
+        @param asset_ids: If given, only assets with these IDs (case insensitive) are yielded.  The whole tree is
+        still searched, but discovery stops once they've all been found.
         """
         repo = self.GetRepo(mapper)
         assert isinstance(repo, git.Repo)
-        ret = []
-
-        for submodule in repo.submodules:
-        #for submodule in repo.iter_submodules():
-            asset = GitWorkingAsset(submodule)
-            if asset.IsCheckedOut():
-                ret.append(asset)
-                if recursive:
-                    ret.extend(self._get_all_subassets(asset))
-        return ret
-
-    def _get_all_subassets(self, working_asset:GitWorkingAsset) -> typing.List[GitWorkingAsset]:
-        ret = []
-        for sub_asset in working_asset.GetSubWorkingAssets():
-            if sub_asset.IsCheckedOut():
-                ret.append(sub_asset)
-                ret.extend(self._get_all_subassets(sub_asset))
-        return ret
-
 
+        wanted = None
+        if asset_ids is not None:
+            wanted = set([asset_id.lower() for asset_id in asset_ids])
+            if len(wanted) == 0:
+                return
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                         thread_name_prefix="fiepipe_asset_discovery")
+        pending = {}
+        try:
+            for submodule in repo.submodules:
+                asset = GitWorkingAsset(submodule)
+                list_children = max_depth is None or max_depth > 0
+                pending[executor.submit(_probe_working_asset, asset, list_children)] = (asset, 0)
+
+            while len(pending) > 0:
+                done, not_done = concurrent.futures.wait(pending.keys(),
+                                                         return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    asset, depth = pending.pop(future)
+                    checked_out, children = future.result()
+                    if not checked_out:
+                        continue
+                    for child in children:
+                        list_children = max_depth is None or max_depth > depth + 1
+                        pending[executor.submit(_probe_working_asset, child, list_children)] = (child, depth + 1)
+                    if wanted is None:
+                        yield asset
+                    elif asset.GetSubmodule().name.lower() in wanted:
+                        wanted.discard(asset.GetSubmodule().name.lower())
+                        yield asset
+                        if len(wanted) == 0:
+                            return
+        finally:
+            for future in pending.keys():
+                future.cancel()
+            executor.shutdown(wait=False)
 
 
 class LocalRootConfigurationsComponent(AbstractNamedItemListComponent[LocalRootConfiguration]):
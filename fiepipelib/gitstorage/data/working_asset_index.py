@@ -0,0 +1,239 @@
+import os
+import os.path
+import threading
+import typing
+
+import git
+
+from fiepipelib.git.routines.repo import get_repo
+from fiepipelib.gitstorage.data.git_working_asset import GitWorkingAsset
+
+
+def _mtime_ns(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _normalize_path(path: str) -> str:
+    return os.path.normcase(os.path.normpath(path))
+
+
+class _IndexLevel(object):
+    """A repository (root or checked out submodule) the index scanned.  Its submodule list comes from its
+    .gitmodules and HEAD, so those files' mtimes tell us when it needs scanning again."""
+
+    working_dir: str = None
+    git_dir: str = None
+    common_dir: str = None
+    signature: typing.Tuple = None
+
+    def __init__(self, repo: git.Repo):
+        self.working_dir = repo.working_tree_dir
+        self.git_dir = repo.git_dir
+        self.common_dir = getattr(repo, "common_dir", repo.git_dir)
+        self.signature = self.current_signature()
+
+    def current_signature(self) -> typing.Tuple:
+        head_path = os.path.join(self.git_dir, "HEAD")
+        ref_mtime = None
+        try:
+            with open(head_path, "r") as f:
+                head = f.read().strip()
+            if head.startswith("ref:"):
+                ref_mtime = _mtime_ns(os.path.join(self.common_dir, head[4:].strip()))
+        except OSError:
+            head = None
+        return (head,
+                _mtime_ns(os.path.join(self.working_dir, ".gitmodules")),
+                _mtime_ns(head_path),
+                ref_mtime,
+                _mtime_ns(os.path.join(self.common_dir, "packed-refs")))
+
+    def is_current(self) -> bool:
+        return self.current_signature() == self.signature
+
+
+class IndexedAsset(object):
+    """What the index knows about one asset (submodule) in a root, at any depth."""
+
+    _id: str = None
+    _path: str = None
+    _abs_path: str = None
+    _level: _IndexLevel = None
+    _parent: 'IndexedAsset' = None
+    _checked_out: bool = False
+
+    def __init__(self, asset_id: str, path: str, abs_path: str, level: _IndexLevel, parent: 'IndexedAsset',
+                 checked_out: bool):
+        self._id = asset_id
+        self._path = path
+        self._abs_path = abs_path
+        self._level = level
+        self._parent = parent
+        self._checked_out = checked_out
+
+    def GetID(self) -> str:
+        return self._id
+
+    def GetPath(self) -> str:
+        """Path relative to the root's working tree."""
+        return self._path
+
+    def GetAbsPath(self) -> str:
+        return self._abs_path
+
+    def GetParentWorkingDir(self) -> str:
+        """The working tree of the repository this asset is a submodule of."""
+        return self._level.working_dir
+
+    def GetParent(self) -> 'IndexedAsset':
+        """The asset this one is nested in.  None if it's directly in the root."""
+        return self._parent
+
+    def IsCheckedOut(self) -> bool:
+        return self._checked_out
+
+    def is_current(self) -> bool:
+        """Whether this entry still matches the disk, checking only its own chain of parents."""
+        entry = self
+        while entry is not None:
+            if not entry._level.is_current():
+                return False
+            if os.path.exists(os.path.join(entry._abs_path, ".git")) != entry._checked_out:
+                return False
+            entry = entry._parent
+        return True
+
+    def GetSubmodule(self) -> git.Submodule:
+        """Opens the parent repository and returns the submodule.  Only parses the one .gitmodules."""
+        repo = get_repo(self.GetParentWorkingDir())
+        return repo.submodule(self._id)
+
+    def GetWorkingAsset(self) -> GitWorkingAsset:
+        return GitWorkingAsset(self.GetSubmodule())
+
+
+class WorkingAssetIndex(object):
+    """An in memory index of all the assets (submodules, at any depth) in a root's working tree, by ID and by
+    relative path.
+
+    The tree is walked once.  After that, a lookup only checks the .gitmodules and HEAD mtimes of the repositories
+    between the root and the found asset, and only walks the tree again if one of those changed or the asset
+    isn't found.
+
+    Use get_working_asset_index rather than constructing one, so the index is shared.
+    """
+
+    _working_dir: str = None
+    _levels: typing.List[_IndexLevel] = None
+    _assets: typing.List[IndexedAsset] = None
+    _by_id: typing.Dict[str, IndexedAsset] = None
+    _by_path: typing.Dict[str, IndexedAsset] = None
+
+    def __init__(self, working_dir: str):
+        self._working_dir = working_dir
+        self._lock = threading.RLock()
+
+    def get_working_dir(self) -> str:
+        return self._working_dir
+
+    def invalidate(self):
+        with self._lock:
+            self._levels = None
+
+    def _is_current(self) -> bool:
+        if self._levels is None:
+            return False
+        for level in self._levels:
+            if not level.is_current():
+                return False
+        for asset in self._assets:
+            if os.path.exists(os.path.join(asset.GetAbsPath(), ".git")) != asset.IsCheckedOut():
+                return False
+        return True
+
+    def _scan(self):
+        levels = []
+        assets = []
+        root_repo = get_repo(self._working_dir)
+        self._scan_level(root_repo, None, levels, assets)
+        by_id = {}
+        by_path = {}
+        for asset in assets:
+            by_id.setdefault(asset.GetID().lower(), asset)
+            by_path.setdefault(_normalize_path(asset.GetPath()), asset)
+        self._levels = levels
+        self._assets = assets
+        self._by_id = by_id
+        self._by_path = by_path
+
+    def _scan_level(self, repo: git.Repo, parent: IndexedAsset, levels: typing.List[_IndexLevel],
+                    assets: typing.List[IndexedAsset]):
+        level = _IndexLevel(repo)
+        levels.append(level)
+        for submodule in repo.submodules:
+            assert isinstance(submodule, git.Submodule)
+            abs_path = submodule.abspath
+            checked_out = os.path.exists(os.path.join(abs_path, ".git"))
+            asset = IndexedAsset(submodule.name, os.path.relpath(abs_path, self._working_dir), abs_path, level,
+                                 parent, checked_out)
+            assets.append(asset)
+            if checked_out and submodule.module_exists():
+                self._scan_level(submodule.module(), asset, levels, assets)
+
+    def get_assets(self) -> typing.List[IndexedAsset]:
+        """All the assets in the root, at any depth, whether checked out or not.  Parents come before their
+        children."""
+        with self._lock:
+            if not self._is_current():
+                self._scan()
+            return list(self._assets)
+
+    def _find(self, table_name: str, key: str) -> IndexedAsset:
+        with self._lock:
+            if self._levels is not None:
+                found = getattr(self, table_name).get(key, None)
+                if found is not None and found.is_current():
+                    return found
+                # a miss is only trusted if nothing anywhere in the tree changed.
+                if found is None and self._is_current():
+                    return None
+            self._scan()
+            return getattr(self, table_name).get(key, None)
+
+    def find_by_id(self, asset_id: str) -> IndexedAsset:
+        """Finds an asset by ID (case insensitive).  None if it's not in the root."""
+        return self._find("_by_id", asset_id.lower())
+
+    def find_by_path(self, path: str) -> IndexedAsset:
+        """Finds an asset by its path relative to the root's working tree.  None if it's not in the root."""
+        return self._find("_by_path", _normalize_path(path))
+
+
+_indexes: typing.Dict[str, WorkingAssetIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_working_asset_index(working_dir: str) -> WorkingAssetIndex:
+    """Returns the process wide asset index for the root working tree at the given path."""
+    key = os.path.realpath(working_dir)
+    with _indexes_lock:
+        index = _indexes.get(key, None)
+        if index is None:
+            index = WorkingAssetIndex(working_dir)
+            _indexes[key] = index
+        return index
+
+
+def invalidate_working_asset_index(working_dir: str = None):
+    """Forces the index for the given root working tree, or all of them if None, to be rebuilt on next use."""
+    with _indexes_lock:
+        if working_dir is None:
+            indexes = list(_indexes.values())
+        else:
+            index = _indexes.get(os.path.realpath(working_dir), None)
+            indexes = [] if index is None else [index]
+    for index in indexes:
+        index.invalidate()
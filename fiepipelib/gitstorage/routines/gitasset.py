@@ -7,8 +7,11 @@ import shutil
 
 import git
 
+from fiepipelib.git.routines.lfs import GetSharedLFSStorage
+from fiepipelib.git.routines.status import get_status, invalidate_status
 from fiepipelib.gitstorage.data.git_asset import GitAsset
 from fiepipelib.gitstorage.data.git_working_asset import GitWorkingAsset
+from fiepipelib.gitstorage.data.working_asset_index import get_working_asset_index
 from fiepipelib.gitstorage.routines.gitrepo import GitRepoRoutines
 from fieui.FeedbackUI import AbstractFeedbackUI
 from fiepipelib.gitstorage.routines.gitroot import GitRootRoutines
@@ -38,16 +41,10 @@ class GitAssetRoutines(GitRepoRoutines):
         self._working_asset = GitWorkingAsset(submod)
 
     def get_submodule_recursive(self, repo:git.Repo, asset_id:str) -> git.Submodule:
-        for submod in repo.submodules:
-            assert isinstance(submod,git.Submodule)
-            if submod.name == asset_id:
-                return submod
-            else:
-                if submod.module_exists():
-                    found = self.get_submodule_recursive(submod.module(), asset_id)
-                    if found is not None:
-                        return found
-        return None
+        found = get_working_asset_index(repo.working_tree_dir).find_by_id(asset_id)
+        if found is None:
+            return None
+        return found.GetSubmodule()
 
     @property
     def working_asset(self):
@@ -96,6 +93,11 @@ class GitAssetRoutines(GitRepoRoutines):
         submod = self._working_asset.GetSubmodule()
         repo = submod.module()
         assert isinstance(repo,git.Repo)
+        shared_storage = GetSharedLFSStorage(repo)
+        if shared_storage is not None:
+            # other assets use these objects too.  they're cleaned up by pruning the shared storage.
+            await feedback_ui.output("Asset uses shared LFS storage: " + shared_storage + ".  Prune it instead.")
+            return
         module_dir = repo.git_dir
         lfs_dir = os.path.join(module_dir,"lfs")
         objects_dir = os.path.join(lfs_dir,"objects")
@@ -153,6 +155,7 @@ class GitAssetRoutines(GitRepoRoutines):
         if repo.is_dirty():
             await feedback_ui.feedback("Commiting: " + self._working_asset.GetSubmodule().path)
             log = repo.git.commit("-m" + shlex.quote(log_message))
+            invalidate_status(repo.working_tree_dir)
             await feedback_ui.output(log)
 
     def get_config_names(self) -> typing.List[str]:
@@ -162,6 +165,7 @@ class GitAssetRoutines(GitRepoRoutines):
         if not os.path.exists(configs_path):
             os.makedirs(configs_path, exist_ok=True)
             self._working_asset.GetRepo().index.add(["asset_configs"])
+            invalidate_status(asset_path)
         contents = os.listdir(configs_path)
         config_filenames = []
         for entry in contents:
@@ -198,12 +202,10 @@ class GitAssetRoutines(GitRepoRoutines):
         f.close()
 
     def is_dirty_index(self) -> bool:
-        repo = self._working_asset.GetRepo()
-        return repo.is_dirty(working_tree=False, index=True, untracked_files=False)
+        return get_status(self._working_asset.GetRepo()).is_index_dirty()
 
     def is_dirty_worktree(self) -> bool:
-        repo = self._working_asset.GetRepo()
-        return repo.is_dirty(working_tree=True, index=False, untracked_files=False)
+        return get_status(self._working_asset.GetRepo()).is_worktree_dirty()
 
     def check_create_change_dir(self):
         submod = self._working_asset.GetSubmodule()
@@ -217,21 +219,22 @@ class GitAssetRoutines(GitRepoRoutines):
     def can_commit(self) -> (bool, str):
         if not self._working_asset.IsCheckedOut():
             return True, "OK: Not checked out"
-        repo = self._working_asset.GetRepo()
+        status = get_status(self._working_asset.GetRepo())
 
-        work_tree_dirty = repo.is_dirty(working_tree=True, index=False, untracked_files=False, submodules=False)
+        work_tree_dirty = status.is_worktree_dirty(submodules=False)
 
         if work_tree_dirty:
             return False, "Dirty WorkTree"
 
         # index_dirty = repo.is_dirty(working_tree=False, index=True ,untracked_files=False)
 
-        untracked_files = self.has_untracked()
+        untracked_files = status.has_untracked()
 
         if untracked_files:
             return False, "Untracked Files"
 
-        modified_files = len(self.get_modified()) > 0
+        # modified submodules.  the rest of the worktree was checked above.
+        modified_files = status.is_worktree_dirty()
 
         if modified_files:
             return False, "Modified Files"
@@ -1,16 +1,23 @@
 import abc
+import asyncio
+import os.path
 import typing
 from abc import ABC
 
 import git
 
 import fiepipelib.git.routines.submodules
-from fiepipelib.git.routines.repo import RepoExists
-from fiepipelib.gitlabserver.routines.gitlabserver import GitLabGitStorageRoutines, GitLabServerRoutines
+from fiepipelib.git.routines.executor import execute_routine, git_command_routine
+from fiepipelib.git.routines.lfs import GetSharedLFSStorage, SetSharedLFSStorage, SharedLFSStorageArgs, \
+    LFSFetchProfile, GetFetchProfile, SetFetchProfile, SKIP_SMUDGE_ENV, hydrate_routine
+from fiepipelib.git.routines.repo import RepoExists, get_repo, evict_repo
+from fiepipelib.gitlabserver.routines.gitlabserver import GitLabGitStorageRoutines, GitLabServerRoutines, \
+    init_submodules_sub_routine, SUBMODULE_UPDATE_JOBS, LFS_FETCH_MAX_CONCURRENT
 from fiepipelib.gitstorage.data.git_root import GitRoot
 from fiepipelib.gitstorage.data.git_working_asset import GitWorkingAsset
 from fiepipelib.gitstorage.data.local_root_configuration import LocalRootConfiguration
 from fiepipelib.gitstorage.data.localstoragemapper import localstoragemapper, get_local_storage_mapper
+from fiepipelib.gitstorage.data.working_asset_index import IndexedAsset, get_working_asset_index
 from fiepipelib.localplatform.routines.localplatform import get_local_platform_routines
 from fiepipelib.localuser.routines.localuser import LocalUserRoutines
 from fiepipelib.storage.localvolume import localvolume
@@ -47,7 +54,7 @@ class GitLabGitRootRoutines(GitLabGitStorageRoutines, ABC):
             return
         else:
             await feedback_ui.output("Cloning from: " + remote_url + " -> " + local_repo_path)
-            git.Repo.clone_from(remote_url, local_repo_path)
+            await execute_routine(git.Repo.clone_from, remote_url, local_repo_path)
 
     async def clone_split(self, backing_vol: localvolume, feedback_ui: AbstractFeedbackUI):
         backing_vol_repo_path = self._root.GetPathForBackingVolume(backing_vol)
@@ -64,25 +71,112 @@ class GitLabGitRootRoutines(GitLabGitStorageRoutines, ABC):
         else:
             # clone to backing vol with no worktree
             await feedback_ui.output("Initializing bare repository on backing volume: " + backing_vol_repo_path)
-            git.Git(backing_vol_repo_path).clone("--bare", remote_url, backing_vol_repo_path)
+            await execute_routine(git.Git(backing_vol_repo_path).clone, "--bare", remote_url, backing_vol_repo_path)
             # add the worktree
-            backing_repo = git.Repo(backing_vol_repo_path)
             await feedback_ui.output("Adding worktree: " + local_worktree_path)
-            backing_repo.git.worktree("add", local_worktree_path)
+            await git_command_routine(backing_vol_repo_path, ["worktree", "add", local_worktree_path], feedback_ui)
 
     @abc.abstractmethod
     def get_all_asset_routines(self, recursive: bool) -> typing.List['GitLabGitAssetRoutines']:
         raise NotImplementedError()
 
+    @abc.abstractmethod
+    def get_asset_routines(self, working_asset: GitWorkingAsset) -> 'GitLabGitAssetRoutines':
+        raise NotImplementedError()
+
+    async def checkout_assets_routine(self, feedback_ui: AbstractFeedbackUI, asset_ids: typing.Iterable[str] = None,
+                                      recursive: bool = True, branch: str = "master",
+                                      jobs: int = SUBMODULE_UPDATE_JOBS,
+                                      max_concurrent_lfs: int = LFS_FETCH_MAX_CONCURRENT,
+                                      lfs_profile: LFSFetchProfile = None) -> bool:
+        """Checks out many assets of this root from gitlab at once.  Assets already checked out are left alone.
+
+        Works down the tree a level at a time.  Each level's assets are cloned in parallel ('git submodule update
+        --jobs'), then LFS fetched and checked out with bounded concurrency.  Different parent repositories are
+        handled concurrently.
+
+        @param asset_ids: the assets to check out.  None for all of them.
+        @param recursive: also check out everything inside the given assets.  With asset_ids None, False checks
+        out only the root's direct children.
+        @param lfs_profile: which LFS files to download.  None for each parent repository's profile.
+        @return: True if all succeeded and all the given asset_ids were found.
+        """
+        root_path = self.get_local_repo_path()
+        index = get_working_asset_index(root_path)
+        wanted = None
+        if asset_ids is not None:
+            wanted = set([asset_id.lower() for asset_id in asset_ids])
+
+        def is_selected(indexed: IndexedAsset) -> bool:
+            if wanted is None:
+                # just the top level, unless recursive.
+                return recursive or indexed.GetParent() is None
+            if indexed.GetID().lower() in wanted:
+                return True
+            if recursive:
+                parent = indexed.GetParent()
+                while parent is not None:
+                    if parent.GetID().lower() in wanted:
+                        return True
+                    parent = parent.GetParent()
+            return False
+
+        found = set()
+        attempted = set()
+        succeeded = True
+        while True:
+            by_parent = {}
+            all_indexed = await execute_routine(index.get_assets)
+            for indexed in all_indexed:
+                if not is_selected(indexed):
+                    continue
+                found.add(indexed.GetID().lower())
+                if indexed.IsCheckedOut() or indexed.GetID().lower() in attempted:
+                    continue
+                attempted.add(indexed.GetID().lower())
+                by_parent.setdefault(indexed.GetParentWorkingDir(), []).append(indexed)
+            if len(by_parent) == 0:
+                break
+
+            async def checkout_parent(parent_path: str, indexed_assets: typing.List[IndexedAsset]) -> bool:
+                parent_repo = get_repo(parent_path)
+                submodules = []
+                for indexed in indexed_assets:
+                    working_asset = GitWorkingAsset(parent_repo.submodule(indexed.GetID()))
+                    submodules.append((indexed.GetID(), self.get_asset_routines(working_asset)))
+                return await init_submodules_sub_routine(feedback_ui, parent_path, submodules, branch, jobs,
+                                                         max_concurrent_lfs, lfs_profile)
+
+            await feedback_ui.output("Checking out " + str(sum([len(v) for v in by_parent.values()])) +
+                                     " asset(s) in " + str(len(by_parent)) + " parent repositories.")
+            results = await asyncio.gather(*[checkout_parent(parent_path, indexed_assets) for
+                                             parent_path, indexed_assets in by_parent.items()],
+                                           return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    await feedback_ui.error(str(result))
+                    succeeded = False
+                elif not result:
+                    succeeded = False
+
+        if wanted is not None:
+            for missing in wanted - found:
+                await feedback_ui.error("Asset not found (is its parent checked out?): " + missing)
+                succeeded = False
+        return succeeded
+
 
 class GitLabFQDNGitRootRoutines(GitLabGitRootRoutines):
     def get_all_asset_routines(self, recursive: bool) -> typing.List['GitLabFQDNGitAssetRoutines']:
         all_assets = self._root_config.GetWorkingAssets(get_local_storage_mapper(), recursive)
         ret = []
         for asset in all_assets:
-            ret.append(GitLabFQDNGitAssetRoutines(self.get_server_routines(), asset, self._fqdn))
+            ret.append(self.get_asset_routines(asset))
         return ret
 
+    def get_asset_routines(self, working_asset: GitWorkingAsset) -> 'GitLabFQDNGitAssetRoutines':
+        return GitLabFQDNGitAssetRoutines(self.get_server_routines(), working_asset, self._fqdn)
+
     _fqdn: str = None
 
     def __init__(self, server_routines: GitLabServerRoutines, root: GitRoot, root_config: LocalRootConfiguration,
@@ -116,33 +210,81 @@ class GitLabGitAssetRoutines(GitLabGitStorageRoutines, ABC):
     async def init(self, feedback_ui: AbstractFeedbackUI):
         """Does an initial checkout of an asset that isn't currently checked out.
         Very likely leaves the asset in a 'detached head' state."""
-        if not self._working_asset.IsCheckedOut():
-            submod = self._working_asset.GetSubmodule()
-            remote_url = self.get_remote_url()
-            old_url = fiepipelib.git.routines.submodules.GetURL(submod.repo, submod.name)
-            fiepipelib.git.routines.submodules.ChangeURL(submod.repo, submod.name, remote_url,
-                                                         revertGitModulesFile=False)
-            textout = submod.repo.git.submodule("update", "--init", submod.path)
-            await feedback_ui.output(textout)
-            fiepipelib.git.routines.submodules.ChangeURL(submod.repo, submod.name, old_url, revertGitModulesFile=False)
+        await GitLabGitAssetRoutines.init_many(feedback_ui, [self])
+
+    @staticmethod
+    async def init_many(feedback_ui: AbstractFeedbackUI, asset_routines: typing.List['GitLabGitAssetRoutines']):
+        """init for many assets at once.  Assets that are submodules of the same repository share one rewrite of
+        the urls, one sync and one update, rather than doing them each.  If the parent uses shared LFS storage,
+        or an LFS fetch profile, so do the assets."""
+        by_parent = {}
+        for routines in asset_routines:
+            if routines._working_asset.IsCheckedOut():
+                continue
+            submod = routines._working_asset.GetSubmodule()
+            parent_path = submod.repo.working_tree_dir
+            by_parent.setdefault(parent_path, []).append((submod, routines.get_remote_url()))
+
+        for parent_path, submods in by_parent.items():
+            # Repos aren't shared between threads.  So the workers open their own.
+            old_urls = await execute_routine(
+                lambda: fiepipelib.git.routines.submodules.GetURLs(get_repo(parent_path)))
+            new_urls = dict([(submod.name, remote_url) for submod, remote_url in submods])
+            await execute_routine(lambda: fiepipelib.git.routines.submodules.ChangeURLs(
+                get_repo(parent_path), new_urls, revertGitModulesFile=False))
+            paths = [submod.path for submod, remote_url in submods]
+            lfs_storage = await execute_routine(lambda: GetSharedLFSStorage(get_repo(parent_path)))
+            lfs_profile = await execute_routine(lambda: GetFetchProfile(get_repo(parent_path)))
+            update_env = None if lfs_profile.is_full() else SKIP_SMUDGE_ENV
+            for chunk in fiepipelib.git.routines.submodules.chunks(paths,
+                                                                   fiepipelib.git.routines.submodules.PATHS_PER_COMMAND):
+                await git_command_routine(parent_path, SharedLFSStorageArgs(lfs_storage) +
+                                          ["submodule", "update", "--init", "--"] + chunk,
+                                          feedback_ui, env=update_env)
+            for submod, remote_url in submods:
+                if not os.path.exists(os.path.join(submod.abspath, ".git")):
+                    continue
+                if lfs_storage is not None:
+                    await execute_routine(lambda: SetSharedLFSStorage(get_repo(submod.abspath), lfs_storage))
+                if not lfs_profile.is_full():
+                    await execute_routine(lambda: SetFetchProfile(get_repo(submod.abspath), lfs_profile))
+                    await hydrate_routine(submod.abspath, "origin", lfs_profile, feedback_ui)
+            reverted_urls = dict([(submod.name, old_urls[submod.name]) for submod, remote_url in submods])
+            await execute_routine(lambda: fiepipelib.git.routines.submodules.ChangeURLs(
+                get_repo(parent_path), reverted_urls, revertGitModulesFile=False))
             # repo.git.submodule("init",submod.abspath)
 
     async def init_branch(self, feedback_ui: AbstractFeedbackUI):
         """recursive init from this asset through all its children.
         Like init, it likely leaves the assets in a 'detached head' state.
         """
-        if not self._working_asset.IsCheckedOut():
-            await self.init(feedback_ui=feedback_ui)
-            for asset_routines in self.get_sub_asset_routines():
-                await asset_routines.init_branch()
+        await GitLabGitAssetRoutines.init_branches(feedback_ui, [self])
+
+    @staticmethod
+    async def init_branches(feedback_ui: AbstractFeedbackUI, asset_routines: typing.List['GitLabGitAssetRoutines']):
+        """init_branch for many assets at once.  Works down the tree a level at a time, initing each level's
+        assets together with init_many."""
+        level = [routines for routines in asset_routines if not routines._working_asset.IsCheckedOut()]
+        while len(level) > 0:
+            await GitLabGitAssetRoutines.init_many(feedback_ui, level)
+            next_level = []
+            for routines in level:
+                if not routines._working_asset.IsCheckedOut():
+                    # the init failed quietly.  Nothing below it to init.
+                    continue
+                for sub_routines in routines.get_sub_asset_routines():
+                    if not sub_routines._working_asset.IsCheckedOut():
+                        next_level.append(sub_routines)
+            level = next_level
 
     async def deinit(self):
         """Un-checks out an asset that is currently checked out."""
         submod = self._working_asset.GetSubmodule()
         if submod.exists():
-            repo = submod.repo
-            assert isinstance(repo, git.Repo)
-            repo.git.submodule("deinit", submod.path)
+            # the parent repo was opened on this thread.  So we only take its path to the git process.
+            parent_path = submod.repo.working_tree_dir
+            evict_repo(submod.abspath)
+            await git_command_routine(parent_path, ["submodule", "deinit", submod.path])
 
     async def deinit_branch(self):
         """Recursive de-init that de-inits children before parents."""
@@ -184,8 +326,13 @@ class GitLabGitAssetRoutines(GitLabGitStorageRoutines, ABC):
                 return
 
         if latest:
-            textout = self._working_asset.GetRepo().git.checkout("master")
-            await feedback_ui.output(textout)
+            local_repo_path = self.get_local_repo_path()
+            lfs_profile = await execute_routine(lambda: GetFetchProfile(get_repo(local_repo_path)))
+            if lfs_profile.is_full():
+                await git_command_routine(local_repo_path, ["checkout", "master"], feedback_ui)
+            else:
+                await git_command_routine(local_repo_path, ["checkout", "master"], feedback_ui, env=SKIP_SMUDGE_ENV)
+                await hydrate_routine(local_repo_path, "origin", lfs_profile, feedback_ui)
 
     async def update_branch(self, feedback_ui: AbstractFeedbackUI, latest=True, init=False):
         """Recursive version of update that walks down the tree of checked out assets.
@@ -1,8 +1,13 @@
 import abc
+import os.path
 import typing
 
 import git
 
+from fiepipelib.git.routines.lfs import LFSFetchProfile, hydrate_routine as lfs_hydrate_routine
+from fiepipelib.git.routines.status import get_status, invalidate_status
+from fieui.FeedbackUI import AbstractFeedbackUI
+
 
 class GitRepoRoutines(abc.ABC):
 
@@ -66,6 +71,7 @@ class GitRepoRoutines(abc.ABC):
             if submod.module_exists():
                 self._add_submodules_recursive(submod.module())
                 repo.git.add(submod.path)
+                invalidate_status(repo.working_tree_dir)
 
     def add_submodule_versions(self):
         repo = self.get_repo()
@@ -76,18 +82,22 @@ class GitRepoRoutines(abc.ABC):
         raise NotImplementedError()
 
     def is_in_conflict(self) -> bool:
-        repo = self.get_repo()
-
-        # checking for conflicts
-        unmerged_blobs = repo.index.unmerged_blobs()
-
-        conflicted = False
-
-        for path in unmerged_blobs:
-            list_of_blobs = unmerged_blobs[path]
-            for (stage, blob) in list_of_blobs:
-                # Now we can check each stage to see whether there were any conflicts
-                if stage != 0:
-                    conflicted = True
-
-        return conflicted
+        return get_status(self.get_repo()).is_conflicted()
+
+    async def hydrate_routine(self, feedback_ui: AbstractFeedbackUI, profile: LFSFetchProfile,
+                              remote: str = "origin"):
+        """Downloads the LFS files the profile says to, which may be more than the repository's own profile
+        downloads, and replaces their pointer files in the worktree."""
+        await lfs_hydrate_routine(self.get_repo().working_tree_dir, remote, profile, feedback_ui)
+
+    async def hydrate_paths_routine(self, feedback_ui: AbstractFeedbackUI, paths: typing.List[str],
+                                    remote: str = "origin"):
+        """Downloads the LFS files at the given paths (files or directories, absolute or relative to the worktree)
+        on demand.  For when the repository's profile left them out."""
+        working_dir = self.get_repo().working_tree_dir
+        include = []
+        for path in paths:
+            if os.path.isabs(path):
+                path = os.path.relpath(path, working_dir)
+            include.append(path.replace(os.sep, "/"))
+        await self.hydrate_routine(feedback_ui, LFSFetchProfile(include=include), remote)
@@ -9,13 +9,19 @@ import git
 from fiepipelib.container.shared.routines.container import ContainerRoutines
 from fiepipelib.container.local_config.routines.container import LocalContainerRoutines
 from fiepipelib.git.routines.ignore import CheckCreateIgnore
-from fiepipelib.git.routines.lfs import InstallLFSRepo
-from fiepipelib.git.routines.repo import RepoExists, InitWorkingTreeRoot, DeleteLocalRepo
+from fiepipelib.git.routines.executor import execute_routine
+from fiepipelib.container.local_config.data.lfs_fetch import ContainerLFSFetchConfigurationComponent
+from fiepipelib.git.routines.lfs import InstallLFSRepo, SetSharedLFSStorage, UnsetSharedLFSStorage, \
+    PruneSharedLFSStorage, IsSharedLFSStorage, LFSFetchProfile, SetFetchProfile, \
+    hydrate_routine as lfs_hydrate_routine
+from fiepipelib.git.routines.repo import RepoExists, InitWorkingTreeRoot, DeleteLocalRepo, get_repo
+from fiepipelib.git.routines.status import get_status, invalidate_status
 from fiepipelib.git.routines.submodules import Remove as RemoveSubmodule, CanCreateSubmodule, CreateFromSubDirectory
 from fiepipelib.gitstorage.data.git_asset import NewID as NewAssetID
 from fiepipelib.gitstorage.data.git_root import SharedGitRootsComponent, GitRoot
 from fiepipelib.gitstorage.data.git_working_asset import GitWorkingAsset
 from fiepipelib.gitstorage.data.local_root_configuration import LocalRootConfigurationsComponent, LocalRootConfiguration
+from fiepipelib.gitstorage.data.working_asset_index import WorkingAssetIndex, get_working_asset_index
 from fiepipelib.gitstorage.data.localstoragemapper import localstoragemapper
 from fiepipelib.gitstorage.routines.gitrepo import GitRepoRoutines
 from fiepipelib.localuser.routines.localuser import LocalUserRoutines
@@ -107,7 +113,7 @@ class GitRootRoutines(GitRepoRoutines):
         if RepoExists(self.get_local_repo_path()):
             existsText = "exists"
             rep = self.get_local_repo()
-            if rep.is_dirty(True,True,True,False):
+            if get_status(rep, submodules=False).is_dirty(True,True,True,False):
                 statusText = "dirty"
             else:
                 statusText = "clean"
@@ -121,7 +127,7 @@ class GitRootRoutines(GitRepoRoutines):
             existsText = "exists"
             rep = working_asset.GetSubmodule().module()
             assert isinstance(rep, git.Repo)
-            if rep.is_dirty(True,True,True,False):
+            if get_status(rep, submodules=False).is_dirty(True,True,True,False):
                 statusText = "dirty"
             else:
                 statusText = "clean"
@@ -156,6 +162,7 @@ class GitRootRoutines(GitRepoRoutines):
         CheckCreateIgnore(repo)
         await feedback_ui.output("Commiting to head")
         repo.git.commit(m="Initial commit.")
+        invalidate_status(dir)
         os.chdir(dir)
         return
 
@@ -185,6 +192,7 @@ class GitRootRoutines(GitRepoRoutines):
         CheckCreateIgnore(workingRepo)
         await feedback_ui.output("Commiting to head")
         workingRepo.index.commit("Initial commit.")
+        invalidate_status(workingtreepath)
         os.chdir(workingtreepath)
 
     async def checkout_worktree_from_backing_routine(self, backingVolume: localvolume, feedback_ui:AbstractFeedbackUI):
@@ -246,41 +254,121 @@ class GitRootRoutines(GitRepoRoutines):
             raise
         return assets
 
+    def get_asset_index(self) -> WorkingAssetIndex:
+        """The shared index of all the assets in this root's working tree."""
+        return get_working_asset_index(self._root_config.GetWorkingPath(self._mapper))
+
     def get_working_asset_by_id(self, id:str) -> GitWorkingAsset:
-        """Returns a workingasset for a path or id from this root, if possible.
+        """Returns a workingasset for an id from this root, if possible.
         """
-        working_assets = self._root_config.GetWorkingAssets(self._mapper, True)
-        for working_asset in working_assets:
-            id = working_asset.GetAsset().GetID()
-            if id.lower() == id.lower():
-                return working_asset
+        found = self.get_asset_index().find_by_id(id)
+        if found is None or not found.IsCheckedOut():
+            return None
+        return found.GetWorkingAsset()
 
 
     def get_working_asset(self, pathorid: str) -> GitWorkingAsset:
         """Returns a workingasset for a path or id from this root, if possible.
         """
-        working_assets = self._root_config.GetWorkingAssets(self._mapper, True)
-        work_tree_dir = self.get_local_repo().working_tree_dir
-        for working_asset in working_assets:
+        index = self.get_asset_index()
+        found = index.find_by_id(pathorid)
+        if found is None:
+            found = index.find_by_path(pathorid)
+        if found is None or not found.IsCheckedOut():
+            raise KeyError("Asset not found: " + pathorid)
+        return found.GetWorkingAsset()
 
-            id = working_asset.GetAsset().GetID()
-            if id.lower() == pathorid.lower():
-                return working_asset
 
+    async def set_shared_lfs_storage_routine(self, feedback_ui:AbstractFeedbackUI, scope:str) -> bool:
+        """Points the root and all its checked out assets at the shared LFS storage of the given scope, or gives
+        each its own storage again if scope is None.  Identical objects are then stored once per scope, rather
+        than once per asset.
 
-            relpath = os.path.relpath(working_asset.GetSubmodule().abspath, work_tree_dir)
-            norm_relpath = os.path.normpath(relpath)
-            norm_pathorid = os.path.normpath(pathorid)
-            if norm_relpath == norm_pathorid:
-                return working_asset
+        Assets checked out later use the shared storage of the repository they're checked out into.
 
-            # path = working_asset.GetSubmodule().path
-            # norm_path = os.path.normpath(path)
-            # if norm_path == norm_pathorid:
-            #    return working_asset
+        @param scope: SHARED_LFS_SCOPE_ROOT, SHARED_LFS_SCOPE_VOLUME or None.
+        """
+        self._root_config.SetSharedLFSScope(scope)
+        self._roots_configuration_component.Commit()
+        self._local_container_routines.commit()
+        storage_path = self._root_config.GetSharedLFSStoragePath(self._mapper)
+
+        paths = [self.get_local_repo().working_tree_dir]
+        for indexed in self.get_asset_index().get_assets():
+            if indexed.IsCheckedOut():
+                paths.append(indexed.GetAbsPath())
+
+        succeeded = True
+        for path in paths:
+            try:
+                if storage_path is None:
+                    copied = await execute_routine(lambda: UnsetSharedLFSStorage(get_repo(path)))
+                    await feedback_ui.output("Own LFS storage: " + path + " - " + str(copied) + " object(s) copied")
+                else:
+                    moved, existing = await execute_routine(lambda: SetSharedLFSStorage(get_repo(path), storage_path))
+                    await feedback_ui.output("Shared LFS storage: " + path + " - " + str(moved) +
+                                             " object(s) moved in, " + str(existing) + " already shared")
+            except (git.GitCommandError, OSError) as err:
+                await feedback_ui.error("Failed to change LFS storage: " + path)
+                await feedback_ui.error(str(err))
+                succeeded = False
+        return succeeded
+
+    async def prune_shared_lfs_storage_routine(self, feedback_ui:AbstractFeedbackUI, scope:str = None,
+                                               dry_run:bool = False) -> bool:
+        """Deletes the objects in the root's shared LFS storage (or the storage of the given scope) that none of
+        the repositories using it reference."""
+        storage_path = self._root_config.GetSharedLFSStoragePath(self._mapper, scope)
+        if storage_path is None or not IsSharedLFSStorage(storage_path):
+            await feedback_ui.error("No shared LFS storage to prune.")
+            return False
+        await feedback_ui.output("Pruning shared LFS storage: " + storage_path)
+        try:
+            deleted, deleted_bytes, kept = await execute_routine(PruneSharedLFSStorage, storage_path,
+                                                                 dry_run=dry_run)
+        except git.GitCommandError as err:
+            await feedback_ui.error("Couldn't list the LFS objects of a repository using the storage.  Not pruning.")
+            await feedback_ui.error(str(err.stderr))
+            return False
+        await feedback_ui.output(("Would delete " if dry_run else "Deleted ") + str(deleted) + " object(s), " +
+                                 str(deleted_bytes) + " bytes.  Kept " + str(kept) + " object(s).")
+        return True
+
+    def get_lfs_fetch_profile(self) -> LFSFetchProfile:
+        """The container's LFS fetch profile on this system."""
+        component = ContainerLFSFetchConfigurationComponent(self.local_container_config)
+        component.Load()
+        return component.get_profile()
 
-        raise KeyError("Asset not found: " + pathorid)
+    async def apply_lfs_fetch_profile_routine(self, feedback_ui:AbstractFeedbackUI, profile:LFSFetchProfile = None,
+                                              hydrate:bool = False) -> bool:
+        """Sets the LFS fetch profile of the root and all its checked out assets, for their pulls.  Assets checked
+        out later use the profile of the repository they're checked out into.
 
+        Files already downloaded are left alone.
+
+        @param profile: the profile to use.  None for the container's.
+        @param hydrate: also download what the profile says to now, rather than at the next pull.
+        """
+        if profile is None:
+            profile = self.get_lfs_fetch_profile()
+        paths = [self.get_local_repo().working_tree_dir]
+        for indexed in self.get_asset_index().get_assets():
+            if indexed.IsCheckedOut():
+                paths.append(indexed.GetAbsPath())
+
+        succeeded = True
+        for path in paths:
+            try:
+                await execute_routine(lambda: SetFetchProfile(get_repo(path), profile))
+                if hydrate:
+                    await feedback_ui.output("Hydrating: " + path)
+                    await lfs_hydrate_routine(path, "origin", profile, feedback_ui)
+            except git.GitCommandError as err:
+                await feedback_ui.error("Failed to apply LFS fetch profile: " + path)
+                await feedback_ui.error(str(err.stderr))
+                succeeded = False
+        return succeeded
 
     def delete_asset(self, pathorid: str):
         workingAsset = self.get_working_asset(pathorid)
@@ -324,16 +412,14 @@ class GitRootRoutines(GitRepoRoutines):
         return True
 
     def can_commit(self) -> (bool, str):
-        repo = self.get_local_repo()
-
-        dirty_index = repo.is_dirty(index=True, working_tree=False, untracked_files=False, submodules=False)
+        status = get_status(self.get_local_repo(), submodules=False)
 
-        dirty_worktree = repo.is_dirty(index=False, working_tree=True, untracked_files=False, submodules=False)
+        dirty_worktree = status.is_worktree_dirty(submodules=False)
 
         if dirty_worktree:
             return False, "Dirty WorkTree"
 
-        untracked_files = repo.is_dirty(index=False, working_tree=False, untracked_files=True, submodules=False)
+        untracked_files = status.has_untracked()
 
         if untracked_files:
             return False, "Untracked Files"
@@ -352,12 +438,10 @@ class GitRootRoutines(GitRepoRoutines):
         #     return False
 
     def is_worktree_dirty(self) -> bool:
-        repo = self.get_local_repo()
-        return repo.is_dirty(index=True, working_tree=False, untracked_files=False, submodules=False)
+        return get_status(self.get_local_repo(), submodules=False).is_worktree_dirty(submodules=False)
 
     def is_index_dirty(self) -> bool:
-        repo = self.get_local_repo()
-        return repo.is_dirty(index=True, working_tree=False, untracked_files=False, submodules=False)
+        return get_status(self.get_local_repo(), submodules=False).is_index_dirty(submodules=False)
 
 
     @property
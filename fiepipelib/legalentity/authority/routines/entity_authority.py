@@ -24,6 +24,9 @@ class LegalEntityAuthorityManagerInteractiveRoutines(AbstractLocalManagedInterac
     def GetAllItems(self) -> typing.List[LegalEntityAuthority]:
         return self.GetManager().GetAll()
 
+    def IterAllItems(self) -> typing.Iterator[LegalEntityAuthority]:
+        return self.GetManager().IterGet()
+
     def ItemToName(self, item: LegalEntityAuthority) -> str:
         return item.get_fqdn()
 
@@ -56,9 +59,9 @@ class LegalEntityAuthorityManagerInteractiveRoutines(AbstractLocalManagedInterac
             await self.get_feedback_ui().error("The given dir is not an absolute path: " + path)
             raise IOError("Not absolute: " + path)
 
-        entities = self.GetAllItems()
-        for e in entities:
-            await self.ExportRegisteredRoutine(e.get_fqdn(), path)
+        fqdns = self.GetManager().GetColumnValues(["fqdn"])
+        for row in fqdns:
+            await self.ExportRegisteredRoutine(row[0], path)
 
     async def RegisterAllRoutine(self):
         """Register all authored entities."""
@@ -18,6 +18,9 @@ class RegisteredEntityManagerInteractiveRoutines(AbstractLocalManagedInteractive
     def GetAllItems(self) -> typing.List[RegisteredEntity]:
         return self.GetManager().GetAll()
 
+    def IterAllItems(self) -> typing.Iterator[RegisteredEntity]:
+        return self.GetManager().IterGet()
+
     def ItemToName(self, item: RegisteredEntity) -> str:
         return item.get_fqdn()
 
@@ -1,14 +1,190 @@
 import abc
+import contextlib
 import json
 import os.path
 import pathlib
 import sqlite3
+import threading
 import typing
 
 import fiepipelib.localuser.routines.localuser
 
 T = typing.TypeVar("T", bound=object)
 
+# seconds a connection will wait on a locked database before raising.
+DB_BUSY_TIMEOUT = 30.0
+
+# the version of the on-disk storage.  Stored in each DB's user_version.
+# v1: json column stored indented.  Lives in 'dbv1' directories.
+# v2: json column stored compact.  Lives in 'dbv2' directories.
+DB_STORAGE_VERSION = 2
+
+# the most idle writer connections each thread keeps per database.  More than that are closed when returned.
+POOL_MAX_IDLE_WRITERS = 4
+
+_pool_lock = threading.RLock()
+_pool_pid: int = None
+_pool_local = threading.local()
+_pool_connections: typing.List[sqlite3.Connection] = []
+_ensured_tables: typing.Set[typing.Tuple[str, str]] = set()
+_upgraded_databases: typing.Set[str] = set()
+
+
+def _check_pool_pid():
+    """Forked children must not share sqlite connections with their parent.  Resets the pool if we've forked."""
+    global _pool_pid, _pool_local, _pool_connections
+    pid = os.getpid()
+    if _pool_pid != pid:
+        with _pool_lock:
+            if _pool_pid != pid:
+                _pool_pid = pid
+                _pool_local = threading.local()
+                _pool_connections = []
+                _ensured_tables.clear()
+                _upgraded_databases.clear()
+
+
+def _open_pooled_connection(filename: str) -> sqlite3.Connection:
+    """Opens and configures a new connection for the pool."""
+    ret = sqlite3.connect(filename, timeout=DB_BUSY_TIMEOUT)
+    ret.row_factory = sqlite3.Row
+    ret.execute("PRAGMA journal_mode=WAL")
+    ret.execute("PRAGMA synchronous=NORMAL")
+    ret.execute("PRAGMA busy_timeout=" + str(int(DB_BUSY_TIMEOUT * 1000)))
+    return ret
+
+
+def _is_connection_usable(conn: sqlite3.Connection) -> bool:
+    try:
+        conn.execute("SELECT 1")
+        return True
+    except sqlite3.ProgrammingError:
+        # closed by someone.
+        return False
+
+
+def _get_thread_pool(name: str) -> dict:
+    _check_pool_pid()
+    ret = getattr(_pool_local, name, None)
+    if ret is None:
+        ret = {}
+        setattr(_pool_local, name, ret)
+    return ret
+
+
+def GetPooledConnection(filename: str) -> sqlite3.Connection:
+    """Returns the calling thread's shared, read-only pooled connection to the given database file, opening one
+    if needed.
+
+    sqlite3 connections may not cross threads, so the pool is per process and per thread.  Connections are
+    opened in WAL journal mode with synchronous=NORMAL and a busy timeout, so readers don't block writers
+    and commits don't fsync every time.
+
+    Coroutines on the same thread share this connection.  So it's query_only, and never holds a transaction
+    open.  Writers check out a connection of their own with CheckoutPooledConnection instead.
+
+    Don't close a pooled connection.  Use ClosePooledConnections if you really need them gone (e.g. before
+    deleting database files).
+    """
+    key = os.path.realpath(filename)
+    conns = _get_thread_pool("connections")
+    ret = conns.get(key, None)
+    if ret is not None and _is_connection_usable(ret):
+        return ret
+    ret = _open_pooled_connection(key)
+    ret.execute("PRAGMA query_only=ON")
+    conns[key] = ret
+    with _pool_lock:
+        _pool_connections.append(ret)
+    return ret
+
+
+def CheckoutPooledConnection(filename: str) -> sqlite3.Connection:
+    """Checks out a writable connection to the given database file, for the caller's use alone, reusing an idle
+    one from the calling thread if there is one.  It is never in a transaction when handed out.
+
+    Give it back with ReturnPooledConnection when done, on the same thread.  Until then, no one else will use it.
+    So a transaction on it can safely span awaits.
+    """
+    key = os.path.realpath(filename)
+    idle = _get_thread_pool("idle").setdefault(key, [])
+    while len(idle) > 0:
+        ret = idle.pop()
+        if _is_connection_usable(ret) and not ret.in_transaction:
+            return ret
+    ret = _open_pooled_connection(key)
+    with _pool_lock:
+        _pool_connections.append(ret)
+    return ret
+
+
+def ReturnPooledConnection(filename: str, conn: sqlite3.Connection):
+    """Returns a connection checked out with CheckoutPooledConnection to the calling thread's pool.  Anything
+    left uncommitted on it is rolled back."""
+    if not _is_connection_usable(conn):
+        return
+    if conn.in_transaction:
+        conn.rollback()
+    idle = _get_thread_pool("idle").setdefault(os.path.realpath(filename), [])
+    if len(idle) >= POOL_MAX_IDLE_WRITERS:
+        conn.close()
+        return
+    idle.append(conn)
+
+
+def ClosePooledConnections():
+    """Closes all pooled connections opened by this process and forgets which tables have been ensured.
+
+    Connections belonging to other threads are closed too, so only call this when no other thread is
+    using a manager.
+    """
+    global _pool_local, _pool_connections
+    _check_pool_pid()
+    with _pool_lock:
+        for conn in _pool_connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass
+        _pool_connections = []
+        _pool_local = threading.local()
+        _ensured_tables.clear()
+        _upgraded_databases.clear()
+
+
+def GetIndexName(table: str, columns: typing.List[str]) -> str:
+    """Builds a stable index name from the table name and the given index column strings.  Collations are part
+    of the name, without the COLLATE keyword."""
+    parts = ["ix", table]
+    for column in columns:
+        parts.extend(column.lower().split())
+    parts = [p for p in parts if p != "collate"]
+    return "_".join(parts)
+
+
+def GetUncoveredIndexes(indexes: typing.List[typing.List[str]], primary: typing.List[str]) -> \
+        typing.List[typing.List[str]]:
+    """Drops the indexes that are a leading part of the primary key, which sqlite already indexes."""
+    ret = []
+    for columns in indexes:
+        if len(columns) <= len(primary) and primary[:len(columns)] == columns:
+            continue
+        ret.append(columns)
+    return ret
+
+
+def CreateIndexes(cur: typing.Union[sqlite3.Connection, sqlite3.Cursor], table: str,
+                  indexes: typing.List[typing.List[str]], schema: str = None):
+    """Creates the given indexes on the table if they don't exist yet.
+
+    @param schema: the attached database the table is in.  None for main.
+    """
+    prefix = "" if schema is None else schema + "."
+    for columns in indexes:
+        statement = "CREATE INDEX IF NOT EXISTS " + prefix + GetIndexName(table, columns) + " ON " + table + \
+                    " (" + ", ".join(columns) + ")"
+        cur.execute(statement)
+
 
 class AbstractLocalTypeManager(typing.Generic[T]):
     """An abstract class with which to make managers of static data.  Currently backed by sqlite.
@@ -27,13 +203,17 @@ class AbstractLocalTypeManager(typing.Generic[T]):
     """
 
     def __init__(self):
-        # we create/update the table
-        conn = self._GetDBConnection()
-        assert isinstance(conn, sqlite3.Connection)
-        cur = conn.cursor()
-        self._CreateTable(cur)
-        conn.commit()
-        conn.close()
+        # we create/update the table, but only once per process and database.  Managers are constructed
+        # often and the table rarely changes underneath us.
+        key = (os.path.realpath(self._GetDBFilename()), self.GetManagedTypeName())
+        _check_pool_pid()
+        if key in _ensured_tables:
+            return
+        with self._WriterConnection() as conn:
+            self._CreateTable(conn)
+            conn.commit()
+        with _pool_lock:
+            _ensured_tables.add(key)
 
     @abc.abstractmethod
     def GetConfigDir(self) -> str:
@@ -48,33 +228,141 @@ class AbstractLocalTypeManager(typing.Generic[T]):
 
     def _GetDBFilename(self) -> str:
         """Returns the full path to the DB file to load."""
-        dir = os.path.join(self.GetConfigDir(), "dbv1")
+        dir = os.path.join(self.GetConfigDir(), "dbv" + str(DB_STORAGE_VERSION))
         if not os.path.exists(dir):
             os.makedirs(dir)
         return os.path.join(dir, self.GetManagedTypeName() + ".db")
 
+    def _GetV1DBFilename(self) -> str:
+        """Returns the full path to where a v1 DB file would be.  It may not exist."""
+        return os.path.join(self.GetConfigDir(), "dbv1", self.GetManagedTypeName() + ".db")
+
+    def _UpgradeDB(self, conn: sqlite3.Connection):
+        """Brings the DB behind the given connection up to DB_STORAGE_VERSION.
+
+        A new v2 DB is populated from the v1 DB if there is one, re-encoding each item's json compactly.  The v1
+        DB is left in place, untouched.  Safe to call repeatedly and from competing processes.
+
+        The connection must be one the caller owns, and must not be in a transaction.
+        """
+        if conn.in_transaction:
+            raise sqlite3.OperationalError("Can't upgrade a DB from inside a transaction.")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= DB_STORAGE_VERSION:
+            return
+        v1filename = self._GetV1DBFilename()
+        v1exists = os.path.exists(v1filename)
+        if v1exists:
+            # attach isn't allowed inside a transaction, so we do it first.
+            conn.execute("ATTACH DATABASE ? AS dbv1", (v1filename,))
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # someone else may have beaten us to it while we waited for the lock.
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version < DB_STORAGE_VERSION:
+                    self._CreateTable(conn)
+                    if v1exists:
+                        self._CopyFromV1DB(conn)
+                    conn.execute("PRAGMA user_version = " + str(DB_STORAGE_VERSION))
+                conn.commit()
+            except:
+                conn.rollback()
+                raise
+        finally:
+            if v1exists:
+                conn.execute("DETACH DATABASE dbv1")
+
+    def _CopyFromV1DB(self, conn: sqlite3.Connection):
+        """Copies all rows from the attached 'dbv1' database into main, re-encoding the json column."""
+        table = self.GetManagedTypeName()
+        found = conn.execute("SELECT name FROM dbv1.sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+        if found is None:
+            return
+        # only columns we still know about come along.
+        known = [col[0] for col in self.GetColumns()]
+        v1names = [row[1] for row in conn.execute("PRAGMA dbv1.table_info(" + table + ")").fetchall()]
+        names = [name for name in v1names if name in known]
+        cur = conn.execute("SELECT " + ", ".join(names) + " FROM dbv1." + table)
+        jsonindex = names.index('json')
+        statement = "REPLACE INTO main." + table + " (" + ", ".join(names) + ") VALUES (" + ", ".join(
+            ["?"] * len(names)) + ")"
+        rows = cur.fetchmany(256)
+        while len(rows) > 0:
+            values = []
+            for row in rows:
+                valrow = list(row)
+                valrow[jsonindex] = self._EncodeJSON(self._DecodeJSON(valrow[jsonindex]))
+                values.append(valrow)
+            conn.executemany(statement, values)
+            rows = cur.fetchmany(256)
+
+    def _EnsureUpgraded(self):
+        """Upgrades older storage versions, once per process and database.  Failure raises."""
+        filename = self._GetDBFilename()
+        _check_pool_pid()
+        key = os.path.realpath(filename)
+        if key in _upgraded_databases:
+            return
+        conn = CheckoutPooledConnection(filename)
+        try:
+            self._UpgradeDB(conn)
+        finally:
+            ReturnPooledConnection(filename, conn)
+        with _pool_lock:
+            _upgraded_databases.add(key)
+
     def _GetDBConnection(self) -> sqlite3.Connection:
-        """Returns an open sqlite3 connection for the mananger's data.  Keep in mind, the database is usually
-        locked based on the transaction this connection represents.  So grab it, use it, and dump it quickly
-        to avoid blocking processes.  Or, hold on to it if you really need to."""
-        # TODO: when we move to v2, we'll need to detect the missing v2
-        # and run an upgrade from v1 to v2 here.  And upon failure, raise
-        # an exception.
-        ret = sqlite3.connect(self._GetDBFilename())
+        """Returns the shared, read-only pooled sqlite3 connection for the mananger's data.  It's shared with
+        other managers and coroutines on this thread, so it's only for reads and should not be closed.  Writes go
+        through _WriterConnection."""
+        self._EnsureUpgraded()
+        ret = GetPooledConnection(self._GetDBFilename())
         assert isinstance(ret, sqlite3.Connection)
         return ret
 
+    @contextlib.contextmanager
+    def _WriterConnection(self, conn: sqlite3.Connection = None) -> typing.Iterator[sqlite3.Connection]:
+        """A context in which to write.  Yields the given connection if there is one.  Otherwise a pooled
+        connection checked out for the context alone, which is returned (and anything uncommitted rolled back)
+        when the context exits."""
+        if conn is not None:
+            yield conn
+            return
+        self._EnsureUpgraded()
+        filename = self._GetDBFilename()
+        ret = CheckoutPooledConnection(filename)
+        try:
+            yield ret
+        finally:
+            ReturnPooledConnection(filename, ret)
+
     def GetDBConnection(self) -> sqlite3.Connection:
         """Returns an open sqlite3 connection with the mananger's data as the "main" DB.  Keep in mind, the
         database is usually
         locked based on the transaction this connection represents.  So grab it, use it, and dump it quickly
         to avoid blocking processes.  Or, hold on to it if you really need to.
         
-        Most manager methods that take a connection argument will open and close one automatically.  If you
+        Most manager methods that take a connection argument will use a pooled one automatically.  If you
         instead intend to use a connection's transation capabilities, you'll want to get one here
         and pass it around, using it's commit, rollback methods at appropriate times.
+
+        The returned connection is checked out of the pool for the caller alone.  Give it back with
+        ReturnDBConnection when done.
         """
-        return self._GetDBConnection()
+        self._EnsureUpgraded()
+        return CheckoutPooledConnection(self._GetDBFilename())
+
+    def ReturnDBConnection(self, conn: sqlite3.Connection):
+        """Gives a connection from GetDBConnection back to the pool.  Anything uncommitted is rolled back."""
+        ReturnPooledConnection(self._GetDBFilename(), conn)
+
+    def OpenDBConnection(self) -> sqlite3.Connection:
+        """Opens a new, unpooled connection to the manager's data, configured like the pooled ones.  For when a
+        connection needs state of its own, such as attached databases or pragmas.  The caller owns it and
+        must close it."""
+        self._EnsureUpgraded()
+        return _open_pooled_connection(os.path.realpath(self._GetDBFilename()))
 
     @abc.abstractmethod
     def GetColumns(self) -> typing.List[typing.Tuple[str, str]]:
@@ -102,8 +390,32 @@ class AbstractLocalTypeManager(typing.Generic[T]):
         """Returns a list of column names that make up the primary key"""
         raise NotImplementedError()
 
+    def GetIndexes(self) -> typing.List[typing.List[str]]:
+        """Override this and call super to add indexes: Returns a list of indexes to create on the table.  Each
+        index is a list of column names.
+
+        The baseclass returns a single column index for each searchable (non 'json') column from GetColumns,
+        skipping the column that leads the primary key, which sqlite already indexes.
+
+        Append composite indexes as multiple column names.  e.g. ['fqdn','shortname']
+
+        A column name may be followed by a collation for case-insensitive indexes.  e.g. ['fqdn COLLATE NOCASE']
+        Such an index is only used by searches that pass the same column string as the column name.  e.g.
+        self._Get([('fqdn COLLATE NOCASE', fqdn)])
+        """
+        ret = []
+        for col in self.GetColumns():
+            if col[0] != 'json':
+                ret.append([col[0]])
+        return GetUncoveredIndexes(ret, self.GetPrimaryKeyColumns())
+
+    def _CreateIndexes(self, conn: sqlite3.Connection):
+        """Creates any declared indexes that don't yet exist.  Safe to run against existing databases, which is
+        how older databases created before indexes were declared get upgraded."""
+        CreateIndexes(conn, self.GetManagedTypeName(), self.GetIndexes())
+
     def _CreateTable(self, conn: sqlite3.Connection = None):
-        """Checks for and automatically creates the neccesaary table.
+        """Checks for and automatically creates the neccesaary table and its indexes.
         """
         statement = "CREATE TABLE IF NOT EXISTS " + self.GetManagedTypeName() + "( "
         cols = self.GetColumns()
@@ -119,14 +431,16 @@ class AbstractLocalTypeManager(typing.Generic[T]):
 
         statement = statement + colstring + ", PRIMARY KEY (" + primstring + ") )"
 
-        if conn == None:
-            conn = self._GetDBConnection()
-
-        conn.execute(statement)
-        # TODO: add indexes here
+        with self._WriterConnection(conn) as writer:
+            writer.execute(statement)
+            self._CreateIndexes(writer)
+            if conn is None:
+                writer.commit()
 
     def _CreateUpdateRows(self, data: typing.List[dict], conn: sqlite3.Connection = None, commit=True):
         """Uses the REPLACE statement to insert or update a row regardless of if it exsits or not.
+        All rows go in with a single executemany, in one transaction.
+        Without a connection, the rows are committed on one of their own, regardless of commit.
         @param data: A list of dictionaries of names and data to insert
         """
         statement = "REPLACE INTO " + self.GetManagedTypeName() + " ("
@@ -142,34 +456,26 @@ class AbstractLocalTypeManager(typing.Generic[T]):
                 for k in data[0].keys():
                     valrow.append(row[k])
                 values.append(valrow)
-                statement = statement + ", ".join(names) + ") VALUES (" + " ,".join(qmarks) + ")"
-            if conn == None:
-                conn = self._GetDBConnection()
-            cur = conn.cursor()
-            cur.executemany(statement, values)
-            if commit:
-                conn.commit()
+            statement = statement + ", ".join(names) + ") VALUES (" + " ,".join(qmarks) + ")"
+            with self._WriterConnection(conn) as writer:
+                cur = writer.cursor()
+                cur.executemany(statement, values)
+                if commit or conn is None:
+                    writer.commit()
 
     def _DeleteRowsByMultipleAND(self, colNamesAndValues: typing.List[typing.Tuple[str, typing.Any]] = [],
                                  conn: sqlite3.Connection = None, commit=True):
         """Runs a delete statement to search for and delete rows matching all passed column and value tupples with AND logic.
+        Without a connection, the delete is committed on one of its own, regardless of commit.
         @param colNamesAndValues: A list of tupples.  e.g. [("firstname","John"),("lastname","Doe")]
         """
         statement = "DELETE FROM " + self.GetManagedTypeName()
-        if conn == None:
-            conn = self._GetDBConnection()
-        cur = conn.cursor()
-        clauses = []
-        values = []
-        if len(colNamesAndValues) > 0:
-            statement = statement + " WHERE "
-            for i in colNamesAndValues:
-                clauses.append(i[0] + " = ?")
-                values.append(str(i[1]))
-            statement = statement + " AND ".join(clauses)
-        cur.execute(statement, values)
-        if commit:
-            conn.commit()
+        where, values = self._WhereClause(colNamesAndValues)
+        with self._WriterConnection(conn) as writer:
+            cur = writer.cursor()
+            cur.execute(statement + where, values)
+            if commit or conn is None:
+                writer.commit()
 
     def _GetRowsByMultipleAND(self, cur: sqlite3.Cursor,
                               colNamesAndValues: typing.List[typing.Tuple[str, typing.Any]] = []):
@@ -180,15 +486,22 @@ class AbstractLocalTypeManager(typing.Generic[T]):
         Ideally values are already strings.  But we run an str internally just incase.
         """
         statement = "SELECT * FROM " + self.GetManagedTypeName()
+        where, values = self._WhereClause(colNamesAndValues)
+        cur.execute(statement + where, values)
+
+    def _WhereClause(self, colNamesAndValues: typing.List[typing.Tuple[str, typing.Any]] = []) -> typing.Tuple[
+        str, typing.List[str]]:
+        """Builds an AND based WHERE clause and its values from the given column and value tupples.
+        Returns an empty clause if there are no tupples.
+        """
         clauses = []
         values = []
-        if len(colNamesAndValues) > 0:
-            statement = statement + " WHERE "
-            for i in colNamesAndValues:
-                clauses.append(i[0] + " = ?")
-                values.append(str(i[1]))
-            statement = statement + " AND ".join(clauses)
-        cur.execute(statement, values)
+        if len(colNamesAndValues) == 0:
+            return "", values
+        for i in colNamesAndValues:
+            clauses.append(i[0] + " = ?")
+            values.append(str(i[1]))
+        return " WHERE " + " AND ".join(clauses), values
 
     @abc.abstractmethod
     def ToJSONData(self, item: T) -> dict:
@@ -200,9 +513,18 @@ class AbstractLocalTypeManager(typing.Generic[T]):
         """Override this: Converts the givne JSON data, which is a dictionary, into an item and returns it."""
         raise NotImplementedError()
 
+    def _EncodeJSON(self, jsondata: dict) -> str:
+        """Encodes JSON data for storage in the 'json' column.  Compact, with sorted keys so identical items
+        store identically.  Pretty printing is for exports, not storage."""
+        return json.dumps(jsondata, separators=(',', ':'), sort_keys=True)
+
+    def _DecodeJSON(self, text: str) -> dict:
+        """Decodes the 'json' column.  Reads both compact and older indented storage."""
+        return json.loads(text)
+
     def _ItemFromRow(self, row: sqlite3.Row) -> T:
         """Converts row data into an item and returns it."""
-        return self.FromJSONData(json.loads(row['json']))
+        return self.FromJSONData(self._DecodeJSON(row['json']))
 
     def _ItemsToInsertData(self, items: typing.List[T]) -> typing.List[typing.Tuple[str, typing.Any]]:
         """Converts the given list of items into data suitable for insertion into the databse."""
@@ -210,7 +532,7 @@ class AbstractLocalTypeManager(typing.Generic[T]):
         for item in items:
             jsondata = self.ToJSONData(item)
             row = {}
-            row['json'] = json.dumps(jsondata,indent=4,sort_keys=True)
+            row['json'] = self._EncodeJSON(jsondata)
             for col in self.GetColumns():
                 if col[0] != 'json':
                     row[col[0]] = str(jsondata[col[0]])
@@ -244,6 +566,78 @@ class AbstractLocalTypeManager(typing.Generic[T]):
     def GetAll(self, conn: sqlite3.Connection = None) -> typing.List[T]:
         return self._Get(conn=conn)
 
+    def IterGet(self, colNamesAndValues: typing.List[typing.Tuple[str, typing.Any]] = [],
+                conn: sqlite3.Connection = None, batch_size: int = 64) -> typing.Iterator[T]:
+        """A lazy version of _Get.  Streams matching rows from the DB in batches and only decodes each item as it
+        is iterated.  Useful when walking large registries, or when you might stop early.
+
+        @param colNamesAndValues: a list of tupples of column name and value pairs.  Empty for all items.
+        @param batch_size: the number of rows to fetch from sqlite at a time.
+        """
+        if conn == None:
+            conn = self._GetDBConnection()
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        self._GetRowsByMultipleAND(cur, colNamesAndValues)
+        try:
+            rows = cur.fetchmany(batch_size)
+            while len(rows) > 0:
+                for row in rows:
+                    yield self._ItemFromRow(row)
+                rows = cur.fetchmany(batch_size)
+        finally:
+            cur.close()
+
+    def GetColumnValues(self, columns: typing.List[str],
+                        colNamesAndValues: typing.List[typing.Tuple[str, typing.Any]] = [],
+                        conn: sqlite3.Connection = None) -> typing.List[tuple]:
+        """Gets just the values of the given searchable columns for items matching an AND based filter, without
+        decoding the items themselves.
+
+        e.g. GetColumnValues(['fqdn']) returns [('them.com',),('us.com',)]
+
+        @param columns: names of columns to return, in order.  Usually those returned from GetColumns.
+        @param colNamesAndValues: a list of tupples of column name and value pairs.  Empty for all items.
+        @return: A list of tuples of values, one tuple per row.
+        """
+        if len(columns) == 0:
+            raise ValueError("No columns requested.")
+        if conn == None:
+            conn = self._GetDBConnection()
+        statement = "SELECT " + ", ".join(columns) + " FROM " + self.GetManagedTypeName()
+        where, values = self._WhereClause(colNamesAndValues)
+        cur = conn.cursor()
+        cur.execute(statement + where, values)
+        ret = [tuple(row) for row in cur.fetchall()]
+        cur.close()
+        return ret
+
+    def Count(self, colNamesAndValues: typing.List[typing.Tuple[str, typing.Any]] = [],
+              conn: sqlite3.Connection = None) -> int:
+        """Counts the items that match an AND based filter.  Empty for all items."""
+        if conn == None:
+            conn = self._GetDBConnection()
+        statement = "SELECT COUNT(*) FROM " + self.GetManagedTypeName()
+        where, values = self._WhereClause(colNamesAndValues)
+        cur = conn.cursor()
+        cur.execute(statement + where, values)
+        ret = cur.fetchone()[0]
+        cur.close()
+        return ret
+
+    def Exists(self, colNamesAndValues: typing.List[typing.Tuple[str, typing.Any]] = [],
+               conn: sqlite3.Connection = None) -> bool:
+        """Returns true if any item matches an AND based filter.  Stops at the first match."""
+        if conn == None:
+            conn = self._GetDBConnection()
+        statement = "SELECT 1 FROM " + self.GetManagedTypeName()
+        where, values = self._WhereClause(colNamesAndValues)
+        cur = conn.cursor()
+        cur.execute(statement + where + " LIMIT 1", values)
+        ret = cur.fetchone() is not None
+        cur.close()
+        return ret
+
     def Set(self, items: typing.List[T], conn: sqlite3.Connection = None, commit=True):
         """Sets (create/update) items.
         @param items: A list of items to set.
@@ -283,17 +677,15 @@ class AbstractLocalTypeManager(typing.Generic[T]):
         statement = ".dump"
         cur.execute(statement)
         cur.close()
-        conn.close()
 
     def _readFrom(self, path: str, conn: sqlite3.Connection = None):
         p = pathlib.Path(path)
-        if conn == None:
-            conn = self._GetDBConnection()
-        cur = conn.cursor()
-        assert isinstance(cur, sqlite3.Cursor)
-        statement = ".read " + str(p.absolute())
-        cur.execute(statement)
-        conn.commit()
+        with self._WriterConnection(conn) as writer:
+            cur = writer.cursor()
+            assert isinstance(cur, sqlite3.Cursor)
+            statement = ".read " + str(p.absolute())
+            cur.execute(statement)
+            writer.commit()
 
 class AbstractUserLocalTypeManager(AbstractLocalTypeManager[T]):
     """Subclass this.
@@ -1,4 +1,6 @@
 import abc
+import asyncio
+import concurrent.futures
 import json
 import os
 import os.path
@@ -29,6 +31,13 @@ class AbstractLocalManagedRoutines(typing.Generic[T]):
     def GetAllItems(self) -> typing.List[T]:
         raise NotImplementedError()
 
+    def IterAllItems(self) -> typing.Iterator[T]:
+        """The same items as GetAllItems, decoded one at a time as they're iterated rather than all up front.
+
+        Override alongside GetAllItems, with the manager's IterGet and the same filter.  The default just iterates
+        GetAllItems."""
+        return iter(self.GetAllItems())
+
     @abc.abstractmethod
     def ItemToName(self, item: T) -> str:
         raise NotImplementedError()
@@ -41,6 +50,22 @@ class AbstractLocalManagedRoutines(typing.Generic[T]):
     async def DeleteRoutine(self, name: str):
         raise NotImplementedError()
 
+    def _ReadItemFile(self, path: pathlib.Path) -> dict:
+        """Reads an item's JSON data from a file."""
+        with path.open() as f:
+            return json.load(f)
+
+    def _ItemToFileText(self, item: T) -> str:
+        """Serializes an item to the text of its export file.  Exports are pretty printed for humans and diffs."""
+        data = self.GetManager().ToJSONData(item)
+        return json.dumps(data, indent=4, sort_keys=True)
+
+    def _WriteItemFile(self, item: T, path: pathlib.Path):
+        """Writes an item's JSON data to a file."""
+        text = self._ItemToFileText(item)
+        with path.open('w') as f:
+            f.write(text)
+
     async def ImportRoutine(self, path):
         """Import an item from a file
         @arg path:  The absolute path to a .json file which contains an item's JSON data."""
@@ -55,9 +80,7 @@ class AbstractLocalManagedRoutines(typing.Generic[T]):
             await self.get_feedback_ui().error("the path does not lead to a file: " + str(path))
             raise IOError(str(path))
 
-        data = None
-        with path.open() as f:
-            data = json.load(f)
+        data = self._ReadItemFile(path)
 
         man = self.GetManager()
         entity = man.FromJSONData(data)
@@ -68,7 +91,10 @@ class AbstractLocalManagedRoutines(typing.Generic[T]):
     async def ImportAllRoutine(self, path):
         """Import all items from a directory
         Usage: import [pathname]
-        arg pathname:  The absolute path to a directory which contains .json files which contain item JSON data."""
+        arg pathname:  The absolute path to a directory which contains .json files which contain item JSON data.
+
+        Files are read in parallel and all items are registered in a single transaction.  If any file fails to
+        read, nothing is registered."""
         path = pathlib.Path(path)
         if not path.is_absolute():
             await self.get_feedback_ui().error("pathname is not an absolute path.")
@@ -79,11 +105,27 @@ class AbstractLocalManagedRoutines(typing.Generic[T]):
         if not path.is_dir():
             await self.get_feedback_ui().error("the path does not lead to a directory: " + str(path))
             raise IOError()
-        files = os.listdir(str(path))
-        for file in files:
+        files = []
+        for file in os.listdir(str(path)):
             f, e = os.path.splitext(file)
             if (e.lower() == ".json"):
-                await self.ImportRoutine(os.path.join(str(path), file))
+                files.append(path / file)
+
+        if len(files) == 0:
+            return
+
+        loop = asyncio.get_event_loop()
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            futures = [loop.run_in_executor(executor, self._ReadItemFile, file) for file in files]
+            datas = await asyncio.gather(*futures)
+
+        man = self.GetManager()
+        entities = []
+        for file, data in zip(files, datas):
+            entities.append(man.FromJSONData(data))
+            await self.get_feedback_ui().feedback("found valid item at: " + str(file))
+        man.Set(entities)
+        await self.get_feedback_ui().feedback("registered " + str(len(entities)) + " items.")
 
     async def ExportRoutine(self, name: str, path: str):
         """Export an item to a file
@@ -98,16 +140,16 @@ class AbstractLocalManagedRoutines(typing.Generic[T]):
             os.makedirs(str(parDirPath))
 
         item = self.GetItemByName(name)
-        man = self.GetManager()
-        data = man.ToJSONData(item)
-        with path.open('w') as f:
-            json.dump(data, f,indent=4,sort_keys=True)
+        self._WriteItemFile(item, path)
 
         await self.get_feedback_ui().feedback("File written: " + str(path))
 
     async def ExportAllRoutine(self, path: str):
         """Export all items to a directory
-        arg path:  The absolute path to a directory."""
+        arg path:  The absolute path to a directory.
+
+        Items are streamed from the DB and each is written as it's decoded.  We don't look each one up again by
+        name."""
         path = pathlib.Path(path)
 
         if not path.is_absolute():
@@ -121,11 +163,61 @@ class AbstractLocalManagedRoutines(typing.Generic[T]):
             await self.get_feedback_ui().error("the path does not lead to a directory: " + str(path))
             raise IOError()
 
-        allItems = self.GetAllItems()
+        for item in self.IterAllItems():
+            itemPath = path / (self.ItemToName(item) + ".json")
+            self._WriteItemFile(item, itemPath)
+            await self.get_feedback_ui().feedback("File written: " + str(itemPath))
 
-        for item in allItems:
-            itemPath = os.path.join(str(path), self.ItemToName(item) + ".json")
-            await self.ExportRoutine(self.ItemToName(item), itemPath)
+    async def ExportAllIncrementalRoutine(self, path: str) -> typing.Tuple[typing.List[str], typing.List[str]]:
+        """Export all items to a directory, touching only what changed.
+
+        Files whose contents already match the item's export are left alone.  Other .json files in the directory,
+        which no longer correspond to an item, are removed.
+        arg path:  The absolute path to a directory.
+        @return: A tuple of two lists: the filenames written and the filenames removed.  Relative to path.
+        """
+        path = pathlib.Path(path)
+
+        if not path.is_absolute():
+            await self.get_feedback_ui().error("pathname is not an absolute path.")
+            raise IOError()
+
+        if not path.exists():
+            os.makedirs(str(path))
+
+        if not path.is_dir():
+            await self.get_feedback_ui().error("the path does not lead to a directory: " + str(path))
+            raise IOError()
+
+        existing = set()
+        for file in os.listdir(str(path)):
+            f, e = os.path.splitext(file)
+            if (e.lower() == ".json"):
+                existing.add(file)
+
+        written = []
+        exported = set()
+        for item in self.IterAllItems():
+            filename = self.ItemToName(item) + ".json"
+            exported.add(filename)
+            itemPath = path / filename
+            text = self._ItemToFileText(item)
+            if filename in existing:
+                with itemPath.open() as f:
+                    if f.read() == text:
+                        continue
+            with itemPath.open('w') as f:
+                f.write(text)
+            written.append(filename)
+            await self.get_feedback_ui().feedback("File written: " + str(itemPath))
+
+        removed = []
+        for filename in sorted(existing - exported):
+            os.remove(str(path / filename))
+            removed.append(filename)
+            await self.get_feedback_ui().feedback("File removed: " + str(path / filename))
+
+        return written, removed
 
 
 class AbstractLocalManagedInteractiveRoutines(AbstractLocalManagedRoutines[T]):
@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from fiepipelib.assetdata.data.assetdatabasemanager import hashfile
+from fiepipelib.assetdata.data.items import AbstractItemsRelation, DUMP_FORMAT_HEADER
+
+# rows that have to survive a dump and read exactly.
+_TEXT_ROWS = [
+    ("plain", "hello"),
+    ("quotes", "it's \"quoted\""),
+    ("lf", "one\ntwo\n"),
+    ("crlf", "one\r\ntwo\r\n"),
+    ("cr", "\rone\rtwo"),
+    ("nul", "a\0b\0"),
+    ("only nul", "\0"),
+    ("mixed", "'\r\n\0'\n"),
+    ("unicode", "é中\U0001F600"),
+    ("empty", ""),
+    ("null", None),
+]
+
+_OTHER_ROWS = [
+    (1, 1.5, b"\x00\xff\r\n", None),
+    (2, -0.0, b"", 9223372036854775807),
+    (3, 1e300, None, -9223372036854775808),
+    (4, float("inf"), b"\x00", 0),
+    (5, None, None, None),
+]
+
+
+class _TestRelation(AbstractItemsRelation):
+    """A relation that lives in a temp dir, rather than in a working asset."""
+
+    def __init__(self, dir: str, name: str):
+        super().__init__(None, [])
+        self._dir = dir
+        self._name = name
+
+    def GetMultiManagedName(self) -> str:
+        return self._name
+
+    def GetDBDir(self):
+        return os.path.join(self._dir, "db")
+
+    def GetDumpDir(self):
+        return os.path.join(self._dir, "dumps")
+
+
+class AssetDBDumpTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.source = _TestRelation(self.dir, "source")
+        conn = self.source._Connect()
+        conn.execute("CREATE TABLE texts (name text, value text, PRIMARY KEY (name))")
+        conn.execute("CREATE TABLE others (id integer, real_value real, blob_value blob, int_value integer, "
+                     "PRIMARY KEY (id))")
+        conn.execute("CREATE INDEX ix_texts_value ON texts (value)")
+        conn.executemany("INSERT INTO texts VALUES (?, ?)", _TEXT_ROWS)
+        conn.executemany("INSERT INTO others VALUES (?, ?, ?, ?)", reversed(_OTHER_ROWS))
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def _rows(self, relation: AbstractItemsRelation, table: str):
+        conn = relation._Connect()
+        try:
+            return conn.execute("SELECT * FROM " + table + " ORDER BY 1").fetchall()
+        finally:
+            conn.close()
+
+    def _round_trip(self, name: str) -> AbstractItemsRelation:
+        copy = _TestRelation(self.dir, name)
+        copy._readFrom(self.source._GetDBDumpFilename())
+        return copy
+
+    def test_round_trip(self):
+        self.source._dumpTo(self.source._GetDBDumpFilename())
+        copy = self._round_trip("copy")
+        self.assertEqual(sorted(_TEXT_ROWS, key=lambda r: r[0]), self._rows(copy, "texts"))
+        self.assertEqual(_OTHER_ROWS, self._rows(copy, "others"))
+
+    def test_every_row_is_one_line(self):
+        self.source._dumpTo(self.source._GetDBDumpFilename())
+        with open(self.source._GetDBDumpFilename(), "rb") as f:
+            data = f.read()
+        self.assertNotIn(b"\r", data)
+        self.assertNotIn(b"\0", data)
+        lines = data.decode("utf-8").splitlines()
+        self.assertEqual(DUMP_FORMAT_HEADER, lines[0])
+        inserts = [line for line in lines if line.startswith("INSERT INTO")]
+        self.assertEqual(len(_TEXT_ROWS) + len(_OTHER_ROWS), len(inserts))
+
+    def test_returned_hash_is_the_file_hash(self):
+        path = self.source._GetDBDumpFilename()
+        hash = self.source._dumpTo(path)
+        self.assertEqual(hashfile(path), hash)
+
+    def test_dump_is_deterministic(self):
+        hash = self.source._dumpTo(self.source._GetDBDumpFilename())
+        copy = self._round_trip("copy")
+        self.assertEqual(hash, copy._dumpTo(copy._GetDBDumpFilename()))
+        with open(self.source._GetDBDumpFilename(), "rb") as f:
+            source_data = f.read()
+        with open(copy._GetDBDumpFilename(), "rb") as f:
+            self.assertEqual(source_data, f.read())
+
+    def test_indexes_are_left_out(self):
+        self.source._dumpTo(self.source._GetDBDumpFilename())
+        with open(self.source._GetDBDumpFilename(), "r", encoding="utf-8") as f:
+            self.assertNotIn("ix_texts_value", f.read())
+
+    def test_splices_dirty_tables(self):
+        path = self.source._GetDBDumpFilename()
+        hash = self.source._dumpTo(path)
+        conn = self.source._Connect()
+        conn.execute("INSERT INTO texts VALUES (?, ?)", ("added", "new\r\n\0"))
+        conn.commit()
+        conn.close()
+        self.assertIsNone(self.source._dumpTo(path, set(), hash))
+        spliced = self.source._dumpTo(path, {"texts"}, hash)
+        self.assertEqual(hashfile(path), spliced)
+        self.assertEqual(spliced, self.source._dumpTo(path))
+        copy = self._round_trip("copy")
+        self.assertIn(("added", "new\r\n\0"), self._rows(copy, "texts"))
+
+    def test_regenerates_whole_dump_that_changed_on_disk(self):
+        path = self.source._GetDBDumpFilename()
+        hash = self.source._dumpTo(path)
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text.replace("VALUES(5,", "VALUES(6,"))
+        self.source._dumpTo(path, {"texts"}, hash)
+        copy = self._round_trip("copy")
+        self.assertEqual(_OTHER_ROWS, self._rows(copy, "others"))
+
+    def test_reads_older_iterdumps(self):
+        # iterdump can't write infinities or NULs.  So the older format never had them.
+        older = _TestRelation(self.dir, "older")
+        conn = older._Connect()
+        try:
+            conn.execute("CREATE TABLE texts (name text, value text, PRIMARY KEY (name))")
+            conn.executemany("INSERT INTO texts VALUES (?, ?)", _TEXT_ROWS[:5])
+            conn.commit()
+            script = "\n".join(conn.iterdump())
+        finally:
+            conn.close()
+        with open(self.source._GetDBDumpFilename(), "w", encoding="utf-8") as f:
+            f.write(script)
+        copy = self._round_trip("copy")
+        self.assertEqual(sorted(_TEXT_ROWS[:5], key=lambda r: r[0]), self._rows(copy, "texts"))
+
+
+if __name__ == '__main__':
+    unittest.main()
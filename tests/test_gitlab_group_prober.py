@@ -0,0 +1,187 @@
+import http.server
+import json
+import threading
+import unittest
+import urllib.parse
+
+import gitlab
+
+from fiepipelib.gitlabserver.routines.gitlabserver import GitLabServerRoutines, GitLabGroupProjectsProber, \
+    clear_gitlab_caches
+
+
+class _MockGitLabHandler(http.server.BaseHTTPRequestHandler):
+    """Just enough of the GitLab v4 API for the prober: a group by path and its projects, paginated like GitLab
+    does, with Link headers."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, code: int, data, headers: dict = None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if headers is not None:
+            for name, value in headers.items():
+                self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        mock = self.server.mock
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        parts = [urllib.parse.unquote(part) for part in url.path.split("/") if part != ""]
+        mock.requests.append((url.path, query))
+        if mock.fail:
+            self._send_json(500, {"message": "500 Internal Server Error"})
+            return
+        if parts[:3] != ["api", "v4", "groups"] or len(parts) < 4:
+            self._send_json(404, {"message": "404 Not Found"})
+            return
+        if parts[3] not in (mock.group_path, str(mock.group_id)):
+            self._send_json(404, {"message": "404 Group Not Found"})
+            return
+        if len(parts) == 4:
+            self._send_json(200, {"id": mock.group_id, "path": mock.group_path, "name": mock.group_path})
+            return
+        if len(parts) == 5 and parts[4] == "projects":
+            search = query.get("search", "")
+            matching = [name for name in mock.project_names if search in name]
+            per_page = min(int(query.get("per_page", "20")), mock.max_per_page)
+            page = int(query.get("page", "1"))
+            total_pages = max(1, (len(matching) + per_page - 1) // per_page)
+            items = [{"id": i, "path": name, "name": name} for i, name in
+                     enumerate(matching[(page - 1) * per_page:page * per_page])]
+            headers = {"X-Page": str(page), "X-Per-Page": str(per_page), "X-Total": str(len(matching)),
+                       "X-Total-Pages": str(total_pages)}
+            if page < total_pages:
+                next_query = dict(query)
+                next_query["page"] = str(page + 1)
+                next_url = "http://" + self.headers["Host"] + url.path + "?" + urllib.parse.urlencode(next_query)
+                headers["X-Next-Page"] = str(page + 1)
+                headers["Link"] = '<' + next_url + '>; rel="next"'
+            self._send_json(200, items, headers)
+            return
+        self._send_json(404, {"message": "404 Not Found"})
+
+
+class _MockGitLab(object):
+    """A local GitLab API server on a free port."""
+
+    def __init__(self, group_path: str, project_names, max_per_page: int = 100):
+        self.group_path = group_path
+        self.group_id = 7
+        self.project_names = list(project_names)
+        self.max_per_page = max_per_page
+        self.fail = False
+        self.requests = []
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _MockGitLabHandler)
+        self._server.mock = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def get_url(self) -> str:
+        return "http://127.0.0.1:" + str(self._server.server_address[1])
+
+    def project_list_requests(self):
+        return [request for request in self.requests if request[0].endswith("/projects")]
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _MockGitLabServerRoutines(GitLabServerRoutines):
+    """Server routines that talk to the mock, rather than a configured server."""
+
+    def __init__(self, server_name: str, url: str):
+        super().__init__(server_name)
+        self._url = url
+
+    def get_gitlab_client(self) -> gitlab.Gitlab:
+        return gitlab.Gitlab(url=self._url, private_token="token")
+
+
+class GitLabGroupProjectsProberTests(unittest.TestCase):
+
+    def setUp(self):
+        clear_gitlab_caches()
+        self.root_ids = ["1a-2b_3c", "44-55"]
+        names = ["fiepipe_gitasset_" + str(i) for i in range(230)]
+        names.append("notfiepipe_other")
+        names.append("unrelated")
+        self.mock = _MockGitLab("grp", names, max_per_page=100)
+        self.mock.start()
+        self.server_routines = _MockGitLabServerRoutines("mock", self.mock.get_url())
+        self.mock.project_names.append(self.server_routines.project_name_for_gitroot(self.root_ids[0]))
+
+    def tearDown(self):
+        self.mock.stop()
+        clear_gitlab_caches()
+
+    def test_reads_every_page(self):
+        prober = GitLabGroupProjectsProber(self.server_routines, "grp")
+        self.assertTrue(prober.is_available())
+        self.assertTrue(prober.project_exists("fiepipe_gitasset_0"))
+        self.assertTrue(prober.project_exists("fiepipe_gitasset_229"))
+        # 231 matching projects at 100 a page.
+        self.assertEqual(3, len(self.mock.project_list_requests()))
+
+    def test_listing_is_loaded_once(self):
+        prober = GitLabGroupProjectsProber(self.server_routines, "grp")
+        for i in range(230):
+            self.assertTrue(prober.asset_exists(str(i)))
+        self.assertEqual(3, len(self.mock.project_list_requests()))
+
+    def test_misses(self):
+        prober = GitLabGroupProjectsProber(self.server_routines, "grp")
+        self.assertFalse(prober.project_exists("fiepipe_gitasset_230"))
+        self.assertFalse(prober.root_exists(self.root_ids[1]))
+        self.assertTrue(prober.root_exists(self.root_ids[0]))
+        # the search is a substring match on the server.  Names without the prefix don't count.
+        self.assertFalse(prober.project_exists("notfiepipe_other"))
+        self.assertFalse(prober.project_exists("unrelated"))
+
+    def test_missing_group_has_no_projects(self):
+        prober = GitLabGroupProjectsProber(self.server_routines, "nogroup")
+        self.assertTrue(prober.is_available())
+        self.assertFalse(prober.project_exists("fiepipe_gitasset_0"))
+        self.assertEqual(0, len(self.mock.project_list_requests()))
+
+    def test_mark_exists(self):
+        prober = GitLabGroupProjectsProber(self.server_routines, "grp")
+        self.assertFalse(prober.asset_exists("new"))
+        prober.mark_exists(self.server_routines.project_name_for_gitasset("new"))
+        self.assertTrue(prober.asset_exists("new"))
+
+    def test_refresh_sees_new_projects(self):
+        prober = GitLabGroupProjectsProber(self.server_routines, "grp")
+        self.assertFalse(prober.project_exists("fiepipe_gitasset_new"))
+        self.mock.project_names.append("fiepipe_gitasset_new")
+        # cached until refreshed.
+        self.assertFalse(prober.project_exists("fiepipe_gitasset_new"))
+        prober.refresh()
+        self.assertTrue(prober.project_exists("fiepipe_gitasset_new"))
+
+    def test_unavailable_when_the_api_fails(self):
+        self.mock.fail = True
+        prober = GitLabGroupProjectsProber(self.server_routines, "grp")
+        self.assertFalse(prober.is_available())
+        with self.assertRaises(RuntimeError):
+            prober.project_exists("fiepipe_gitasset_0")
+        # it doesn't ask again until refreshed.
+        requests = len(self.mock.requests)
+        self.assertFalse(prober.is_available())
+        self.assertEqual(requests, len(self.mock.requests))
+        self.mock.fail = False
+        prober.refresh()
+        self.assertTrue(prober.is_available())
+        self.assertTrue(prober.project_exists("fiepipe_gitasset_0"))
+
+
+if __name__ == '__main__':
+    unittest.main()
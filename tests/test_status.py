@@ -0,0 +1,132 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from fiepipelib.git.routines.status import parse_porcelain_v2, get_status
+
+_OID = "1" * 40
+_OID2 = "2" * 40
+
+
+def _ordinary(xy: str, path: str, sub: str = "N...") -> str:
+    return " ".join(["1", xy, sub, "100644", "100644", "100644", _OID, _OID2, path])
+
+
+def _renamed(xy: str, path: str, original: str) -> str:
+    # the original path is its own NUL separated field.
+    return " ".join(["2", xy, "N...", "100644", "100644", "100644", _OID, _OID2, "R100", path]) + "\0" + original
+
+
+def _unmerged(path: str) -> str:
+    return " ".join(["u", "UU", "N...", "100644", "100644", "100644", "100644", _OID, _OID2, _OID, path])
+
+
+def _status_output(*entries: str) -> str:
+    return "\0".join(entries) + "\0"
+
+
+class ParsePorcelainV2Tests(unittest.TestCase):
+
+    def test_clean(self):
+        status = parse_porcelain_v2(_status_output("# branch.oid " + _OID, "# branch.head master"))
+        self.assertFalse(status.is_dirty(untracked_files=True))
+        self.assertFalse(status.is_conflicted())
+        self.assertEqual("master", status.get_head_branch())
+        self.assertEqual(_OID, status.get_head_commit())
+        self.assertFalse(status.is_detached())
+
+    def test_empty_output(self):
+        status = parse_porcelain_v2("")
+        self.assertFalse(status.is_dirty(untracked_files=True))
+
+    def test_branch_headers(self):
+        status = parse_porcelain_v2(_status_output("# branch.oid " + _OID, "# branch.head local",
+                                                   "# branch.upstream origin/local", "# branch.ab +3 -12"))
+        self.assertEqual("origin/local", status.get_upstream())
+        self.assertEqual(3, status.get_commits_ahead())
+        self.assertEqual(12, status.get_commits_behind())
+
+    def test_initial_and_detached(self):
+        status = parse_porcelain_v2(_status_output("# branch.oid (initial)", "# branch.head (detached)"))
+        self.assertIsNone(status.get_head_commit())
+        self.assertTrue(status.is_detached())
+
+    def test_index_and_worktree(self):
+        status = parse_porcelain_v2(_status_output(_ordinary("M.", "staged.txt")))
+        self.assertTrue(status.is_index_dirty())
+        self.assertFalse(status.is_worktree_dirty())
+        status = parse_porcelain_v2(_status_output(_ordinary(".M", "changed.txt")))
+        self.assertFalse(status.is_index_dirty())
+        self.assertTrue(status.is_worktree_dirty())
+        self.assertTrue(status.is_dirty(index=False))
+        self.assertFalse(status.is_dirty(working_tree=False))
+
+    def test_paths_with_spaces(self):
+        status = parse_porcelain_v2(_status_output(_ordinary(".M", "a dir/a file.txt"), "? new dir/new file.txt"))
+        self.assertEqual(["new dir/new file.txt"], status.get_untracked())
+        self.assertEqual([("a dir/a file.txt", False)], status._worktree_changed)
+
+    def test_rename_consumes_original_path(self):
+        status = parse_porcelain_v2(_status_output(_renamed("R.", "new name.txt", "old name.txt"),
+                                                   "? untracked.txt"))
+        self.assertEqual([("new name.txt", False)], status._index_changed)
+        # the original path mustn't be mistaken for an entry of its own.
+        self.assertEqual(["untracked.txt"], status.get_untracked())
+        self.assertFalse(status.is_worktree_dirty())
+
+    def test_unmerged(self):
+        status = parse_porcelain_v2(_status_output(_unmerged("both.txt")))
+        self.assertTrue(status.is_conflicted())
+        self.assertEqual(["both.txt"], status.get_conflicted())
+        self.assertTrue(status.is_dirty())
+
+    def test_untracked_only_counts_when_asked(self):
+        status = parse_porcelain_v2(_status_output("? loose.txt"))
+        self.assertFalse(status.is_dirty())
+        self.assertTrue(status.is_dirty(untracked_files=True))
+
+    def test_submodules(self):
+        status = parse_porcelain_v2(_status_output(_ordinary(".M", "sub", "SC..")))
+        self.assertTrue(status.is_dirty())
+        self.assertFalse(status.is_dirty(submodules=False))
+        self.assertFalse(status.is_worktree_dirty(submodules=False))
+
+
+class GetStatusTests(unittest.TestCase):
+
+    def _git(self, cwd: str, *args: str):
+        subprocess.run(["git"] + list(args), cwd=cwd, check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, env=self.env)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.env = dict(os.environ)
+        self.env.update({"GIT_AUTHOR_NAME": "test", "GIT_AUTHOR_EMAIL": "test@example.com",
+                         "GIT_COMMITTER_NAME": "test", "GIT_COMMITTER_EMAIL": "test@example.com"})
+        self.sub = os.path.join(self.dir, "sub")
+        self.top = os.path.join(self.dir, "top")
+        os.makedirs(self.sub)
+        os.makedirs(self.top)
+        self._git(self.sub, "init", "-q")
+        self._git(self.sub, "commit", "-q", "--allow-empty", "-m", "sub")
+        self._git(self.top, "init", "-q")
+        self._git(self.top, "-c", "protocol.file.allow=always", "submodule", "add", "-q", self.sub, "sub")
+        self._git(self.top, "commit", "-q", "-m", "top")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_clean(self):
+        self.assertFalse(get_status(self.top, use_cache=False).is_dirty(untracked_files=True))
+
+    def test_ignores_submodules_when_asked(self):
+        with open(os.path.join(self.top, "sub", "inside.txt"), "w") as f:
+            f.write("change")
+        self.assertTrue(get_status(self.top, use_cache=False).is_dirty(untracked_files=True))
+        self.assertFalse(get_status(self.top, use_cache=False, submodules=False).is_dirty(untracked_files=True))
+
+
+if __name__ == '__main__':
+    unittest.main()